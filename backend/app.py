@@ -1,8 +1,9 @@
-import asyncio
+import functools
 import json
 import logging
+import time
 
-from flask import Flask, request, jsonify, Response, stream_with_context
+from flask import Flask, g, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 
 from healthbackend.services.user_profile_store import save_profile, get_profile
@@ -10,21 +11,66 @@ from healthbackend.services.orchestrator import (
     orchestrate,
     stream_agent_updates,  # NEW: import streaming helper
 )
+from healthbackend.services.admission import admission
+from healthbackend.services.background_loop import iterate_in_background, run_coroutine
 from healthbackend.services.history_store import get_history
-from healthbackend.utils.exceptions import AuthError, InputError, AgentError
+from healthbackend.services.intent import OFF_TOPIC_MESSAGE, is_health_query
+from healthbackend.services.memory import get_session_memory, history_budget
+from healthbackend.services import metrics
+from healthbackend.services.result_cache import result_cache
+from healthbackend.services.jobs import get_job_status, submit_job
+from healthbackend.utils.exceptions import AuthError, InputError, OverloadError
+from healthbackend.utils.request_id import (
+    HEADER as REQUEST_ID_HEADER,
+    install_log_record_factory,
+    set_request_id,
+)
 from healthbackend.services.user_auth_store import check_credentials, create_user
-from healthbackend.config.settings import GROQ_API_KEY, GROQ_MODEL_NAME, YOUTUBE_API_KEY
-from healthbackend.services.api_key_pool import get_next_key
+from healthbackend.config.settings import SPECULATIVE_INTENT, YOUTUBE_API_KEY
+from healthbackend.services.llm_calls import call_llm_sync
 from healthbackend.services.youtube_recommendations import YouTubeRecommendationService
-from langchain_openai import ChatOpenAI
 from langchain.schema import HumanMessage, SystemMessage
 
 
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})
-logging.basicConfig(level=logging.INFO)
+install_log_record_factory()
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s",
+)
 logger = logging.getLogger("healthbackend")
 
+_http_seconds = metrics.histogram(
+    "http_request_seconds",
+    "HTTP request duration until the response is closed (whole stream for SSE)",
+    ("route", "method", "status"),
+)
+
+
+# -------------------------
+# Request id + HTTP metrics
+# -------------------------
+@app.before_request
+def _start_request():
+    # Also bound for work scheduled on the background loop from this request
+    g.request_id = set_request_id(request.headers.get(REQUEST_ID_HEADER))
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def _finish_request(response):
+    response.headers[REQUEST_ID_HEADER] = g.request_id
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    started, method, status = g.request_started, request.method, str(response.status_code)
+    # Observed on close, so streamed responses are timed to their end
+    response.call_on_close(
+        lambda: _http_seconds.observe(
+            time.perf_counter() - started, route=route, method=method, status=status
+        )
+    )
+    return response
+
 
 # -------------------------
 # Error Handlers
@@ -39,105 +85,32 @@ def input_error(e):
     return jsonify({"error": str(e)}), 400
 
 
-# Intent Classification using LLM
-def _is_health_query(text: str) -> bool:
-    """LLM-based intent filter: allow only health/wellness related queries."""
-    if not text or not text.strip():
-        return False
+@app.errorhandler(OverloadError)
+def overload_error(e):
+    headers = {"Retry-After": str(e.retry_after)} if e.retry_after else {}
+    return jsonify({"error": str(e)}), e.status_code, headers
 
-    try:
-        # Use LLM to determine if the query is health-related
-        api_key = get_next_key()
-        llm = ChatOpenAI(
-            model=GROQ_MODEL_NAME,
-            openai_api_base="https://api.groq.com/openai/v1",
-            openai_api_key=api_key,
-            temperature=0,
-            max_tokens=10,
-        )
 
-        system_prompt = """You are an intent classifier. Determine if the user's query is related to health, wellness, medical symptoms, diet, fitness, mental health, or lifestyle.
+def _admitted(view):
+    """Run an LLM-bound view only once admission control grants it a slot."""
 
-Respond with ONLY "YES" if the query is health/wellness related.
-Respond with ONLY "NO" if the query is completely unrelated (e.g., technology, politics, entertainment, general knowledge).
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if admission is None:
+            return view(*args, **kwargs)
+        with admission.slot():
+            return view(*args, **kwargs)
 
-Health-related topics include: symptoms, diseases, pain, medical conditions, nutrition, diet, exercise, fitness, mental health, stress, sleep, lifestyle, medications, preventive care, body conditions (acne, skin issues, etc.)."""
+    return wrapper
 
-        user_prompt = f"Is this query health/wellness related?\n\nQuery: {text}"
 
-        messages = [
-            SystemMessage(content=system_prompt),
-            HumanMessage(content=user_prompt),
-        ]
-
-        response = llm.invoke(messages)
-        answer = response.content.strip().upper()
-
-        return "YES" in answer
-
-    except Exception as e:
-        # Fallback to keyword matching if LLM fails
-        t = text.lower()
-        health_keywords = [
-            "symptom",
-            "fever",
-            "cough",
-            "pain",
-            "headache",
-            "cold",
-            "flu",
-            "blood pressure",
-            "bp",
-            "sugar",
-            "diabetes",
-            "hypertension",
-            "cholesterol",
-            "heart",
-            "breath",
-            "breathing",
-            "asthma",
-            "diet",
-            "food",
-            "meal",
-            "nutrition",
-            "calorie",
-            "exercise",
-            "workout",
-            "walking",
-            "running",
-            "yoga",
-            "fitness",
-            "sleep",
-            "insomnia",
-            "snoring",
-            "stress",
-            "anxiety",
-            "depression",
-            "fatigue",
-            "tired",
-            "doctor",
-            "medicine",
-            "tablet",
-            "pill",
-            "health",
-            "wellness",
-            "weight",
-            "obesity",
-            "acne",
-            "pimples",
-            "skin",
-            "rash",
-            "allergy",
-            "itch",
-            "stomach",
-            "nausea",
-            "suffering",
-            "feel",
-            "sick",
-            "unwell",
-            "condition",
-        ]
-        return any(k in t for k in health_keywords)
+def _cache_bypassed(data: dict, cache_control: str = None) -> bool:
+    """True if the client asked for a fresh answer (`"no_cache": true` or Cache-Control: no-cache)."""
+    if data.get("no_cache"):
+        return True
+    if cache_control is None:
+        cache_control = request.headers.get("Cache-Control", "")
+    return "no-cache" in cache_control.lower()
 
 
 # -------------------------
@@ -182,6 +155,7 @@ def register():
 # Health Assist API
 # -------------------------
 @app.route("/health-assist", methods=["POST"])
+@_admitted
 def health_assist():
     data = request.get_json()
 
@@ -189,30 +163,71 @@ def health_assist():
         raise InputError("Symptoms required")
 
     symptoms = data["symptoms"].strip()
-    if not _is_health_query(symptoms):
+    # With SPECULATIVE_INTENT the orchestrator checks intent alongside the agents
+    if not SPECULATIVE_INTENT and not is_health_query(symptoms):
         return (
-            jsonify(
-                {
-                    "error": "This is a wellness specialized system. Please ask about symptoms, lifestyle, diet, exercise, or other health-related topics."
-                }
-            ),
+            jsonify({"error": OFF_TOPIC_MESSAGE}),
             400,
         )
 
-    result = asyncio.run(
+    result = run_coroutine(
         orchestrate(
             symptoms,
             data.get("medical_report"),
             data.get("user_id", "guest"),
+            session_id=data.get("session_id"),
+            use_cache=not _cache_bypassed(data),
+            check_intent=SPECULATIVE_INTENT,
         )
     )
     return jsonify(result)
 
 
+# -------------------------
+# Health Assist jobs (submit, then poll)
+# -------------------------
+def _job_request(data: dict, cache_control: str = None) -> dict:
+    """Validate a /health-assist/jobs body into orchestrate() arguments."""
+    if not data or not (data.get("symptoms") or "").strip():
+        raise InputError("Symptoms required")
+    return {
+        "symptoms": data["symptoms"].strip(),
+        "medical_report": data.get("medical_report"),
+        "user_id": data.get("user_id", "guest"),
+        "session_id": data.get("session_id"),
+        "use_cache": not _cache_bypassed(data, cache_control),
+    }
+
+
+@app.route("/health-assist/jobs", methods=["POST"])
+def submit_health_assist_job():
+    job_id = submit_job(_job_request(request.get_json(silent=True) or {}))
+    return (
+        jsonify(
+            {
+                "job_id": job_id,
+                "status": "queued",
+                "status_url": f"/health-assist/jobs/{job_id}",
+            }
+        ),
+        202,
+        {"Location": f"/health-assist/jobs/{job_id}"},
+    )
+
+
+@app.route("/health-assist/jobs/<job_id>", methods=["GET"])
+def health_assist_job(job_id):
+    job = get_job_status(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+
 # -------------------------
 # Recommendation API
 # -------------------------
 @app.route("/recommendations", methods=["POST"])
+@_admitted
 def recommendations_only():
     data = request.get_json() or {}
 
@@ -223,21 +238,21 @@ def recommendations_only():
     if not symptoms:
         raise InputError("Symptoms required")
 
-    if not _is_health_query(symptoms):
+    # With SPECULATIVE_INTENT the orchestrator checks intent alongside the agents
+    if not SPECULATIVE_INTENT and not is_health_query(symptoms):
         return (
-            jsonify(
-                {
-                    "error": "This is a wellness specialized system. Please ask about symptoms, lifestyle, diet, exercise, or other health-related topics."
-                }
-            ),
+            jsonify({"error": OFF_TOPIC_MESSAGE}),
             400,
         )
 
-    result = asyncio.run(
+    result = run_coroutine(
         orchestrate(
             symptoms,
             medical_report,
             user_id,
+            session_id=data.get("session_id"),
+            use_cache=not _cache_bypassed(data),
+            check_intent=SPECULATIVE_INTENT,
         )
     )
 
@@ -253,35 +268,47 @@ def recommendations_only():
 # Follow-up API (uses Groq)
 # -------------------------
 @app.route("/follow-up", methods=["POST"])
+@_admitted
 def follow_up():
     data = request.get_json() or {}
+    messages, session_memory, question = _build_follow_up(data)
+    answer = call_llm_sync(messages, "follow_up")
+    _remember_follow_up(session_memory, question, answer)
+    return jsonify({"answer": answer})
+
+
+def _build_follow_up(data: dict):
+    """
+    Validate a follow-up request and build its LLM messages.
+
+    Returns (messages, session memory or None, question); raises InputError.
+    Shared by the Flask view and the ASGI app.
+    """
     user_id = data.get("user_id")
     question = data.get("question", "").strip()
 
     if not user_id or not question:
-        return jsonify({"error": "user_id and question are required"}), 400
+        raise InputError("user_id and question are required")
 
     history = get_history(user_id) or []
     if not history:
-        return (
-            jsonify({"error": "No previous wellness session found for this user"}),
-            400,
-        )
+        raise InputError("No previous wellness session found for this user")
 
     last = history[-1]
 
+    # Reuse the agents' conversation if the session is still in memory
+    session_memory = get_session_memory(data.get("session_id"))
+    session_history = (
+        session_memory.chat_history(history_budget("follow_up"))
+        if session_memory is not None
+        else []
+    )
+
     context_text = (
         f"Previous wellness plan summary:\n{last.get('synthesized_guidance', '')}\n\n"
         f"Key recommendations:\n" + "\n".join(last.get("recommendations", []))
     )
 
-    llm = ChatOpenAI(
-        model=GROQ_MODEL_NAME,
-        api_key=get_next_key(),
-        base_url="https://api.groq.com/openai/v1",
-        temperature=0.0,
-    )
-
     messages = [
         SystemMessage(
             content=(
@@ -292,12 +319,20 @@ def follow_up():
                 "always remind the user to follow their doctor's advice."
             )
         ),
+        *session_history,
         HumanMessage(content=context_text),
         HumanMessage(content=f"User follow-up question: {question}"),
     ]
 
-    result = llm.invoke(messages)
-    return jsonify({"answer": result.content})
+    return messages, session_memory, question
+
+
+def _remember_follow_up(session_memory, question: str, answer: str) -> None:
+    if session_memory is not None:
+        session_memory.save_context(
+            {"input": f"[follow_up] {question}"},
+            {"output": answer},
+        )
 
 
 # -------------------------
@@ -319,37 +354,45 @@ def chat_stream():
     data = request.get_json() or {}
     symptoms = (data.get("symptoms") or "").strip()
     medical_report = data.get("medical_report", "")
+    session_id = data.get("session_id")
 
     if not symptoms:
         # SSE still needs a normal HTTP error if no symptoms
         return jsonify({"error": "Symptoms required"}), 400
 
-    if not _is_health_query(symptoms):
+    # The slot is held until the stream ends or the client disconnects
+    ticket = admission.acquire() if admission is not None else None
+    try:
+        response = app.make_response(_stream_response(symptoms, medical_report, session_id))
+    except BaseException:
+        if ticket is not None:
+            ticket.release()
+        raise
+    if ticket is not None:
+        response.call_on_close(ticket.release)
+    return response
+
+
+def _stream_response(symptoms: str, medical_report: str, session_id):
+    # With SPECULATIVE_INTENT the orchestrator checks intent alongside the agents
+    if not SPECULATIVE_INTENT and not is_health_query(symptoms):
         return (
-            jsonify(
-                {
-                    "error": "This is a wellness specialized system. Please ask about symptoms, lifestyle, diet, exercise, or other health-related topics."
-                }
-            ),
+            jsonify({"error": OFF_TOPIC_MESSAGE}),
             400,
         )
 
-    async def agen():
-        async for evt in stream_agent_updates(symptoms, medical_report):
-            yield f"data: {json.dumps(evt)}\n\n"
-
     def generate():
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        async_gen = agen()
+        # The stream runs on this worker's background event loop; closing
+        # this generator (client disconnected) cancels the agents' LLM calls
+        events = stream_agent_updates(
+            symptoms, medical_report, session_id, check_intent=SPECULATIVE_INTENT
+        )
+        stream = iterate_in_background(events)
         try:
-            while True:
-                chunk = loop.run_until_complete(async_gen.__anext__())
-                yield chunk
-        except StopAsyncIteration:
-            pass
+            for evt in stream:
+                yield f"data: {json.dumps(evt)}\n\n"
         finally:
-            loop.close()
+            stream.close()
 
     return Response(stream_with_context(generate()), mimetype="text/event-stream")
 
@@ -455,6 +498,34 @@ def get_youtube_recommendations():
         return jsonify({"error": f"Failed to get recommendations: {str(e)}"}), 500
 
 
+# -------------------------
+# Result cache stats
+# -------------------------
+@app.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    if result_cache is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **result_cache.stats()})
+
+
+# -------------------------
+# Prometheus metrics
+# -------------------------
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+# -------------------------
+# Admission control stats
+# -------------------------
+@app.route("/admission/stats", methods=["GET"])
+def admission_stats():
+    if admission is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **admission.stats()})
+
+
 @app.route("/", methods=["GET"])
 def welcome_health():
     return "Welcome to Health & Diet Care"
@@ -0,0 +1,291 @@
+"""
+ASGI entry point: serves the same API as `wsgi.py` from one long-lived
+event loop per worker.
+
+The LLM-bound routes (/health-assist, /recommendations, /follow-up,
+/chat_stream) are native async handlers, so a worker holds many concurrent
+orchestrations while they wait on the LLM. Every other route is served by
+the Flask app through a WSGI adapter (in a thread pool).
+
+Run with:
+    uvicorn healthbackend.asgi:app --workers 4
+or:
+    gunicorn -k uvicorn.workers.UvicornWorker healthbackend.asgi:app
+"""
+import asyncio
+import json
+import logging
+import time
+from contextlib import asynccontextmanager
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+from healthbackend.app import (
+    _build_follow_up,
+    _cache_bypassed,
+    _http_seconds,
+    _remember_follow_up,
+)
+from healthbackend.app import app as flask_app
+from healthbackend.config.settings import LLM_PREWARM, SPECULATIVE_INTENT
+from healthbackend.services.admission import admission
+from healthbackend.services.api_key_pool import get_next_key
+from healthbackend.services.intent import OFF_TOPIC_MESSAGE, ais_health_query, warm_intent_model
+from healthbackend.services.jobs import resume_orphaned_jobs
+from healthbackend.services.llm_calls import call_llm
+from healthbackend.services.llm_clients import prewarm_connections
+from healthbackend.services.orchestrator import orchestrate, stream_agent_updates
+from healthbackend.services.rag import knowledge_base
+from healthbackend.utils.exceptions import AuthError, InputError, OverloadError
+from healthbackend.utils.request_id import HEADER as REQUEST_ID_HEADER, set_request_id
+
+logger = logging.getLogger("healthbackend")
+
+_REQUEST_ID_KEY = REQUEST_ID_HEADER.lower().encode("latin-1")
+
+
+class RequestContextMiddleware:
+    """
+    Bind a request id (client's X-Request-ID or a new one) for logs and
+    return it in the response; time the native routes into the HTTP
+    histogram. Mounted Flask routes see the same id in their headers and
+    record their own timing.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = [(k, v) for k, v in scope["headers"] if k != _REQUEST_ID_KEY]
+        incoming = next(
+            (v.decode("latin-1") for k, v in scope["headers"] if k == _REQUEST_ID_KEY), None
+        )
+        request_id = set_request_id(incoming)
+        scope["headers"] = headers + [(_REQUEST_ID_KEY, request_id.encode("latin-1"))]
+        started = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                response_headers = list(message.get("headers", []))
+                if not any(k.lower() == _REQUEST_ID_KEY for k, _ in response_headers):
+                    response_headers.append((_REQUEST_ID_KEY, request_id.encode("latin-1")))
+                message = {**message, "headers": response_headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            route = _NATIVE_ROUTES.get(scope.get("endpoint"))
+            if route is not None:
+                _http_seconds.observe(
+                    time.perf_counter() - started,
+                    route=route,
+                    method=scope["method"],
+                    status=str(status["code"]),
+                )
+
+
+async def _json_body(request: Request) -> dict:
+    try:
+        data = await request.json()
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+@asynccontextmanager
+async def _admitted():
+    """Hold an admission-control slot for the block (no-op when disabled)."""
+    if admission is None:
+        yield
+        return
+    async with admission.aslot():
+        yield
+
+
+async def _run_orchestration(request: Request, data: dict, symptoms: str, medical_report, user_id: str):
+    """Intent check + orchestrate(); returns the result or an error response."""
+    # With SPECULATIVE_INTENT the orchestrator checks intent alongside the agents
+    if not SPECULATIVE_INTENT and not await ais_health_query(symptoms):
+        return JSONResponse({"error": OFF_TOPIC_MESSAGE}, status_code=400)
+
+    return await orchestrate(
+        symptoms,
+        medical_report,
+        user_id,
+        session_id=data.get("session_id"),
+        use_cache=not _cache_bypassed(data, request.headers.get("Cache-Control", "")),
+        check_intent=SPECULATIVE_INTENT,
+    )
+
+
+# -------------------------
+# Health Assist API
+# -------------------------
+async def health_assist(request: Request):
+    data = await _json_body(request)
+    if not data or "symptoms" not in data:
+        raise InputError("Symptoms required")
+
+    async with _admitted():
+        result = await _run_orchestration(
+            request,
+            data,
+            data["symptoms"].strip(),
+            data.get("medical_report"),
+            data.get("user_id", "guest"),
+        )
+    if isinstance(result, JSONResponse):
+        return result
+    return JSONResponse(result)
+
+
+# -------------------------
+# Recommendation API
+# -------------------------
+async def recommendations_only(request: Request):
+    data = await _json_body(request)
+    symptoms = (data.get("symptoms") or "").strip()
+    if not symptoms:
+        raise InputError("Symptoms required")
+
+    async with _admitted():
+        result = await _run_orchestration(
+            request,
+            data,
+            symptoms,
+            data.get("medical_report", ""),
+            data.get("user_id", "guest"),
+        )
+    if isinstance(result, JSONResponse):
+        return result
+    return JSONResponse(
+        {
+            "query": symptoms,
+            "recommendations": result.get("recommendations", []),
+        }
+    )
+
+
+# -------------------------
+# Follow-up API
+# -------------------------
+async def follow_up(request: Request):
+    data = await _json_body(request)
+    # History file read: keep it off the event loop
+    messages, session_memory, question = await asyncio.to_thread(_build_follow_up, data)
+    async with _admitted():
+        answer = await call_llm(messages, "follow_up")
+    _remember_follow_up(session_memory, question, answer)
+    return JSONResponse({"answer": answer})
+
+
+# -------------------------
+# Streaming endpoint (Server-Sent Events)
+# -------------------------
+async def chat_stream(request: Request):
+    data = await _json_body(request)
+    symptoms = (data.get("symptoms") or "").strip()
+    medical_report = data.get("medical_report", "")
+    session_id = data.get("session_id")
+
+    if not symptoms:
+        return JSONResponse({"error": "Symptoms required"}, status_code=400)
+
+    # The slot is held until the stream ends or the client disconnects
+    ticket = await admission.aacquire() if admission is not None else None
+    release = ticket.release if ticket is not None else (lambda: None)
+    try:
+        if not SPECULATIVE_INTENT and not await ais_health_query(symptoms):
+            release()
+            return JSONResponse({"error": OFF_TOPIC_MESSAGE}, status_code=400)
+    except BaseException:
+        release()
+        raise
+
+    async def generate():
+        # Starlette cancels this generator when the client disconnects
+        try:
+            async for evt in stream_agent_updates(
+                symptoms, medical_report, session_id, check_intent=SPECULATIVE_INTENT
+            ):
+                yield f"data: {json.dumps(evt)}\n\n"
+        finally:
+            release()
+
+    # Also released if the generator never starts (release is idempotent)
+    return StreamingResponse(
+        generate(), media_type="text/event-stream", background=BackgroundTask(release)
+    )
+
+
+# -------------------------
+# Error Handlers
+# -------------------------
+async def auth_error(request: Request, exc: AuthError):
+    return JSONResponse({"error": str(exc)}, status_code=401)
+
+
+async def input_error(request: Request, exc: InputError):
+    return JSONResponse({"error": str(exc)}, status_code=400)
+
+
+async def overload_error(request: Request, exc: OverloadError):
+    headers = {"Retry-After": str(exc.retry_after)} if exc.retry_after else None
+    return JSONResponse({"error": str(exc)}, status_code=exc.status_code, headers=headers)
+
+
+@asynccontextmanager
+async def lifespan(_app):
+    # Each worker warms its own connection pool
+    if LLM_PREWARM:
+        await asyncio.to_thread(prewarm_connections, get_next_key())
+    # Load the knowledge base index now rather than on the first request
+    await asyncio.to_thread(knowledge_base.snapshot)
+    # Train the local intent model off the event loop
+    await asyncio.to_thread(warm_intent_model)
+    # Job routes are served by Flask; resume jobs a stopped worker left behind
+    await asyncio.to_thread(resume_orphaned_jobs, True)
+    yield
+
+
+_NATIVE = [
+    Route("/health-assist", health_assist, methods=["POST"]),
+    Route("/recommendations", recommendations_only, methods=["POST"]),
+    Route("/follow-up", follow_up, methods=["POST"]),
+    Route("/chat_stream", chat_stream, methods=["POST"]),
+]
+# Endpoint -> route label for the HTTP metrics
+_NATIVE_ROUTES = {route.endpoint: route.path for route in _NATIVE}
+
+app = Starlette(
+    routes=[
+        *_NATIVE,
+        # Everything else (auth, profile, history, jobs, metrics, YouTube, stats) stays in Flask
+        Mount("/", app=WSGIMiddleware(flask_app)),
+    ],
+    middleware=[
+        Middleware(RequestContextMiddleware),
+        Middleware(
+            CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"]
+        ),
+    ],
+    exception_handlers={
+        AuthError: auth_error,
+        InputError: input_error,
+        OverloadError: overload_error,
+    },
+    lifespan=lifespan,
+)
@@ -9,4 +9,130 @@ load_dotenv(dotenv_path=_ENV_PATH)
 # API_KEY = os.getenv("API_KEY")
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 GROQ_MODEL_NAME = os.getenv("GROQ_MODEL_NAME", "llama-3.3-70b-versatile")
+# OpenAI-compatible endpoint for every LLM call; point it at the local stand-in
+# (python -m healthbackend.tools.fake_llm_server) to run without Groq
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "https://api.groq.com/openai/v1").rstrip("/")
 YOUTUBE_API_KEY = os.getenv("YOUTUBE_API_KEY")
+
+# Session memory: how many recent sessions to keep for follow-up questions
+SESSION_MEMORY_MAX_SESSIONS = int(os.getenv("SESSION_MEMORY_MAX_SESSIONS", "256"))
+
+# Agent context: per-agent history token budgets ("diet_agent=1200,synthesizer=3000")
+AGENT_HISTORY_TOKEN_BUDGET = int(os.getenv("AGENT_HISTORY_TOKEN_BUDGET", "1500"))
+AGENT_HISTORY_TOKEN_BUDGETS = dict(
+    (name.strip(), int(value))
+    for name, _, value in (
+        item.partition("=")
+        for item in os.getenv(
+            "AGENT_HISTORY_TOKEN_BUDGETS", "synthesizer=3000,follow_up=2000"
+        ).split(",")
+    )
+    if value
+)
+MEMORY_MAX_INPUT_CHARS = int(os.getenv("MEMORY_MAX_INPUT_CHARS", "240"))
+MEMORY_SUMMARY_SENTENCES = int(os.getenv("MEMORY_SUMMARY_SENTENCES", "2"))
+
+# LLM HTTP connection pooling (shared by every API key)
+LLM_POOL_MAX_CONNECTIONS = int(os.getenv("LLM_POOL_MAX_CONNECTIONS", "100"))
+LLM_POOL_MAX_KEEPALIVE = int(os.getenv("LLM_POOL_MAX_KEEPALIVE", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+LLM_HTTP_TIMEOUT = float(os.getenv("LLM_HTTP_TIMEOUT", "60"))
+# Open keep-alive connections when a worker starts (set LLM_PREWARM=1)
+LLM_PREWARM = os.getenv("LLM_PREWARM", "0").lower() in ("1", "true", "yes")
+LLM_PREWARM_CONNECTIONS = int(os.getenv("LLM_PREWARM_CONNECTIONS", "2"))
+
+# Orchestration result cache (exact + near-duplicate symptom queries)
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "1").lower() in ("1", "true", "yes")
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "1024"))
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("RESULT_CACHE_TTL_SECONDS", "3600"))
+# Cosine similarity needed for a near-duplicate hit (1.0 = exact matches only)
+RESULT_CACHE_SIMILARITY = float(os.getenv("RESULT_CACHE_SIMILARITY", "0.92"))
+
+# Disk-backed memo of deterministic (temperature 0) LLM replies, shared by workers
+LLM_MEMO_ENABLED = os.getenv("LLM_MEMO_ENABLED", "1").lower() in ("1", "true", "yes")
+LLM_MEMO_PATH = os.getenv("LLM_MEMO_PATH", "healthbackend/storage/llm_memo.sqlite3")
+LLM_MEMO_MAX_BYTES = int(os.getenv("LLM_MEMO_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Intent filter: local model score thresholds (log-odds) and decision cache size.
+# Scores between the thresholds are escalated to the LLM.
+INTENT_YES_THRESHOLD = float(os.getenv("INTENT_YES_THRESHOLD", "1.0"))
+INTENT_NO_THRESHOLD = float(os.getenv("INTENT_NO_THRESHOLD", "-1.0"))
+INTENT_CACHE_SIZE = int(os.getenv("INTENT_CACHE_SIZE", "4096"))
+# How often (seconds) the history file is checked to retrain the local model;
+# retraining runs in the background
+INTENT_RETRAIN_INTERVAL = float(os.getenv("INTENT_RETRAIN_INTERVAL", "300"))
+
+# Run the intent check concurrently with the agents instead of before them
+SPECULATIVE_INTENT = os.getenv("SPECULATIVE_INTENT", "0").lower() in ("1", "true", "yes")
+
+# LLM call layer: retries with jittered exponential backoff within a deadline
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "4"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_CAP = float(os.getenv("LLM_BACKOFF_CAP", "8"))
+LLM_CALL_DEADLINE = float(os.getenv("LLM_CALL_DEADLINE", "90"))
+# Hedged requests: duplicate a call on another key once it is slower than
+# the given latency percentile for its kind (set LLM_HEDGE=1)
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE", "0").lower() in ("1", "true", "yes")
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "1.0"))
+
+# Groq API key scheduler: per-key limits (refined from x-ratelimit-* headers),
+# concurrent calls per key, and how long a call may wait for a free key
+GROQ_RPM_LIMIT = int(os.getenv("GROQ_RPM_LIMIT", "30"))
+GROQ_TPM_LIMIT = int(os.getenv("GROQ_TPM_LIMIT", "12000"))
+GROQ_MAX_IN_FLIGHT_PER_KEY = int(os.getenv("GROQ_MAX_IN_FLIGHT_PER_KEY", "4"))
+KEY_ACQUIRE_TIMEOUT = float(os.getenv("KEY_ACQUIRE_TIMEOUT", "30"))
+# Completion tokens reserved per call when max_tokens is not set
+LLM_COMPLETION_TOKEN_ESTIMATE = int(os.getenv("LLM_COMPLETION_TOKEN_ESTIMATE", "600"))
+# Where key-pool state lives: "sqlite" (shared by all workers on the node) or "memory"
+KEY_POOL_BACKEND = os.getenv("KEY_POOL_BACKEND", "sqlite").lower()
+KEY_POOL_PATH = os.getenv("KEY_POOL_PATH", "healthbackend/storage/key_pool.sqlite3")
+
+# Coalesce concurrent identical orchestrations / streams into one run
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "1").lower() in ("1", "true", "yes")
+
+# Events buffered between the background event loop and a /chat_stream response
+STREAM_QUEUE_SIZE = int(os.getenv("STREAM_QUEUE_SIZE", "64"))
+
+# Background /health-assist jobs: concurrent runs per worker, queue bound,
+# store location and how long finished jobs stay pollable (seconds)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_MAX_QUEUED = int(os.getenv("JOB_MAX_QUEUED", "100"))
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", "healthbackend/storage/jobs.sqlite3")
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", "86400"))
+# A worker that has not renewed its heartbeat for this long loses its
+# unfinished jobs to other workers (seconds)
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "30"))
+
+# Admission control for the LLM-bound routes, per worker: requests running at
+# once (0 disables), requests allowed to wait, and how long they may wait (s)
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "16"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "15"))
+
+# RAG knowledge base (JSON list of {"title", "content"}) and how often its
+# mtime is checked for changes (seconds)
+KB_PATH = os.getenv(
+    "KB_PATH", str(Path(__file__).resolve().parents[1] / "storage" / "knowledge.json")
+)
+KB_RELOAD_INTERVAL = float(os.getenv("KB_RELOAD_INTERVAL", "2"))
+# Prebuilt index written by tools/kb_ingest.py; when set it replaces KB_PATH
+KB_INDEX_DIR = os.getenv("KB_INDEX_DIR", "")
+
+# Retrieval mode: "lexical" (BM25), "dense" (hashed n-gram vectors) or "hybrid"
+RAG_MODE = os.getenv("RAG_MODE", "lexical").lower()
+RAG_EMBED_DIM = int(os.getenv("RAG_EMBED_DIM", "256"))
+# Weight of the dense score in hybrid mode (the rest goes to normalized BM25)
+RAG_HYBRID_ALPHA = float(os.getenv("RAG_HYBRID_ALPHA", "0.5"))
+# Dense-only matches below this cosine similarity are not returned
+RAG_DENSE_MIN_SCORE = float(os.getenv("RAG_DENSE_MIN_SCORE", "0.2"))
+# Memory-mapped document vectors, one file per knowledge base version
+RAG_VECTOR_DIR = os.getenv(
+    "RAG_VECTOR_DIR", str(Path(__file__).resolve().parents[1] / "storage" / "kb_vectors")
+)
+# Dense index: "flat" (exact scan) or "ivf" (k-means inverted lists; scans
+# RAG_IVF_NPROBE of RAG_IVF_NLIST lists, 0 = about 4 * sqrt(documents))
+RAG_INDEX_TYPE = os.getenv("RAG_INDEX_TYPE", "flat").lower()
+RAG_IVF_NLIST = int(os.getenv("RAG_IVF_NLIST", "0"))
+RAG_IVF_NPROBE = int(os.getenv("RAG_IVF_NPROBE", "8"))
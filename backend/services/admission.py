@@ -0,0 +1,286 @@
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Deque, Dict, Optional
+
+from healthbackend.config.settings import (
+    ADMISSION_MAX_CONCURRENT,
+    ADMISSION_MAX_QUEUE,
+    ADMISSION_QUEUE_TIMEOUT,
+)
+from healthbackend.services.metrics import histogram, register_collector
+from healthbackend.utils.exceptions import OverloadError
+
+# Recent queue waits kept for the percentile stats
+_WAIT_SAMPLES = 1024
+# Bounds of the Retry-After hint (seconds)
+_MIN_RETRY_AFTER = 1
+_MAX_RETRY_AFTER = 60
+
+_wait_seconds = histogram(
+    "admission_wait_seconds", "Time requests spent queued for an admission slot", ("outcome",)
+)
+
+
+class _Waiter:
+    """A queued request: a thread (event) or a coroutine (future on its loop)."""
+
+    __slots__ = ("event", "loop", "future", "granted")
+
+    def __init__(self, event=None, loop=None, future=None):
+        self.event = event
+        self.loop = loop
+        self.future = future
+        self.granted = False
+
+
+class Ticket:
+    """An admitted request; `release()` frees its slot (idempotent)."""
+
+    def __init__(self, controller: "AdmissionController"):
+        self._controller = controller
+        self._started = time.monotonic()
+        self._released = False
+        self._lock = threading.Lock()
+
+    def release(self) -> None:
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self._controller._release(time.monotonic() - self._started)
+
+
+# ------------------------------------------------------------
+# Admission control
+# ------------------------------------------------------------
+class AdmissionController:
+    """
+    Concurrency limit plus bounded FIFO wait queue for LLM-bound requests.
+
+    At most `max_concurrent` requests run at once per worker; up to
+    `max_queue` more wait (at most `queue_timeout` seconds) for a slot. When
+    the queue is full, requests are turned away at once with 429; requests
+    that wait too long get 503. Both carry a Retry-After hint derived from
+    the recent service time, so a traffic spike is shed before it becomes a
+    flood of Groq calls, rate-limit errors and key cooldowns.
+
+    Works for threads (Flask) and coroutines (ASGI) alike: a freed slot is
+    handed directly to the oldest waiter, whichever kind it is.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = ADMISSION_MAX_CONCURRENT,
+        max_queue: int = ADMISSION_MAX_QUEUE,
+        queue_timeout: float = ADMISSION_QUEUE_TIMEOUT,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._queue: Deque[_Waiter] = deque()
+        # Moving average of how long an admitted request holds its slot
+        self._service_time = 5.0
+        self._waits: Deque[float] = deque(maxlen=_WAIT_SAMPLES)
+        self._stats = {
+            "admitted": 0,
+            "queued_total": 0,
+            "rejected_queue_full": 0,
+            "rejected_timeout": 0,
+            "wait_seconds_total": 0.0,
+        }
+
+    # ---- acquire -------------------------------------------------------
+    def _try_admit(self) -> bool:
+        # Caller holds the lock; never jump ahead of queued requests
+        if self._in_flight < self.max_concurrent and not self._queue:
+            self._in_flight += 1
+            self._stats["admitted"] += 1
+            self._waits.append(0.0)
+            _wait_seconds.observe(0.0, outcome="admitted")
+            return True
+        if len(self._queue) >= self.max_queue:
+            self._stats["rejected_queue_full"] += 1
+            raise OverloadError(
+                "Server is busy, please retry shortly",
+                retry_after=self._retry_after(),
+                status_code=429,
+            )
+        return False
+
+    def acquire(self) -> Ticket:
+        """Block until admitted; raises OverloadError (queue full / timed out)."""
+        with self._lock:
+            if self._try_admit():
+                return Ticket(self)
+            waiter = _Waiter(event=threading.Event())
+            self._enqueue(waiter)
+
+        started = time.monotonic()
+        waiter.event.wait(self.queue_timeout)
+        self._admitted_or_timeout(waiter, started)
+        return Ticket(self)
+
+    async def aacquire(self) -> Ticket:
+        """Async acquire; waits without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._try_admit():
+                return Ticket(self)
+            waiter = _Waiter(loop=loop, future=loop.create_future())
+            self._enqueue(waiter)
+
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            # Client went away while queued; give back a slot handed to us
+            if not self._abandon(waiter):
+                self._release(None)
+            raise
+        self._admitted_or_timeout(waiter, started)
+        return Ticket(self)
+
+    def _enqueue(self, waiter: _Waiter) -> None:
+        # Caller holds the lock
+        self._queue.append(waiter)
+        self._stats["queued_total"] += 1
+
+    def _abandon(self, waiter: _Waiter) -> bool:
+        """Drop a waiter from the queue; False if it was already granted a slot."""
+        with self._lock:
+            if waiter.granted:
+                return False
+            self._queue.remove(waiter)
+            return True
+
+    def _admitted_or_timeout(self, waiter: _Waiter, started: float) -> None:
+        waited = time.monotonic() - started
+        with self._lock:
+            self._waits.append(waited)
+            self._stats["wait_seconds_total"] += waited
+            if waiter.granted:
+                self._stats["admitted"] += 1
+                _wait_seconds.observe(waited, outcome="admitted")
+                return
+            self._queue.remove(waiter)
+            self._stats["rejected_timeout"] += 1
+            _wait_seconds.observe(waited, outcome="timeout")
+            retry_after = self._retry_after()
+        raise OverloadError(
+            "Server is busy, please retry shortly", retry_after=retry_after, status_code=503
+        )
+
+    # ---- release -------------------------------------------------------
+    def _release(self, service_time: Optional[float]) -> None:
+        with self._lock:
+            if service_time is not None:
+                self._service_time = 0.8 * self._service_time + 0.2 * service_time
+            # Hand the slot straight to the oldest live waiter
+            while self._queue:
+                waiter = self._queue.popleft()
+                waiter.granted = True
+                if waiter.event is not None:
+                    waiter.event.set()
+                    return
+                try:
+                    waiter.loop.call_soon_threadsafe(_grant, waiter.future)
+                    return
+                except RuntimeError:
+                    # Its event loop is closed; nobody is waiting there any more
+                    continue
+            self._in_flight -= 1
+
+    def _retry_after(self) -> int:
+        # Caller holds the lock: time for the queue ahead to drain
+        estimate = self._service_time * (len(self._queue) + 1) / max(self.max_concurrent, 1)
+        return int(min(_MAX_RETRY_AFTER, max(_MIN_RETRY_AFTER, math.ceil(estimate))))
+
+    # ---- helpers -------------------------------------------------------
+    @contextmanager
+    def slot(self):
+        """`with admission.slot():` hold a slot for the block (sync)."""
+        ticket = self.acquire()
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+    @asynccontextmanager
+    async def aslot(self):
+        """`async with admission.aslot():` hold a slot for the block."""
+        ticket = await self.aacquire()
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            waits = sorted(self._waits)
+            return {
+                **self._stats,
+                "in_flight": self._in_flight,
+                "queue_depth": len(self._queue),
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue,
+                "avg_service_seconds": round(self._service_time, 3),
+                "wait_p50_seconds": round(_percentile(waits, 50), 4),
+                "wait_p95_seconds": round(_percentile(waits, 95), 4),
+                "wait_max_seconds": round(waits[-1], 4) if waits else 0.0,
+            }
+
+
+def _grant(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+def _percentile(sorted_values, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))
+    return sorted_values[idx]
+
+
+# Per-worker controller for the LLM-bound routes (None when disabled)
+admission: Optional[AdmissionController] = (
+    AdmissionController() if ADMISSION_MAX_CONCURRENT > 0 else None
+)
+
+
+def _collect_metrics():
+    if admission is None:
+        return
+    stats = admission.stats()
+    yield (
+        "admission_in_flight",
+        "gauge",
+        "Requests holding an admission slot",
+        [({}, stats["in_flight"])],
+    )
+    yield (
+        "admission_queue_depth",
+        "gauge",
+        "Requests waiting for an admission slot",
+        [({}, stats["queue_depth"])],
+    )
+    yield (
+        "admission_rejected_total",
+        "counter",
+        "Requests turned away by admission control",
+        [
+            ({"reason": "queue_full"}, stats["rejected_queue_full"]),
+            ({"reason": "timeout"}, stats["rejected_timeout"]),
+        ],
+    )
+
+
+register_collector(_collect_metrics)
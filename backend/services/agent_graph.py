@@ -0,0 +1,153 @@
+import asyncio
+import functools
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+
+class AgentNode:
+    """
+    One agent in the orchestration graph.
+
+    Args:
+        name: Unique node name; the agent's output is stored under this key.
+        label: Human readable name used in `agent_flow` (e.g. "Diet Agent").
+        func: Async callable that runs the agent.
+        args: Mapping of keyword argument -> source. A source is either the
+            name of another node (its output is passed in, which makes that
+            node a dependency) or the name of a pipeline input.
+        after: Extra node names that must finish first even though their
+            output is not passed as an argument (ordering-only edges).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        label: str,
+        func: Callable[..., Awaitable[Any]],
+        args: Optional[Dict[str, str]] = None,
+        after: Iterable[str] = (),
+    ):
+        self.name = name
+        self.label = label
+        self.func = func
+        self.args = dict(args or {})
+        self.after = tuple(after)
+
+    def bind(self, **kwargs) -> "AgentNode":
+        """Return a copy of this node whose agent is always called with `kwargs`."""
+        return AgentNode(
+            self.name,
+            self.label,
+            functools.partial(self.func, **kwargs),
+            self.args,
+            self.after,
+        )
+
+    def dependencies(self, node_names) -> set:
+        """Return the names of nodes that must complete before this one starts."""
+        deps = {src for src in self.args.values() if src in node_names}
+        deps.update(self.after)
+        return deps
+
+
+def validate_graph(nodes: List[AgentNode]) -> None:
+    """Raise ValueError if the graph has duplicate names, unknown edges or a cycle."""
+    names = [n.name for n in nodes]
+    if len(names) != len(set(names)):
+        raise ValueError("Agent graph has duplicate node names")
+
+    name_set = set(names)
+    for node in nodes:
+        unknown = set(node.after) - name_set
+        if unknown:
+            raise ValueError(f"{node.name} depends on unknown nodes: {sorted(unknown)}")
+
+    # Kahn's algorithm: if we cannot drain every node, there is a cycle
+    remaining = {n.name: n.dependencies(name_set) for n in nodes}
+    while remaining:
+        ready = [name for name, deps in remaining.items() if not deps]
+        if not ready:
+            raise ValueError(f"Agent graph has a cycle among: {sorted(remaining)}")
+        for name in ready:
+            del remaining[name]
+        for deps in remaining.values():
+            deps.difference_update(ready)
+
+
+async def run_agent_graph(
+    nodes: List[AgentNode],
+    inputs: Dict[str, Any],
+    on_agent_start: Optional[Callable[[AgentNode], None]] = None,
+    on_agent_done: Optional[Callable[[AgentNode, Dict[str, Any]], None]] = None,
+) -> tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """
+    Run every agent as soon as all of its dependencies have finished.
+
+    Independent agents run concurrently on the current event loop, so the
+    end-to-end latency is the critical path of the graph instead of the sum
+    of all agent calls.
+
+    Returns:
+        (results, agent_flow): `results` maps node name -> agent output and
+        `agent_flow` lists one entry per agent (in declaration order) with
+        its output and `started_at` / `finished_at` epoch timestamps.
+        If any agent fails, the agents still running are cancelled and the
+        error is re-raised.
+
+        `on_agent_start(node)` / `on_agent_done(node, flow_entry)` are
+        optional hooks called as agents start and finish.
+    """
+    validate_graph(nodes)
+    name_set = {n.name for n in nodes}
+    deps = {n.name: n.dependencies(name_set) for n in nodes}
+
+    results: Dict[str, Any] = {}
+    flow: Dict[str, Dict[str, Any]] = {}
+    pending = list(nodes)
+    running: Dict[asyncio.Task, AgentNode] = {}
+
+    try:
+        while pending or running:
+            # Start every node whose dependencies are satisfied
+            for node in list(pending):
+                if not deps[node.name].issubset(results):
+                    continue
+                pending.remove(node)
+                kwargs = {
+                    arg: results[src] if src in name_set else inputs[src]
+                    for arg, src in node.args.items()
+                }
+                flow[node.name] = {
+                    "agent": node.label,
+                    "started_at": round(time.time(), 3),
+                }
+                task = asyncio.create_task(node.func(**kwargs))
+                running[task] = node
+                if on_agent_start is not None:
+                    on_agent_start(node)
+
+            done, _ = await asyncio.wait(
+                running.keys(), return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                node = running.pop(task)
+                result = task.result()
+                results[node.name] = result
+
+                entry = flow[node.name]
+                entry["output"] = result
+                entry["finished_at"] = round(time.time(), 3)
+                entry["duration_ms"] = int(
+                    (entry["finished_at"] - entry["started_at"]) * 1000
+                )
+                if on_agent_done is not None:
+                    on_agent_done(node, entry)
+    finally:
+        # On failure (or cancellation of the caller) do not leave agents running
+        for task in running:
+            task.cancel()
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+
+    agent_flow = [flow[n.name] for n in nodes]
+    return results, agent_flow
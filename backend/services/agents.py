@@ -1,51 +1,28 @@
-from langchain_openai import ChatOpenAI
+from typing import Optional
+
 from langchain.schema import HumanMessage, SystemMessage
 
-from healthbackend.config.settings import GROQ_MODEL_NAME
-from healthbackend.services.memory import get_shared_memory
+from healthbackend.services.llm_calls import TokenCallback, call_llm
+from healthbackend.services.memory import SessionMemory, history_budget
 from healthbackend.services.rag import retrieve_context
-from healthbackend.services.api_key_pool import get_next_key, mark_key_quota_exceeded
-
-
-def _make_llm_with_key():
-    """
-    Create a Grok chat model using the next available API key.
-
-    Returns:
-        tuple[ChatOpenAI, str]: (llm instance, api_key used)
-    """
-    # Pick the next key from the pool (handles round‑robin and cooldown logic)
-    api_key = get_next_key()
-
-    # Instantiate the Grok chat model with that key (OpenAI‑compatible)
-    llm = ChatOpenAI(
-        model=GROQ_MODEL_NAME,          # e.g. "grok-3" or "grok-3-fast"
-        api_key=api_key,
-        base_url="https://api.groq.com/openai/v1",
-        temperature=0.0,
-    )
-    return llm, api_key
-
-
-def _memory():
-    """
-    Convenience wrapper to get the shared conversation memory object.
-    All agents write into the same buffer so they can see each other’s outputs.
-    """
-    return get_shared_memory()
 
 
 # ------------------------------------------------------------
 # SYMPTOM AGENT
 # ------------------------------------------------------------
-async def symptom_agent(symptoms: str) -> str:
+async def symptom_agent(
+    symptoms: str,
+    memory: SessionMemory,
+    on_token: Optional[TokenCallback] = None,
+) -> str:
     """
     Analyze raw symptoms and comment on possible severity / urgency.
     Does NOT diagnose; only suggests when to see a doctor or seek emergency care.
+    `memory` is the session memory shared by the agents of one orchestration;
+    `on_token` (optional) receives the reply chunks as they stream in.
     """
-    memory = _memory()
     # Load previous messages so this agent can see context from other agents
-    history = memory.load_memory_variables({})["chat_history"]
+    history = memory.chat_history(history_budget("symptom_agent"))
 
     # System prompt describes the role and strict safety constraints
     messages = [
@@ -62,32 +39,28 @@ async def symptom_agent(symptoms: str) -> str:
         )
     ]
 
-    llm, key = _make_llm_with_key()
-    try:
-        result = await llm.ainvoke(messages)
-    except Exception:
-        # This key may have hit quota or another hard failure → mark & retry once
-        mark_key_quota_exceeded(key)
-        llm, key = _make_llm_with_key()
-        result = await llm.ainvoke(messages)
+    result = await call_llm(messages, "symptom_agent", on_token=on_token)
 
     memory.save_context(
         {"input": f"[symptom_agent] {symptoms}"},
-        {"output": result.content},
+        {"output": result},
     )
-    return result.content
+    return result
 
 
 # ------------------------------------------------------------
 # LIFESTYLE AGENT
 # ------------------------------------------------------------
-async def lifestyle_agent(symptoms: str) -> str:
+async def lifestyle_agent(
+    symptoms: str,
+    memory: SessionMemory,
+    on_token: Optional[TokenCallback] = None,
+) -> str:
     """
     Suggest lifestyle adjustments (sleep, stress, routine) based on symptoms
     and conversation context. Keeps suggestions generic and safe.
     """
-    memory = _memory()
-    history = memory.load_memory_variables({})["chat_history"]
+    history = memory.chat_history(history_budget("lifestyle_agent"))
 
     prompt = (
         f"Given the conversation so far and these symptoms: {symptoms}, "
@@ -104,25 +77,25 @@ async def lifestyle_agent(symptoms: str) -> str:
         ),
     ] + history + [HumanMessage(content=prompt)]
 
-    llm, key = _make_llm_with_key()
-    try:
-        result = await llm.ainvoke(messages)
-    except Exception:
-        mark_key_quota_exceeded(key)
-        llm, key = _make_llm_with_key()
-        result = await llm.ainvoke(messages)
+    result = await call_llm(messages, "lifestyle_agent", on_token=on_token)
 
     memory.save_context(
-        {"input": f"[lifestyle_agent] {prompt}"},
-        {"output": result.content},
+        {"input": f"[lifestyle_agent] {symptoms}"},
+        {"output": result},
     )
-    return result.content
+    return result
 
 
 # ------------------------------------------------------------
 # DIET AGENT
 # ------------------------------------------------------------
-async def diet_agent(symptoms: str, report: str, lifestyle_notes: str) -> str:
+async def diet_agent(
+    symptoms: str,
+    report: str,
+    lifestyle_notes: str,
+    memory: SessionMemory,
+    on_token: Optional[TokenCallback] = None,
+) -> str:
     """
     Propose a safe, balanced diet plan using:
       - user symptoms
@@ -131,8 +104,7 @@ async def diet_agent(symptoms: str, report: str, lifestyle_notes: str) -> str:
       - retrieved snippets from local knowledge base (RAG)
     The guidance is strictly non‑diagnostic and non‑prescriptive.
     """
-    memory = _memory()
-    history = memory.load_memory_variables({})["chat_history"]
+    history = memory.chat_history(history_budget("diet_agent"))
 
     kb = retrieve_context(symptoms)
 
@@ -154,33 +126,31 @@ async def diet_agent(symptoms: str, report: str, lifestyle_notes: str) -> str:
         ),
     ] + history + [HumanMessage(content=prompt)]
 
-    llm, key = _make_llm_with_key()
-    try:
-        result = await llm.ainvoke(messages)
-    except Exception:
-        mark_key_quota_exceeded(key)
-        llm, key = _make_llm_with_key()
-        result = await llm.ainvoke(messages)
+    result = await call_llm(messages, "diet_agent", on_token=on_token)
 
     memory.save_context(
-        {"input": f"[diet_agent] {prompt}"},
-        {"output": result.content},
+        {"input": f"[diet_agent] {symptoms}"},
+        {"output": result},
     )
-    return result.content
+    return result
 
 
 # ------------------------------------------------------------
 # FITNESS AGENT
 # ------------------------------------------------------------
-async def fitness_agent(symptoms: str, diet_notes: str) -> str:
+async def fitness_agent(
+    symptoms: str,
+    diet_notes: str,
+    memory: SessionMemory,
+    on_token: Optional[TokenCallback] = None,
+) -> str:
     """
     Recommend gentle, low‑risk physical activities that respect
     both the symptoms and the diet constraints.
     Always reminds the user to stop if they feel discomfort and to
     consult a doctor before more intense exercise.
     """
-    memory = _memory()
-    history = memory.load_memory_variables({})["chat_history"]
+    history = memory.chat_history(history_budget("fitness_agent"))
 
     prompt = (
         f"User symptoms: {symptoms}\n"
@@ -199,16 +169,10 @@ async def fitness_agent(symptoms: str, diet_notes: str) -> str:
         ),
     ] + history + [HumanMessage(content=prompt)]
 
-    llm, key = _make_llm_with_key()
-    try:
-        result = await llm.ainvoke(messages)
-    except Exception:
-        mark_key_quota_exceeded(key)
-        llm, key = _make_llm_with_key()
-        result = await llm.ainvoke(messages)
+    result = await call_llm(messages, "fitness_agent", on_token=on_token)
 
     memory.save_context(
-        {"input": f"[fitness_agent] {prompt}"},
-        {"output": result.content},
+        {"input": f"[fitness_agent] {symptoms}"},
+        {"output": result},
     )
-    return result.content
+    return result
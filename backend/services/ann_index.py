@@ -0,0 +1,304 @@
+import json
+import logging
+import math
+import os
+import shutil
+import threading
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from healthbackend.services.embeddings import top_k_scores
+
+logger = logging.getLogger("healthbackend")
+
+# Rows scored per block while assigning vectors to centroids (bounds memory)
+_BLOCK = 65536
+# k-means is trained on at most this many sampled vectors
+_MAX_TRAINING_SAMPLE = 100_000
+
+
+def default_nlist(n: int) -> int:
+    """Number of inverted lists for `n` vectors: ~4 * sqrt(n)."""
+    return max(1, min(n, int(4 * math.sqrt(n))))
+
+
+# ------------------------------------------------------------
+# Spherical k-means
+# ------------------------------------------------------------
+def assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Index of the most similar centroid for every vector."""
+    out = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), _BLOCK):
+        block = np.asarray(vectors[start : start + _BLOCK], dtype=np.float32)
+        out[start : start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return out
+
+
+def kmeans(vectors: np.ndarray, k: int, iterations: int = 20, seed: int = 0) -> np.ndarray:
+    """
+    Cosine k-means over unit vectors (trained on a sample for large inputs).
+    Returns (k, dim) float32 unit centroids; empty clusters are re-seeded.
+    """
+    rng = np.random.default_rng(seed)
+    n = len(vectors)
+    if n > _MAX_TRAINING_SAMPLE:
+        sample = np.asarray(vectors[np.sort(rng.choice(n, _MAX_TRAINING_SAMPLE, replace=False))])
+    else:
+        sample = np.asarray(vectors, dtype=np.float32)
+    centroids = sample[rng.choice(len(sample), k, replace=False)].copy()
+    for _ in range(iterations):
+        labels = assign(sample, centroids)
+        counts = np.bincount(labels, minlength=k)
+        # Per-cluster sums via one sorted pass (np.add.at is far slower)
+        order = np.argsort(labels, kind="stable")
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        nonempty = counts > 0
+        sums = np.zeros_like(centroids)
+        sums[nonempty] = np.add.reduceat(sample[order], starts[nonempty], axis=0)
+        empty = np.flatnonzero(~nonempty)
+        if len(empty):
+            sums[empty] = sample[rng.choice(len(sample), len(empty), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        updated = (sums / norms).astype(np.float32)
+        if np.allclose(updated, centroids, atol=1e-6):
+            break
+        centroids = updated
+    return centroids
+
+
+# ------------------------------------------------------------
+# IVF index
+# ------------------------------------------------------------
+class IVFIndex:
+    """
+    Inverted-file ANN index over unit vectors.
+
+    Vectors are grouped by their nearest k-means centroid, each list stored
+    contiguously. A query scores the centroids, then only the vectors of the
+    `nprobe` closest lists, so raising `nprobe` trades latency for recall
+    (`nprobe == nlist` is exact search). Saved indexes are memory-mapped.
+
+    `add()` inserts vectors without retraining: they go to their nearest
+    list in an in-memory tail that queries also probe, and `save()` merges
+    the tail into the on-disk layout.
+    """
+
+    def __init__(
+        self,
+        centroids: np.ndarray,
+        vectors: np.ndarray,
+        ids: np.ndarray,
+        offsets: np.ndarray,
+        nprobe: int = 8,
+        trained_on: int = 0,
+    ):
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.vectors = vectors
+        self.ids = ids
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.nprobe = nprobe
+        self.trained_on = trained_on or len(ids)
+        self.dim = self.centroids.shape[1]
+        self._row_of: Optional[np.ndarray] = None
+        # Inserted since the last save: vectors, doc ids, list of each
+        self._lock = threading.Lock()
+        self._tail_vectors = np.zeros((0, self.dim), dtype=np.float32)
+        self._tail_ids = np.zeros(0, dtype=np.int64)
+        self._tail_lists = np.zeros(0, dtype=np.int64)
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    def __len__(self) -> int:
+        return len(self.ids) + len(self._tail_ids)
+
+    # ---- construction --------------------------------------------------
+    @classmethod
+    def train(
+        cls, vectors: np.ndarray, nlist: int = 0, nprobe: int = 8, seed: int = 0
+    ) -> "IVFIndex":
+        """Train centroids on `vectors` and index them (doc ids = row numbers)."""
+        nlist = nlist or default_nlist(len(vectors))
+        centroids = kmeans(vectors, min(nlist, len(vectors)), seed=seed) if len(vectors) else None
+        if centroids is None:
+            raise ValueError("cannot train an IVF index on zero vectors")
+        return cls.from_centroids(centroids, vectors, nprobe=nprobe, trained_on=len(vectors))
+
+    @classmethod
+    def from_centroids(
+        cls,
+        centroids: np.ndarray,
+        vectors: np.ndarray,
+        ids: Optional[np.ndarray] = None,
+        nprobe: int = 8,
+        trained_on: int = 0,
+    ) -> "IVFIndex":
+        """Index `vectors` under existing centroids (no retraining)."""
+        dim = centroids.shape[1]
+        index = cls(
+            centroids,
+            np.zeros((0, dim), dtype=np.float32),
+            np.zeros(0, dtype=np.int64),
+            np.zeros(len(centroids) + 1, dtype=np.int64),
+            nprobe=nprobe,
+            trained_on=trained_on,
+        )
+        index.add(vectors, ids)
+        index.compact()
+        return index
+
+    def add(self, vectors: np.ndarray, ids: Optional[Sequence[int]] = None) -> None:
+        """Insert vectors (doc ids default to the next row numbers)."""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        with self._lock:
+            if ids is None:
+                ids = np.arange(len(self), len(self) + len(vectors), dtype=np.int64)
+            ids = np.asarray(ids, dtype=np.int64)
+            lists = assign(vectors, self.centroids)
+            self._tail_vectors = np.concatenate([self._tail_vectors, vectors])
+            self._tail_ids = np.concatenate([self._tail_ids, ids])
+            self._tail_lists = np.concatenate([self._tail_lists, lists])
+            self._row_of = None
+
+    def compact(self) -> None:
+        """Merge inserted vectors into the contiguous per-list layout (in memory)."""
+        with self._lock:
+            if not len(self._tail_ids):
+                return
+            main_lists = np.repeat(np.arange(self.nlist), np.diff(self.offsets))
+            lists = np.concatenate([main_lists, self._tail_lists])
+            order = np.argsort(lists, kind="stable")
+            self.vectors = np.concatenate([np.asarray(self.vectors), self._tail_vectors])[order]
+            self.ids = np.concatenate([np.asarray(self.ids), self._tail_ids])[order]
+            counts = np.bincount(lists, minlength=self.nlist)
+            self.offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+            self._tail_vectors = np.zeros((0, self.dim), dtype=np.float32)
+            self._tail_ids = np.zeros(0, dtype=np.int64)
+            self._tail_lists = np.zeros(0, dtype=np.int64)
+            self._row_of = None
+
+    # ---- search --------------------------------------------------------
+    def search(
+        self, query: np.ndarray, top_k: int, min_score: float = 0.0, nprobe: Optional[int] = None
+    ) -> List[Tuple[int, float]]:
+        """Approximate `top_k` (doc_id, score) pairs at or above `min_score`."""
+        if top_k <= 0 or not len(self):
+            return []
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        centroid_scores = self.centroids @ query
+        if nprobe < self.nlist:
+            probe = np.argpartition(centroid_scores, -nprobe)[-nprobe:]
+        else:
+            probe = np.arange(self.nlist)
+
+        # One consistent view, even if add()/compact() run concurrently
+        with self._lock:
+            vectors, row_ids, offsets = self.vectors, self.ids, self.offsets
+            tail_vectors, tail_ids, tail_lists = self._tail_vectors, self._tail_ids, self._tail_lists
+        scores: List[np.ndarray] = []
+        ids: List[np.ndarray] = []
+        for lst in probe:
+            start, end = offsets[lst], offsets[lst + 1]
+            if end > start:
+                scores.append(vectors[start:end] @ query)
+                ids.append(row_ids[start:end])
+        if len(tail_ids):
+            mask = np.isin(tail_lists, probe)
+            scores.append(tail_vectors[mask] @ query)
+            ids.append(tail_ids[mask])
+        if not scores:
+            return []
+        all_scores = np.concatenate(scores)
+        all_ids = np.concatenate(ids)
+        return [(int(all_ids[i]), s) for i, s in top_k_scores(all_scores, top_k, min_score)]
+
+    def similarity(self, query: np.ndarray, doc_ids: Sequence[int]) -> np.ndarray:
+        """Exact cosine similarity of the query to the given documents."""
+        rows = self._lookup(doc_ids)
+        out = np.zeros(len(rows), dtype=np.float32)
+        in_main = rows >= 0
+        if in_main.any():
+            out[in_main] = self.vectors[rows[in_main]] @ query
+        for i in np.flatnonzero(~in_main):
+            # Not compacted yet: look it up in the insert tail
+            tail_row = np.flatnonzero(self._tail_ids == doc_ids[i])
+            if len(tail_row):
+                out[i] = self._tail_vectors[tail_row[0]] @ query
+        return out
+
+    def _lookup(self, doc_ids: Sequence[int]) -> np.ndarray:
+        # doc id -> row in the main layout (-1 if not there)
+        if self._row_of is None:
+            size = int(self.ids.max()) + 1 if len(self.ids) else 0
+            row_of = np.full(size, -1, dtype=np.int64)
+            row_of[np.asarray(self.ids)] = np.arange(len(self.ids))
+            self._row_of = row_of
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        rows = np.full(len(doc_ids), -1, dtype=np.int64)
+        known = doc_ids < len(self._row_of)
+        rows[known] = self._row_of[doc_ids[known]]
+        return rows
+
+    # ---- persistence ---------------------------------------------------
+    def save(self, path: str) -> None:
+        """Write the index (inserts merged) to directory `path`, replacing it."""
+        tmp_path = self._write_tmp(path)
+        if os.path.exists(path):
+            old_path = f"{path}.{os.getpid()}.old"
+            os.rename(path, old_path)
+            os.rename(tmp_path, path)
+            shutil.rmtree(old_path, ignore_errors=True)
+        else:
+            os.rename(tmp_path, path)
+
+    def _write_tmp(self, path: str) -> str:
+        # Full copy next to `path`, ready to be renamed into place
+        self.compact()
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        np.save(os.path.join(tmp_path, "centroids.npy"), self.centroids)
+        np.save(os.path.join(tmp_path, "vectors.npy"), np.asarray(self.vectors, dtype=np.float32))
+        np.save(os.path.join(tmp_path, "ids.npy"), np.asarray(self.ids, dtype=np.int64))
+        np.save(os.path.join(tmp_path, "offsets.npy"), self.offsets)
+        with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"nlist": self.nlist, "dim": self.dim, "trained_on": self.trained_on}, f)
+        return tmp_path
+
+    @classmethod
+    def open(cls, path: str, nprobe: int = 8) -> "IVFIndex":
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        return cls(
+            np.load(os.path.join(path, "centroids.npy")),
+            np.load(os.path.join(path, "vectors.npy"), mmap_mode="r"),
+            np.load(os.path.join(path, "ids.npy"), mmap_mode="r"),
+            np.load(os.path.join(path, "offsets.npy")),
+            nprobe=nprobe,
+            trained_on=meta.get("trained_on", 0),
+        )
+
+
+def open_or_build(
+    path: str, vectors: np.ndarray, nlist: int = 0, nprobe: int = 8
+) -> IVFIndex:
+    """
+    The IVF index saved at `path`, or one trained on `vectors` and saved
+    there (another worker may have built it first; either copy is fine).
+    """
+    if os.path.exists(os.path.join(path, "meta.json")):
+        return IVFIndex.open(path, nprobe)
+    logger.info("Training IVF index for %d vectors at %s", len(vectors), path)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = IVFIndex.train(vectors, nlist, nprobe)._write_tmp(path)
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        # Renaming onto a non-empty directory fails: another worker won
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        if not os.path.exists(os.path.join(path, "meta.json")):
+            raise
+    return IVFIndex.open(path, nprobe)
@@ -1,50 +1,410 @@
+import asyncio
+import functools
 import os
+import re
 import time
-import threading
-from typing import List, Dict
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Tuple
 
 from dotenv import load_dotenv
 load_dotenv()
 
-# Read all keys from env: XAI_API_KEY=key1,key2,key3
+from healthbackend.config.settings import (
+    GROQ_MAX_IN_FLIGHT_PER_KEY,
+    GROQ_RPM_LIMIT,
+    GROQ_TPM_LIMIT,
+    KEY_ACQUIRE_TIMEOUT,
+    KEY_POOL_BACKEND,
+    KEY_POOL_PATH,
+)
+from healthbackend.services.key_pool_backends import create_backend
+from healthbackend.services.metrics import register_collector, span
+
+# Read all keys from env: GROQ_API_KEY=key1,key2,key3
 _keys: List[str] = [
     k.strip()
     for k in os.getenv("GROQ_API_KEY", "").split(",")
     if k.strip()
 ]
 
-# For each key, track when it becomes usable again (epoch seconds)
-_key_state: Dict[str, float] = {k: 0.0 for k in _keys}
-
-# Lock to keep operations thread-safe
-_lock = threading.Lock()
-
 # How long to disable a key after quota error (seconds)
 COOLDOWN_SECONDS = 3600  # 1 hour
 
+# Cooldown for a rate-limited key when the response has no Retry-After
+RATE_LIMIT_COOLDOWN_SECONDS = 10
 
-def get_next_key() -> str:
-    """Return the next available Grok/xAI API key, skipping keys in cooldown."""
-    with _lock:
-        if not _keys:
+# How often a waiting caller re-checks keys that are busy (seconds)
+_POLL_SECONDS = 0.05
+
+
+# ------------------------------------------------------------
+# Per-key scheduling state
+# ------------------------------------------------------------
+# Each key has a request bucket and a token bucket that refill continuously
+# at the per-minute limits (capacity = one minute's worth), an in-flight
+# counter, and a cooldown deadline (quota exhaustion, 429 Retry-After).
+# Limits come from GROQ_RPM_LIMIT / GROQ_TPM_LIMIT; a per-minute token limit
+# reported in the x-ratelimit-* response headers takes precedence.
+#
+# All reads and writes go through `_transact(fn)`, which runs `fn` on the
+# whole state mapping atomically in the configured backend (KEY_POOL_BACKEND):
+# "sqlite" shares the state with every worker process on the node, "memory"
+# keeps it per process.
+def _new_key_state(now: float) -> Dict[str, float]:
+    return {
+        # Token limit reported by the API (0 = not seen yet)
+        "tpm_reported": 0.0,
+        "requests": float(GROQ_RPM_LIMIT),
+        "tokens": float(GROQ_TPM_LIMIT),
+        "refilled_at": now,
+        "in_flight": 0.0,
+        "cooldown_until": 0.0,
+        "last_used": 0.0,
+        # Usage counters
+        "calls": 0.0,
+        "used_tokens": 0.0,
+    }
+
+
+_backend = create_backend(KEY_POOL_BACKEND, KEY_POOL_PATH, _keys, _new_key_state)
+
+
+def _transact(fn: Callable[[Dict[str, Dict[str, float]]], Any]) -> Any:
+    return _backend.transact(fn)
+
+
+async def offload(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """
+    Call a key-pool function from a coroutine without stalling the event
+    loop: with the SQLite backend a transaction can wait on another worker's
+    lock, so it runs in a thread. The in-memory backend is called directly.
+    """
+    if _backend.blocking:
+        return await asyncio.to_thread(fn, *args, **kwargs)
+    return fn(*args, **kwargs)
+
+
+def _rpm(s: Dict[str, float]) -> float:
+    return float(GROQ_RPM_LIMIT)
+
+
+def _tpm(s: Dict[str, float]) -> float:
+    return s["tpm_reported"] or float(GROQ_TPM_LIMIT)
+
+
+def _refill(s: Dict[str, float], now: float) -> None:
+    elapsed = max(now - s["refilled_at"], 0.0)
+    rpm, tpm = _rpm(s), _tpm(s)
+    s["requests"] = min(rpm, s["requests"] + elapsed * rpm / 60.0)
+    s["tokens"] = min(tpm, s["tokens"] + elapsed * tpm / 60.0)
+    s["refilled_at"] = now
+
+
+def _wait_time(s: Dict[str, float], needed_tokens: float, now: float) -> float:
+    """Seconds until this key could take a call needing `needed_tokens` (0 = now)."""
+    if s["cooldown_until"] > now:
+        return s["cooldown_until"] - now
+    if s["in_flight"] >= GROQ_MAX_IN_FLIGHT_PER_KEY:
+        return _POLL_SECONDS
+    _refill(s, now)
+    wait = 0.0
+    if s["requests"] < 1.0:
+        wait = max(wait, (1.0 - s["requests"]) * 60.0 / _rpm(s))
+    if s["tokens"] < needed_tokens:
+        wait = max(wait, (needed_tokens - s["tokens"]) * 60.0 / _tpm(s))
+    return wait
+
+
+def _try_acquire(
+    estimated_tokens: int, exclude: Iterable[str], reserve: bool = True
+) -> Tuple[Optional[str], float]:
+    """
+    Pick the least-loaded usable key and (with `reserve`) charge it.
+
+    Returns:
+        (key, wait): `key` is None when no key is usable right now; `wait`
+        is then the shortest time until one might be.
+    """
+    excluded = set(exclude)
+
+    def fn(state: Dict[str, Dict[str, float]]) -> Tuple[Optional[str], float]:
+        if not state:
             raise RuntimeError("No GROQ_API_KEY configured")
+        now = time.time()
+        best, best_rank, shortest_wait = None, None, float("inf")
+        for key, s in state.items():
+            if key in excluded:
+                continue
+            # A prompt larger than a whole minute's budget only waits for a full bucket
+            needed = min(float(estimated_tokens), _tpm(s))
+            wait = _wait_time(s, needed, now)
+            if wait > 0:
+                shortest_wait = min(shortest_wait, wait)
+                continue
+            # Fewest calls in flight, then most token headroom, then least recently used
+            rank = (s["in_flight"], -s["tokens"] / _tpm(s), s["last_used"])
+            if best_rank is None or rank < best_rank:
+                best, best_rank = key, rank
+        if best is not None and reserve:
+            s = state[best]
+            s["in_flight"] += 1
+            s["requests"] -= 1.0
+            s["tokens"] -= float(estimated_tokens)
+            s["last_used"] = now
+        return best, shortest_wait
+
+    return _transact(fn)
+
+
+# ------------------------------------------------------------
+# Acquire / release
+# ------------------------------------------------------------
+def try_acquire_key(estimated_tokens: int = 0, exclude: Iterable[str] = ()) -> Optional[str]:
+    """Reserve a key if one is usable right now, else return None."""
+    key, _ = _try_acquire(estimated_tokens, exclude)
+    return key
+
+
+async def atry_acquire_key(estimated_tokens: int = 0, exclude: Iterable[str] = ()) -> Optional[str]:
+    """Async `try_acquire_key`; safe to cancel (see `_areserve`)."""
+    key, _ = await _areserve(estimated_tokens, exclude)
+    return key
+
+
+async def _areserve(estimated_tokens: int, exclude: Iterable[str]) -> Tuple[Optional[str], float]:
+    """
+    `_try_acquire` from a coroutine. With the SQLite backend the transaction
+    runs in a thread and commits even if the caller is cancelled meanwhile;
+    a key reserved for a caller that is gone is then handed back.
+    """
+    reserve = asyncio.ensure_future(offload(_try_acquire, estimated_tokens, exclude))
+    try:
+        return await asyncio.shield(reserve)
+    except asyncio.CancelledError:
+        reserve.add_done_callback(functools.partial(_unreserve_abandoned, estimated_tokens))
+        raise
+
+
+def _unreserve_abandoned(estimated_tokens: int, reserve: "asyncio.Future") -> None:
+    if reserve.cancelled() or reserve.exception() is not None:
+        return
+    key, _ = reserve.result()
+    if key is None:
+        return
+    if _backend.blocking:
+        # Runs on the event loop: keep the SQLite transaction off it
+        reserve.get_loop().run_in_executor(None, _unreserve, key, estimated_tokens)
+    else:
+        _unreserve(key, estimated_tokens)
+
+
+def _unreserve(key: str, estimated_tokens: int) -> None:
+    """Undo a reservation that was never used for a call."""
 
+    def fn(state: Dict[str, Dict[str, float]]) -> None:
+        s = state.get(key)
+        if s is None:
+            return
+        _refill(s, time.time())
+        s["in_flight"] = max(s["in_flight"] - 1, 0.0)
+        s["requests"] = min(_rpm(s), s["requests"] + 1.0)
+        s["tokens"] = min(_tpm(s), s["tokens"] + float(estimated_tokens))
+
+    _transact(fn)
+
+
+def acquire_key(
+    estimated_tokens: int = 0,
+    timeout: float = KEY_ACQUIRE_TIMEOUT,
+    exclude: Iterable[str] = (),
+) -> str:
+    """
+    Reserve the least-loaded key for one call, blocking until one is free.
+
+    Every acquired key must be handed back with `release_key()`.
+    Raises RuntimeError if no key frees up within `timeout` seconds.
+    """
+    deadline = time.monotonic() + timeout
+    with span("key_acquire"):
+        while True:
+            key, wait = _try_acquire(estimated_tokens, exclude)
+            if key is not None:
+                return key
+            if wait > deadline - time.monotonic():
+                raise RuntimeError(
+                    "All Groq API keys are rate limited, busy or in cooldown."
+                )
+            time.sleep(max(wait, _POLL_SECONDS))
+
+
+async def aacquire_key(
+    estimated_tokens: int = 0,
+    timeout: float = KEY_ACQUIRE_TIMEOUT,
+    exclude: Iterable[str] = (),
+) -> str:
+    """
+    Async `acquire_key`: waits without blocking the event loop. A caller
+    cancelled while a key is being reserved never holds it.
+    """
+    deadline = time.monotonic() + timeout
+    with span("key_acquire"):
+        while True:
+            key, wait = await _areserve(estimated_tokens, exclude)
+            if key is not None:
+                return key
+            if wait > deadline - time.monotonic():
+                raise RuntimeError(
+                    "All Groq API keys are rate limited, busy or in cooldown."
+                )
+            await asyncio.sleep(max(wait, _POLL_SECONDS))
+
+
+def release_key(
+    key: str,
+    estimated_tokens: int = 0,
+    used_tokens: Optional[int] = None,
+    headers: Optional[Mapping[str, str]] = None,
+) -> None:
+    """
+    Hand back a key reserved by `acquire_key()`.
+
+    `used_tokens` (from the response usage) corrects the token bucket for
+    the difference to the estimate; `headers` are the response headers,
+    whose x-ratelimit-* values override the local bookkeeping.
+    """
+
+    def fn(state: Dict[str, Dict[str, float]]) -> None:
+        s = state.get(key)
+        if s is None:
+            return
         now = time.time()
-        available = [k for k in _keys if _key_state.get(k, 0) <= now]
-        if not available:
-            raise RuntimeError(
-                "All Groq API keys are currently in cooldown due to quota limits."
-            )
+        _refill(s, now)
+        s["in_flight"] = max(s["in_flight"] - 1, 0.0)
+        s["calls"] += 1
+        if used_tokens is not None:
+            s["tokens"] += float(estimated_tokens - used_tokens)
+            s["used_tokens"] += float(used_tokens)
+        if headers:
+            _apply_rate_limit_headers(s, headers, now)
+
+    _transact(fn)
+
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}
+
+
+def _parse_duration(value: str) -> Optional[float]:
+    # "6m0s", "7.66s", "120ms" -> seconds
+    parts = _DURATION_RE.findall(value or "")
+    if not parts:
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+    return sum(float(n) * _DURATION_UNITS[u] for n, u in parts)
+
+
+def _header_float(headers: Mapping[str, str], name: str) -> Optional[float]:
+    try:
+        return float(headers[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
 
-        # Simple round-robin: take first available, move it to the end
-        key = available[0]
-        _keys.remove(key)
-        _keys.append(key)
-        return key
+def _apply_rate_limit_headers(s: Dict[str, float], headers: Mapping[str, str], now: float) -> None:
+    # Groq: *-tokens are per minute, *-requests are per day
+    headers = {k.lower(): v for k, v in headers.items()}
+    limit_tokens = _header_float(headers, "x-ratelimit-limit-tokens")
+    if limit_tokens:
+        s["tpm_reported"] = limit_tokens
+    remaining_tokens = _header_float(headers, "x-ratelimit-remaining-tokens")
+    if remaining_tokens is not None:
+        s["tokens"] = min(remaining_tokens, _tpm(s))
+    remaining_requests = _header_float(headers, "x-ratelimit-remaining-requests")
+    if remaining_requests is not None and remaining_requests <= 0:
+        reset = _parse_duration(headers.get("x-ratelimit-reset-requests", ""))
+        s["cooldown_until"] = max(
+            s["cooldown_until"], now + (reset if reset is not None else COOLDOWN_SECONDS)
+        )
+
+
+# ------------------------------------------------------------
+# Cooldowns
+# ------------------------------------------------------------
+def _cool_down(key: str, seconds: float) -> None:
+    def fn(state: Dict[str, Dict[str, float]]) -> None:
+        s = state.get(key)
+        if s is not None:
+            # Never shorten a longer cooldown (e.g. quota exhaustion)
+            s["cooldown_until"] = max(s["cooldown_until"], time.time() + seconds)
+
+    _transact(fn)
 
 
 def mark_key_quota_exceeded(key: str) -> None:
     """Mark a key as temporarily disabled because quota was exceeded."""
-    with _lock:
-        if key in _key_state:
-            _key_state[key] = time.time() + COOLDOWN_SECONDS
+    _cool_down(key, COOLDOWN_SECONDS)
+
+
+def mark_key_rate_limited(key: str, retry_after: Optional[float] = None) -> None:
+    """Briefly rest a key that hit a per-minute rate limit (HTTP 429)."""
+    _cool_down(key, retry_after if retry_after is not None else RATE_LIMIT_COOLDOWN_SECONDS)
+
+
+def get_next_key() -> str:
+    """
+    Return the least-loaded available key without reserving it.
+
+    For requests that are not LLM calls (e.g. connection pre-warming);
+    LLM calls go through `acquire_key()` / `release_key()`.
+    """
+    key, _ = _try_acquire(0, (), reserve=False)
+    if key is None:
+        raise RuntimeError("All Groq API keys are rate limited, busy or in cooldown.")
+    return key
+
+
+def key_pool_stats() -> Dict[str, Dict[str, float]]:
+    """Snapshot of every key's state, keys masked to their last 4 characters."""
+
+    def fn(state: Dict[str, Dict[str, float]]) -> Dict[str, Dict[str, float]]:
+        now = time.time()
+        snapshot = {}
+        for key, s in state.items():
+            _refill(s, now)
+            snapshot[f"…{key[-4:]}"] = {
+                "in_flight": s["in_flight"],
+                "requests_available": round(s["requests"], 2),
+                "tokens_available": round(s["tokens"]),
+                "cooldown_seconds": round(max(s["cooldown_until"] - now, 0.0), 1),
+                "calls": s["calls"],
+                "used_tokens": s["used_tokens"],
+            }
+        return snapshot
+
+    return _transact(fn)
+
+
+def _collect_metrics():
+    stats = key_pool_stats()
+    yield (
+        "key_in_flight",
+        "gauge",
+        "LLM calls in flight per API key (all workers sharing the pool)",
+        [({"key": k}, s["in_flight"]) for k, s in stats.items()],
+    )
+    yield (
+        "key_cooldown_seconds",
+        "gauge",
+        "Seconds until a cooled-down API key is usable again",
+        [({"key": k}, s["cooldown_seconds"]) for k, s in stats.items()],
+    )
+    yield (
+        "key_tokens_available",
+        "gauge",
+        "Per-minute token budget currently left per API key",
+        [({"key": k}, s["tokens_available"]) for k, s in stats.items()],
+    )
+
+
+register_collector(_collect_metrics)
@@ -0,0 +1,124 @@
+import asyncio
+import concurrent.futures
+import logging
+import os
+import threading
+from typing import Any, AsyncIterator, Coroutine, Iterator, Optional, Tuple
+
+from healthbackend.config.settings import STREAM_QUEUE_SIZE
+
+logger = logging.getLogger("healthbackend")
+
+
+# ------------------------------------------------------------
+# Per-worker background event loop
+# ------------------------------------------------------------
+# Sync (WSGI) views hand their async work to one long-lived event loop
+# running in a daemon thread, instead of creating a loop per request. The
+# loop's pooled LLM clients are therefore reused across requests, and
+# streams can be cancelled from the request thread.
+#
+# Coroutines are scheduled with call_soon_threadsafe, which copies the
+# calling thread's contextvars, so request-scoped context follows the work.
+_lock = threading.Lock()
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_pid: Optional[int] = None
+
+
+def _run_loop(loop: asyncio.AbstractEventLoop) -> None:
+    asyncio.set_event_loop(loop)
+    loop.run_forever()
+
+
+def get_background_loop() -> asyncio.AbstractEventLoop:
+    """Return this worker's background loop, starting its thread if needed."""
+    global _loop, _loop_pid
+    with _lock:
+        # After a fork the loop thread does not exist in the child
+        if _loop is None or _loop_pid != os.getpid():
+            _loop = asyncio.new_event_loop()
+            _loop_pid = os.getpid()
+            threading.Thread(
+                target=_run_loop, args=(_loop,), name="async-worker", daemon=True
+            ).start()
+        return _loop
+
+
+def run_coroutine(coro: Coroutine[Any, Any, Any], timeout: Optional[float] = None) -> Any:
+    """Run `coro` on the background loop and block until it finishes."""
+    future = asyncio.run_coroutine_threadsafe(coro, get_background_loop())
+    try:
+        return future.result(timeout)
+    except BaseException:
+        # Timeout or the calling thread is being torn down: stop the work
+        future.cancel()
+        raise
+
+
+_ITEM, _DONE, _ERROR = "item", "done", "error"
+
+# How often a waiting consumer checks that the pump is still running (seconds)
+_PUMP_CHECK_SECONDS = 1.0
+
+
+async def _pump(agen: AsyncIterator[Any], queue: asyncio.Queue) -> None:
+    try:
+        async for item in agen:
+            # Bounded queue: a slow client pauses the producer
+            await queue.put((_ITEM, item))
+        await queue.put((_DONE, None))
+    except asyncio.CancelledError:
+        # Wake the consumer now if there is room; otherwise it notices that
+        # the pump is gone within _PUMP_CHECK_SECONDS
+        try:
+            queue.put_nowait((_ERROR, RuntimeError("Stream was cancelled before it finished")))
+        except asyncio.QueueFull:
+            pass
+        raise
+    except Exception as e:
+        await queue.put((_ERROR, e))
+    finally:
+        await agen.aclose()
+
+
+def _next_item(
+    loop: asyncio.AbstractEventLoop, queue: asyncio.Queue, pump: concurrent.futures.Future
+) -> Tuple[str, Any]:
+    get = asyncio.run_coroutine_threadsafe(queue.get(), loop)
+    pump_done = False
+    while True:
+        try:
+            return get.result(_PUMP_CHECK_SECONDS)
+        except concurrent.futures.TimeoutError:
+            if pump_done:
+                # The pump ended without a terminal item and nothing is left
+                get.cancel()
+                return _ERROR, RuntimeError("Stream stopped before it finished")
+            # Give items queued just before the pump ended one more round
+            pump_done = pump.done()
+
+
+def iterate_in_background(
+    agen: AsyncIterator[Any], maxsize: int = STREAM_QUEUE_SIZE
+) -> Iterator[Any]:
+    """
+    Drive an async generator on the background loop and yield its items
+    from the calling (WSGI) thread, through a queue of `maxsize` items.
+
+    Closing the returned generator (e.g. the client disconnected) cancels
+    the async generator, so in-flight LLM calls behind it are cancelled.
+    """
+    loop = get_background_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize)
+    pump = asyncio.run_coroutine_threadsafe(_pump(agen, queue), loop)
+    try:
+        while True:
+            kind, value = _next_item(loop, queue, pump)
+            if kind == _DONE:
+                return
+            if kind == _ERROR:
+                raise value
+            yield value
+    finally:
+        # No-op if the stream finished; otherwise stops the upstream work
+        pump.cancel()
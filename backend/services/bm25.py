@@ -0,0 +1,106 @@
+import heapq
+import math
+import re
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+# Okapi BM25 parameters (term-frequency saturation, length normalization)
+K1 = 1.5
+B = 0.75
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Common English function words; they match nearly every document and carry
+# no signal for symptom queries
+STOPWORDS = frozenset(
+    """
+    a about above after again against all am an and any are as at be because
+    been before being below between both but by can could did do does doing
+    down during each few for from further had has have having he her here hers
+    herself him himself his how i if in into is it its itself just me more most
+    my myself no nor not now of off on once only or other our ours ourselves
+    out over own same she should so some such than that the their theirs them
+    themselves then there these they this those through to too under until up
+    very was we were what when where which while who whom why will with would
+    you your yours yourself yourselves also get got feel feeling im ive dont
+    t s d m ll re ve cant didnt doesnt isnt wont
+    """.split()
+)
+
+
+def normalize(token: str) -> str:
+    """Fold simple English plurals so "headaches" matches "headache"."""
+    if len(token) > 3 and token.endswith("s") and not token.endswith(("ss", "us", "is")):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase alphanumeric tokens, stopwords removed, plurals folded."""
+    return [normalize(t) for t in _TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+# ------------------------------------------------------------
+# Inverted index
+# ------------------------------------------------------------
+class BM25Index:
+    """
+    Inverted index with BM25 ranking over a fixed list of documents.
+
+    Each term maps to a posting list of (doc_id, term_frequency), so a query
+    only touches the documents that contain one of its terms; the best
+    `top_k` are picked with a heap rather than sorting every candidate.
+    """
+
+    def __init__(
+        self,
+        postings: Dict[str, Sequence[Tuple[int, int]]],
+        doc_lengths: Sequence[int],
+    ):
+        self.postings = postings
+        self.doc_lengths = doc_lengths
+        self.num_docs = len(doc_lengths)
+        self.avg_length = (sum(doc_lengths) / self.num_docs) if self.num_docs else 0.0
+        self.idf = {
+            term: math.log(1 + (self.num_docs - len(plist) + 0.5) / (len(plist) + 0.5))
+            for term, plist in postings.items()
+        }
+
+    @classmethod
+    def build(cls, texts: Iterable[str]) -> "BM25Index":
+        postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        doc_lengths: List[int] = []
+        for doc_id, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                postings[term].append((doc_id, tf))
+        return cls(dict(postings), doc_lengths)
+
+    def to_dict(self) -> Dict[str, object]:
+        """JSON-serializable form, for prebuilt index artifacts."""
+        return {"doc_lengths": list(self.doc_lengths), "postings": self.postings}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, object]) -> "BM25Index":
+        return cls(data["postings"], data["doc_lengths"])
+
+    def scores(self, query: str) -> Dict[int, float]:
+        """BM25 score of every document matching at least one query term."""
+        scores: Dict[int, float] = defaultdict(float)
+        avg_length = self.avg_length or 1.0
+        for term in set(tokenize(query)):
+            plist = self.postings.get(term)
+            if not plist:
+                continue
+            idf = self.idf[term]
+            for doc_id, tf in plist:
+                norm = K1 * (1 - B + B * self.doc_lengths[doc_id] / avg_length)
+                scores[doc_id] += idf * tf * (K1 + 1) / (tf + norm)
+        return scores
+
+    def search(self, query: str, top_k: int) -> List[Tuple[int, float]]:
+        """The `top_k` best (doc_id, score) pairs, highest score first."""
+        scores = self.scores(query)
+        # Ties go to the earlier document, keeping results deterministic
+        return heapq.nlargest(top_k, scores.items(), key=lambda item: (item[1], -item[0]))
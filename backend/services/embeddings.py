@@ -0,0 +1,155 @@
+import hashlib
+import os
+import re
+from functools import lru_cache
+from typing import Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+from healthbackend.services.bm25 import tokenize
+
+# ------------------------------------------------------------
+# Synonyms
+# ------------------------------------------------------------
+# Lay phrasings mapped to a shared concept term, added to both documents and
+# queries before hashing so "can't sleep" lands next to "insomnia".
+# Phrases are matched on lowercased text with apostrophes removed.
+SYNONYMS = {
+    "insomnia": [
+        "cant sleep", "cannot sleep", "unable to sleep", "trouble sleeping",
+        "difficulty sleeping", "sleepless", "sleep problem", "poor sleep", "awake at night",
+    ],
+    "hypertension": ["high blood pressure", "high bp", "blood pressure is high"],
+    "diabetes": ["diabetic", "high blood sugar", "blood glucose", "high sugar levels"],
+    "obesity": ["overweight", "weight gain", "gaining weight", "lose weight", "weight loss"],
+    "breathing": [
+        "shortness of breath", "short of breath", "breathless", "cant breathe",
+        "hard to breathe", "wheezing", "asthma",
+    ],
+    "fatigue": ["tired", "tiredness", "exhausted", "exhaustion", "low energy", "no energy", "weakness"],
+    "headache": ["migraine", "head pain", "head hurts", "head ache"],
+    "anxiety": ["anxious", "stress", "stressed", "worried", "panic", "nervous"],
+    "reflux": ["heartburn", "acid reflux", "acidity", "gerd", "indigestion", "sour stomach"],
+    "cholesterol": ["high ldl", "lipids", "triglycerides"],
+    "heart": ["cardiac", "chest pain", "palpitations"],
+    "kidney": ["renal", "kidneys"],
+    "hydration": ["dehydrated", "dehydration", "thirsty", "not drinking enough water"],
+}
+
+_APOSTROPHES = re.compile(r"['’]")
+_SYNONYM_RE = re.compile(
+    r"\b(" + "|".join(
+        re.escape(p) for p in sorted(
+            (p for phrases in SYNONYMS.values() for p in phrases), key=len, reverse=True
+        )
+    ) + r")\b"
+)
+_CONCEPT = {p: concept for concept, phrases in SYNONYMS.items() for p in phrases}
+
+
+def synonym_concepts(text: str) -> List[str]:
+    """Concept terms of the known lay phrases found in `text`."""
+    text = _APOSTROPHES.sub("", text.lower())
+    return sorted({_CONCEPT[m.group(1)] for m in _SYNONYM_RE.finditer(text)})
+
+
+# ------------------------------------------------------------
+# Hashed n-gram embeddings
+# ------------------------------------------------------------
+# Feature weights: whole words, synonym concepts, adjacent word pairs,
+# character trigrams (so "diabetic" still lands close to "diabetes")
+_WORD_WEIGHT = 1.0
+_CONCEPT_WEIGHT = 3.0
+_BIGRAM_WEIGHT = 0.5
+_TRIGRAM_WEIGHT = 0.2
+
+
+@lru_cache(maxsize=65536)
+def _bucket(feature: str, dim: int) -> Tuple[int, float]:
+    # Signed hashing: collisions cancel out on average instead of adding up
+    digest = hashlib.md5(feature.encode("utf-8")).digest()
+    value = int.from_bytes(digest[:4], "little")
+    return value % dim, (1.0 if digest[4] & 1 else -1.0)
+
+
+def embed(text: str, dim: int) -> np.ndarray:
+    """L2-normalized float32 vector of hashed word, bigram and char-trigram features."""
+    vec = np.zeros(dim, dtype=np.float32)
+    words = tokenize(text)
+    features = [("w:" + w, _WORD_WEIGHT) for w in words]
+    # Same feature space as words, so a concept also matches the plain term
+    features += [("w:" + c, _CONCEPT_WEIGHT) for c in synonym_concepts(text)]
+    features += [(f"b:{a} {b}", _BIGRAM_WEIGHT) for a, b in zip(words, words[1:])]
+    for w in words:
+        padded = f"#{w}#"
+        features += [("c:" + padded[i : i + 3], _TRIGRAM_WEIGHT) for i in range(len(padded) - 2)]
+    for feature, weight in features:
+        idx, sign = _bucket(feature, dim)
+        vec[idx] += sign * weight
+    norm = float(np.linalg.norm(vec))
+    return vec / norm if norm else vec
+
+
+def embed_many(texts: Iterable[str], dim: int) -> np.ndarray:
+    """Stack embeddings into an (n, dim) float32 matrix."""
+    rows = [embed(text, dim) for text in texts]
+    return np.vstack(rows) if rows else np.zeros((0, dim), dtype=np.float32)
+
+
+# ------------------------------------------------------------
+# Dense index (memory-mapped vectors)
+# ------------------------------------------------------------
+class DenseIndex:
+    """
+    Exact ("flat") cosine search over an (n, dim) float32 matrix of unit vectors.
+
+    The matrix is memory-mapped from an `.npy` file, so opening the index
+    costs no parsing and the pages are shared by all workers on the host.
+    A query is one matrix-vector product plus `argpartition` for the top k.
+    """
+
+    def __init__(self, matrix: np.ndarray):
+        self.matrix = matrix
+        self.dim = matrix.shape[1]
+
+    @classmethod
+    def open(cls, path: str) -> "DenseIndex":
+        return cls(np.load(path, mmap_mode="r"))
+
+    @classmethod
+    def build(cls, texts: Iterable[str], dim: int, path: str) -> "DenseIndex":
+        """Embed `texts`, write them to `path` atomically and map the file."""
+        save_matrix(path, embed_many(texts, dim))
+        return cls.open(path)
+
+    def __len__(self) -> int:
+        return self.matrix.shape[0]
+
+    def search(self, query: np.ndarray, top_k: int, min_score: float = 0.0) -> List[Tuple[int, float]]:
+        """The `top_k` most similar (doc_id, score) pairs at or above `min_score`."""
+        if top_k <= 0 or not len(self):
+            return []
+        return top_k_scores(self.matrix @ query, top_k, min_score)
+
+    def similarity(self, query: np.ndarray, doc_ids: Sequence[int]) -> np.ndarray:
+        """Cosine similarity of the query to the given documents."""
+        return self.matrix[np.asarray(doc_ids, dtype=np.int64)] @ query
+
+
+def top_k_scores(scores: np.ndarray, top_k: int, min_score: float = 0.0) -> List[Tuple[int, float]]:
+    """Best `top_k` entries of a score vector, highest first."""
+    if top_k < len(scores):
+        ids = np.argpartition(scores, -top_k)[-top_k:]
+    else:
+        ids = np.arange(len(scores))
+    ids = ids[np.argsort(-scores[ids], kind="stable")]
+    return [(int(i), float(scores[i])) for i in ids if scores[i] >= min_score]
+
+
+def save_matrix(path: str, matrix: np.ndarray) -> None:
+    """Write an `.npy` file via a temp file + rename, so readers never see half of it."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, np.ascontiguousarray(matrix, dtype=np.float32))
+    os.replace(tmp_path, path)
@@ -1,10 +1,16 @@
 # Import necessary modules for file handling and JSON serialization
 import json
 import os
+import threading
+
+from healthbackend.services.metrics import span
 
 # Define the JSON file path used to store user chat or session history
 FILE = "healthbackend/storage/history.json"
 
+# Serializes read-modify-write cycles of concurrent requests in this process
+_lock = threading.Lock()
+
 
 # ------------------------------------------------------------
 # Load function
@@ -27,9 +33,12 @@ def load():
 def save(data):
     # Ensure the directory structure exists before writing the file
     os.makedirs(os.path.dirname(FILE), exist_ok=True)
-    # Write the data as formatted JSON with indentation for readability
-    with open(FILE, "w", encoding="utf-8") as f:
+    # Write the data as formatted JSON with indentation for readability.
+    # Write to a temp file and swap it in, so readers never see a partial file.
+    tmp = f"{FILE}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
         json.dump(data, f, indent=2)
+    os.replace(tmp, FILE)
 
 
 # ------------------------------------------------------------
@@ -38,12 +47,14 @@ def save(data):
 # Purpose: Append a new history entry for a specific user.
 # If the user does not exist, initialize their entry as an empty list.
 def save_history(user_id, entry):
-    # Load the existing history structure
-    data = load()
-    # Create a list for the user if not present and append the new entry
-    data.setdefault(user_id, []).append(entry)
-    # Save updated data back to storage
-    save(data)
+    # Timed including the wait for the lock (concurrent writers queue here)
+    with span("save_history"), _lock:
+        # Load the existing history structure
+        data = load()
+        # Create a list for the user if not present and append the new entry
+        data.setdefault(user_id, []).append(entry)
+        # Save updated data back to storage
+        save(data)
 
 
 # ------------------------------------------------------------
@@ -0,0 +1,364 @@
+import logging
+import math
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+from langchain.schema import HumanMessage, SystemMessage
+
+from healthbackend.config.settings import (
+    INTENT_CACHE_SIZE,
+    INTENT_NO_THRESHOLD,
+    INTENT_RETRAIN_INTERVAL,
+    INTENT_YES_THRESHOLD,
+)
+from healthbackend.services import history_store
+from healthbackend.services.llm_calls import call_llm, call_llm_sync
+from healthbackend.services.metrics import register_collector, span
+from healthbackend.services.result_cache import normalize_symptoms
+
+logger = logging.getLogger("healthbackend")
+
+OFF_TOPIC_MESSAGE = (
+    "This is a wellness specialized system. Please ask about symptoms, "
+    "lifestyle, diet, exercise, or other health-related topics."
+)
+
+# Seed vocabulary for health / wellness queries
+HEALTH_KEYWORDS = [
+    "symptom", "fever", "cough", "pain", "headache", "cold", "flu",
+    "blood pressure", "bp", "sugar", "diabetes", "hypertension", "cholesterol",
+    "heart", "breath", "breathing", "asthma", "diet", "food", "meal",
+    "nutrition", "calorie", "exercise", "workout", "walking", "running", "yoga",
+    "fitness", "sleep", "insomnia", "snoring", "stress", "anxiety", "depression",
+    "fatigue", "tired", "doctor", "medicine", "tablet", "pill", "health",
+    "wellness", "weight", "obesity", "acne", "pimples", "skin", "rash",
+    "allergy", "itch", "stomach", "nausea", "suffering", "sick", "unwell",
+    "condition", "injury", "injured", "sprain", "strain", "hurt", "ache",
+    "sore", "swelling", "cramp", "dizzy", "vomiting", "bleeding", "wound",
+    "knee", "ankle", "wrist", "elbow", "shoulder", "neck", "back", "joint",
+    "muscle", "eye", "vision", "ear", "throat", "chest", "tooth", "posture",
+    "jet lag", "hangover", "hydration",
+]
+
+# Seed vocabulary for clearly unrelated queries
+OFF_TOPIC_KEYWORDS = [
+    "python", "javascript", "java", "code", "coding", "programming", "software",
+    "computer", "laptop", "phone", "app", "website", "movie", "film", "song",
+    "music", "actor", "celebrity", "election", "politics", "president",
+    "minister", "government", "football", "cricket", "match", "score", "stock",
+    "share", "crypto", "bitcoin", "price", "weather", "capital", "country",
+    "history", "war", "math", "equation", "poem", "joke", "story", "translate",
+    "car", "bike", "travel", "hotel", "flight", "game",
+]
+
+# Keyword seeds count as this many training examples each
+_SEED_WEIGHT = 3
+_SMOOTHING = 1.0
+# Inflections a token may add to a known term ("coughing", "injuries");
+# arbitrary continuations ("painting") do not match
+_SUFFIXES = ("s", "es", "ies", "ed", "ing", "er", "ful", "ness", "y", "ly")
+_NEGATED = "no:"
+
+_SYSTEM_PROMPT = """You are an intent classifier. Determine if the user's query is related to health, wellness, medical symptoms, diet, fitness, mental health, or lifestyle.
+
+Respond with ONLY "YES" if the query is health/wellness related.
+Respond with ONLY "NO" if the query is completely unrelated (e.g., technology, politics, entertainment, general knowledge).
+
+Health-related topics include: symptoms, diseases, pain, medical conditions, nutrition, diet, exercise, fitness, mental health, stress, sleep, lifestyle, medications, preventive care, body conditions (acne, skin issues, etc.)."""
+
+
+# ------------------------------------------------------------
+# Local linear model (naive Bayes log-odds per token)
+# ------------------------------------------------------------
+def _tokens(text: str) -> Iterable[str]:
+    # A negated symptom ("no:fever") is still about that symptom
+    for token in normalize_symptoms(text).split():
+        yield token[len(_NEGATED):] if token.startswith(_NEGATED) else token
+
+
+class _IntentModel:
+    """
+    Token weights learned from the keyword seeds plus past queries.
+
+    Every query stored in history passed the intent filter, so history is
+    used as extra positive examples. A query's score is the sum of its
+    token weights; positive means health-related. Separately, a query has
+    a health (off-topic) signal when one of its tokens is a health
+    (off-topic) seed term.
+    """
+
+    def __init__(
+        self,
+        positive: Iterable[str],
+        negative: Iterable[str],
+        health_terms: Iterable[str] = (),
+        off_topic_terms: Iterable[str] = (),
+    ):
+        pos = Counter()
+        neg = Counter()
+        for text in positive:
+            pos.update(_tokens(text))
+        for text in negative:
+            neg.update(_tokens(text))
+
+        vocab = set(pos) | set(neg)
+        pos_total = sum(pos.values()) + _SMOOTHING * len(vocab)
+        neg_total = sum(neg.values()) + _SMOOTHING * len(vocab)
+        self.weights: Dict[str, float] = {
+            t: math.log((pos[t] + _SMOOTHING) / pos_total)
+            - math.log((neg[t] + _SMOOTHING) / neg_total)
+            for t in vocab
+        }
+        self.health_terms = {t for text in health_terms for t in _tokens(text)}
+        self.off_topic_terms = {t for text in off_topic_terms for t in _tokens(text)}
+
+    def _term(self, token: str) -> Optional[str]:
+        """The known term `token` is, or inflects ("coughing" -> "cough")."""
+        if token in self.weights:
+            return token
+        for suffix in _SUFFIXES:
+            if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+                base = token[: -len(suffix)]
+                for term in (base, base + "e", base + "y"):
+                    if term in self.weights:
+                        return term
+        return None
+
+    def score(self, normalized: str) -> Tuple[float, bool, bool]:
+        """(log-odds score, has a health signal, has an off-topic signal)."""
+        total = 0.0
+        health = off_topic = False
+        for token in normalized.split():
+            if token.startswith(_NEGATED):
+                token = token[len(_NEGATED):]
+            term = self._term(token)
+            if term is None:
+                continue
+            total += self.weights[term]
+            health = health or term in self.health_terms
+            off_topic = off_topic or term in self.off_topic_terms
+        return total, health, off_topic
+
+
+_model_lock = threading.Lock()
+_model: Optional[_IntentModel] = None
+_model_history_mtime: Optional[float] = None
+_model_checked_at = float("-inf")
+# Held by the (single) background retrain
+_retrain_lock = threading.Lock()
+
+# Decision counters: answered locally vs escalated to the LLM
+_stats = Counter()
+
+
+def _history_queries() -> Iterable[str]:
+    for entries in history_store.load().values():
+        for entry in entries:
+            query = entry.get("query")
+            if query:
+                yield query
+
+
+def _history_mtime() -> Optional[float]:
+    try:
+        return os.path.getmtime(history_store.FILE)
+    except OSError:
+        return None
+
+
+def _train() -> Tuple[_IntentModel, Optional[float]]:
+    mtime = _history_mtime()
+    try:
+        history = list(_history_queries())
+    except (OSError, ValueError) as e:
+        logger.warning("Intent model: could not read history: %s", e)
+        history = []
+    model = _IntentModel(
+        positive=HEALTH_KEYWORDS * _SEED_WEIGHT + history,
+        negative=OFF_TOPIC_KEYWORDS * _SEED_WEIGHT,
+        health_terms=HEALTH_KEYWORDS,
+        off_topic_terms=OFF_TOPIC_KEYWORDS,
+    )
+    return model, mtime
+
+
+def _retrain() -> None:
+    global _model, _model_history_mtime
+    try:
+        if _history_mtime() != _model_history_mtime:
+            model, mtime = _train()
+            with _model_lock:
+                _model, _model_history_mtime = model, mtime
+    except Exception:
+        logger.exception("Intent model retraining failed; keeping the current model")
+    finally:
+        _retrain_lock.release()
+
+
+def _get_model() -> _IntentModel:
+    """
+    Return the model. It is trained on first use; afterwards the history
+    file is checked at most every INTENT_RETRAIN_INTERVAL seconds and, if it
+    changed, the model is retrained on a background thread while requests
+    keep using the current one.
+    """
+    global _model, _model_history_mtime, _model_checked_at
+    model = _model
+    if model is None:
+        with _model_lock:
+            if _model is None:
+                _model, _model_history_mtime = _train()
+                _model_checked_at = time.monotonic()
+            return _model
+
+    if time.monotonic() - _model_checked_at >= INTENT_RETRAIN_INTERVAL and _retrain_lock.acquire(
+        blocking=False
+    ):
+        _model_checked_at = time.monotonic()
+        threading.Thread(target=_retrain, name="intent-retrain", daemon=True).start()
+    return model
+
+
+def warm_intent_model() -> None:
+    """Train the local model now rather than on the first request."""
+    _get_model()
+
+
+# ------------------------------------------------------------
+# LLM tier (ambiguous queries only)
+# ------------------------------------------------------------
+def _llm_messages(text: str):
+    return [
+        SystemMessage(content=_SYSTEM_PROMPT),
+        HumanMessage(content=f"Is this query health/wellness related?\n\nQuery: {text}"),
+    ]
+
+
+def _llm_is_health_query(text: str) -> bool:
+    """Ask the LLM for a YES / NO intent decision."""
+    reply = call_llm_sync(_llm_messages(text), "intent", max_tokens=10)
+    return "YES" in reply.strip().upper()
+
+
+async def _allm_is_health_query(text: str) -> bool:
+    """Async variant of `_llm_is_health_query`."""
+    reply = await call_llm(_llm_messages(text), "intent", max_tokens=10)
+    return "YES" in reply.strip().upper()
+
+
+# Decisions keyed by normalized query (LRU)
+_decisions: "OrderedDict[str, bool]" = OrderedDict()
+_decisions_lock = threading.Lock()
+
+
+def _quick_decision(text: str) -> Tuple[Optional[bool], str, float]:
+    """
+    Decide without the LLM if possible.
+
+    Returns:
+        (decision, normalized, score): `decision` is None when the query is
+        ambiguous and has to be escalated.
+    """
+    if not text or not text.strip():
+        return False, "", 0.0
+    normalized = normalize_symptoms(text)
+    if not normalized:
+        return False, "", 0.0
+
+    with _decisions_lock:
+        if normalized in _decisions:
+            _decisions.move_to_end(normalized)
+            _stats["cache_hits"] += 1
+            return _decisions[normalized], normalized, 0.0
+
+    # A query with both health and off-topic terms ("knee injury during a
+    # football match") is left to the LLM, and only a query without any
+    # health term can be rejected locally
+    score, health, off_topic = _get_model().score(normalized)
+    if score >= INTENT_YES_THRESHOLD and not off_topic:
+        _stats["local_yes"] += 1
+        decision: Optional[bool] = True
+    elif score <= INTENT_NO_THRESHOLD and not health:
+        _stats["local_no"] += 1
+        decision = False
+    else:
+        _stats["escalated"] += 1
+        return None, normalized, score
+
+    _remember(normalized, decision)
+    return decision, normalized, score
+
+
+def _remember(normalized: str, decision: bool) -> None:
+    with _decisions_lock:
+        _decisions[normalized] = decision
+        _decisions.move_to_end(normalized)
+        while len(_decisions) > INTENT_CACHE_SIZE:
+            _decisions.popitem(last=False)
+
+
+def is_health_query(text: str) -> bool:
+    """
+    Intent filter: allow only health/wellness related queries.
+
+    Confident cases are decided locally by a token-weight model; only
+    ambiguous queries are sent to the LLM. Decisions are LRU-cached by
+    normalized query.
+    """
+    with span("intent_check"):
+        return _is_health_query(text)
+
+
+def _is_health_query(text: str) -> bool:
+    decision, normalized, score = _quick_decision(text)
+    if decision is not None:
+        return decision
+    try:
+        decision = _llm_is_health_query(text.strip())
+    except Exception as e:
+        # Fallback to the local model's leaning if the LLM fails
+        logger.warning("Intent LLM check failed, using local score: %s", e)
+        return score > 0
+    _remember(normalized, decision)
+    return decision
+
+
+async def ais_health_query(text: str) -> bool:
+    """Async `is_health_query`: returns without awaiting when decided locally."""
+    with span("intent_check"):
+        return await _ais_health_query(text)
+
+
+async def _ais_health_query(text: str) -> bool:
+    decision, normalized, score = _quick_decision(text)
+    if decision is not None:
+        return decision
+    try:
+        decision = await _allm_is_health_query(text.strip())
+    except Exception as e:
+        logger.warning("Intent LLM check failed, using local score: %s", e)
+        return score > 0
+    _remember(normalized, decision)
+    return decision
+
+
+def intent_stats() -> Dict[str, int]:
+    """Counters of local decisions, LLM escalations and cache hits."""
+    with _decisions_lock:
+        return {**_stats, "cache_size": len(_decisions)}
+
+
+def _collect_metrics():
+    stats = intent_stats()
+    yield (
+        "intent_decisions_total",
+        "counter",
+        "Intent filter decisions by where they were made",
+        [({"source": name}, value) for name, value in stats.items() if name != "cache_size"],
+    )
+
+
+register_collector(_collect_metrics)
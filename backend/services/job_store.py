@@ -0,0 +1,202 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from healthbackend.config.settings import JOB_LEASE_SECONDS, JOB_STORE_PATH, JOB_TTL_SECONDS
+from healthbackend.utils.processes import pid_alive, worker_id
+
+logger = logging.getLogger("healthbackend")
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+# ------------------------------------------------------------
+# Persistent job store
+# ------------------------------------------------------------
+# Background /health-assist jobs live in a SQLite file (WAL mode) so their
+# status and results survive worker restarts and are visible to every worker
+# process. `owner` is the `worker_id()` of the worker running (or about to
+# run) the job. Every worker refreshes its row in `job_workers` on each
+# `create_job()` / `claim_orphaned_jobs()` call; jobs of a worker whose pid is gone or whose heartbeat is
+# older than JOB_LEASE_SECONDS are handed to another worker by
+# `claim_orphaned_jobs()`. Worker ids are never reused, so a new process that
+# happens to get a dead worker's pid does not keep its jobs alive.
+_local = threading.local()
+_init_lock = threading.Lock()
+_initialized_paths: set = set()
+
+
+def _connect() -> sqlite3.Connection:
+    # One connection per thread (sqlite3 connections are not thread-safe)
+    conn = getattr(_local, "conn", None)
+    if conn is not None and getattr(_local, "pid", None) == os.getpid():
+        return conn
+
+    directory = os.path.dirname(JOB_STORE_PATH)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(JOB_STORE_PATH, timeout=10.0, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    with _init_lock:
+        if JOB_STORE_PATH not in _initialized_paths:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY,"
+                " status TEXT NOT NULL,"
+                " request TEXT NOT NULL,"
+                " agent_flow TEXT NOT NULL DEFAULT '[]',"
+                " result TEXT,"
+                " error TEXT,"
+                " owner TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "owner_pid" in columns:
+                # Stores written by older versions: their owners match no
+                # worker row, so their unfinished jobs are reclaimed
+                conn.execute("ALTER TABLE jobs RENAME COLUMN owner_pid TO owner")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS job_workers ("
+                " worker TEXT PRIMARY KEY,"
+                " pid INTEGER NOT NULL,"
+                " heartbeat_at REAL NOT NULL)"
+            )
+            _initialized_paths.add(JOB_STORE_PATH)
+    _local.conn = conn
+    _local.pid = os.getpid()
+    return conn
+
+
+def create_job(request: Dict[str, Any]) -> str:
+    """Store a new queued job owned by this worker and return its id."""
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    conn = _connect()
+    _heartbeat(conn, now)
+    conn.execute(
+        "INSERT INTO jobs (id, status, request, owner, created_at, updated_at)"
+        " VALUES (?, ?, ?, ?, ?, ?)",
+        (job_id, QUEUED, json.dumps(request), worker_id(), now, now),
+    )
+    _prune(conn, now)
+    return job_id
+
+
+def _heartbeat(conn: sqlite3.Connection, now: float) -> None:
+    conn.execute(
+        "INSERT OR REPLACE INTO job_workers (worker, pid, heartbeat_at) VALUES (?, ?, ?)",
+        (worker_id(), os.getpid(), now),
+    )
+
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    row = _connect().execute(
+        "SELECT id, status, agent_flow, result, error, created_at, updated_at"
+        " FROM jobs WHERE id = ?",
+        (job_id,),
+    ).fetchone()
+    if row is None:
+        return None
+    job_id, status, agent_flow, result, error, created_at, updated_at = row
+    return {
+        "job_id": job_id,
+        "status": status,
+        "agent_flow": json.loads(agent_flow),
+        "result": json.loads(result) if result is not None else None,
+        "error": error,
+        "created_at": created_at,
+        "updated_at": updated_at,
+    }
+
+
+def _update(job_id: str, **fields: Any) -> None:
+    fields["updated_at"] = time.time()
+    columns = ", ".join(f"{name} = ?" for name in fields)
+    _connect().execute(
+        f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id)
+    )
+
+
+def mark_running(job_id: str) -> None:
+    _update(job_id, status=RUNNING)
+
+
+def set_agent_flow(job_id: str, agent_flow: List[Dict[str, Any]]) -> None:
+    """Record the agents finished so far (partial results for polling)."""
+    _update(job_id, agent_flow=json.dumps(agent_flow))
+
+
+def complete_job(job_id: str, result: Dict[str, Any]) -> None:
+    _update(
+        job_id,
+        status=SUCCEEDED,
+        result=json.dumps(result),
+        agent_flow=json.dumps(result.get("agent_flow", [])),
+    )
+
+
+def fail_job(job_id: str, error: str) -> None:
+    _update(job_id, status=FAILED, error=error)
+
+
+def claim_orphaned_jobs() -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    Take over unfinished jobs whose worker is gone: its pid no longer
+    exists or its heartbeat is older than JOB_LEASE_SECONDS.
+
+    They are reset to queued (partial progress is discarded) and owned by
+    this worker. Also renews this worker's heartbeat. Returns
+    [(job_id, request), ...] to be run again.
+    """
+    conn = _connect()
+    me = worker_id()
+    claimed = []
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        now = time.time()
+        _heartbeat(conn, now)
+        live = set()
+        for worker, pid, heartbeat_at in conn.execute(
+            "SELECT worker, pid, heartbeat_at FROM job_workers"
+        ).fetchall():
+            if heartbeat_at >= now - JOB_LEASE_SECONDS and pid_alive(pid):
+                live.add(worker)
+            else:
+                conn.execute("DELETE FROM job_workers WHERE worker = ?", (worker,))
+        rows = conn.execute(
+            "SELECT id, request, owner FROM jobs WHERE status IN (?, ?)",
+            (QUEUED, RUNNING),
+        ).fetchall()
+        for job_id, request, owner in rows:
+            if owner == me or owner in live:
+                continue
+            conn.execute(
+                "UPDATE jobs SET status = ?, agent_flow = '[]', owner = ?,"
+                " updated_at = ? WHERE id = ?",
+                (QUEUED, me, now, job_id),
+            )
+            claimed.append((job_id, json.loads(request)))
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return claimed
+
+
+def _prune(conn: sqlite3.Connection, now: float) -> None:
+    # Finished jobs are kept for JOB_TTL_SECONDS for polling, then dropped
+    conn.execute(
+        "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+        (SUCCEEDED, FAILED, now - JOB_TTL_SECONDS),
+    )
@@ -0,0 +1,213 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from healthbackend.config.settings import JOB_MAX_QUEUED, JOB_WORKERS
+from healthbackend.services import job_store
+from healthbackend.services.agent_graph import AgentNode
+from healthbackend.services.background_loop import get_background_loop
+from healthbackend.services.metrics import register_collector
+from healthbackend.services.orchestrator import orchestrate
+from healthbackend.utils.exceptions import InputError, OverloadError
+
+logger = logging.getLogger("healthbackend")
+
+# How often a worker renews its job lease and looks for jobs left behind by
+# dead workers (seconds); keep it well below JOB_LEASE_SECONDS
+ORPHAN_SCAN_INTERVAL = 5.0
+
+
+# ------------------------------------------------------------
+# Background /health-assist jobs
+# ------------------------------------------------------------
+# A submitted job is stored as "queued" and scheduled on this worker's
+# background event loop; at most JOB_WORKERS of them run orchestrate() at a
+# time, the rest wait on a semaphore. Each finished agent is written to the
+# store, so polling clients see the partial agent_flow while the job runs.
+#
+# Jobs survive restarts: every worker runs a heartbeat thread that renews
+# its lease on its jobs and takes over queued/running jobs whose owner is
+# gone (see job_store.claim_orphaned_jobs), running them again.
+#
+# The background loop also serves /chat_stream and the LLM calls, so job
+# store writes (SQLite, which can wait on another worker's lock) run on one
+# writer thread per worker; a single thread keeps each job's writes in order.
+_lock = threading.Lock()
+_pending = 0  # jobs of this process that are queued or running
+_slots: Optional[asyncio.Semaphore] = None
+_slots_pid: Optional[int] = None
+_writer: Optional[ThreadPoolExecutor] = None
+_writer_pid: Optional[int] = None
+_last_scan = 0.0
+_heartbeat_pid: Optional[int] = None
+
+
+def _job_slots() -> asyncio.Semaphore:
+    # Created on the background loop thread, once per worker process
+    global _slots, _slots_pid
+    if _slots is None or _slots_pid != os.getpid():
+        _slots = asyncio.Semaphore(JOB_WORKERS)
+        _slots_pid = os.getpid()
+    return _slots
+
+
+def _store_writer() -> ThreadPoolExecutor:
+    # Threads do not survive a fork: one writer per worker process
+    global _writer, _writer_pid
+    with _lock:
+        if _writer is None or _writer_pid != os.getpid():
+            _writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-store")
+            _writer_pid = os.getpid()
+        return _writer
+
+
+def _log_write_error(future: Future) -> None:
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("Job store write failed", exc_info=future.exception())
+
+
+def _write_later(fn: Callable[..., None], *args: Any) -> None:
+    """Queue a job store write without waiting for it (sync callbacks)."""
+    _store_writer().submit(fn, *args).add_done_callback(_log_write_error)
+
+
+async def _write(fn: Callable[..., None], *args: Any) -> None:
+    """Run a job store write on the writer thread, off the event loop."""
+    await asyncio.get_running_loop().run_in_executor(_store_writer(), fn, *args)
+
+
+async def _run_job(job_id: str, request: Dict[str, Any]) -> None:
+    global _pending
+    agent_flow = []
+
+    def on_agent_done(node: AgentNode, entry: Dict[str, Any]) -> None:
+        agent_flow.append(entry)
+        _write_later(job_store.set_agent_flow, job_id, list(agent_flow))
+
+    try:
+        async with _job_slots():
+            await _write(job_store.mark_running, job_id)
+            result = await orchestrate(
+                request["symptoms"],
+                request.get("medical_report"),
+                request.get("user_id", "guest"),
+                session_id=request.get("session_id"),
+                use_cache=request.get("use_cache", True),
+                # The intent filter runs alongside the agents, inside the job
+                check_intent=True,
+                on_agent_done=on_agent_done,
+            )
+        await _write(job_store.complete_job, job_id, result)
+    except asyncio.CancelledError:
+        # The worker is shutting down. The job is left queued/running on
+        # purpose: once this worker's lease lapses another worker claims it
+        # and runs it again (see job_store.claim_orphaned_jobs).
+        logger.info("Job %s interrupted; it will be resumed by another worker", job_id)
+        raise
+    except InputError as e:
+        await _write(job_store.fail_job, job_id, str(e))
+    except Exception as e:
+        logger.exception("Job %s failed", job_id)
+        await _write(job_store.fail_job, job_id, f"Job failed: {e}")
+    finally:
+        with _lock:
+            _pending -= 1
+
+
+def _schedule(job_id: str, request: Dict[str, Any]) -> None:
+    # The caller has already counted the job in _pending
+    asyncio.run_coroutine_threadsafe(_run_job(job_id, request), get_background_loop())
+
+
+def _heartbeat_loop() -> None:
+    while True:
+        time.sleep(ORPHAN_SCAN_INTERVAL)
+        try:
+            resume_orphaned_jobs(force=True)
+        except Exception:
+            logger.exception("Job heartbeat failed")
+
+
+def _ensure_heartbeat() -> None:
+    # One heartbeat thread per worker process (threads do not survive a fork)
+    global _heartbeat_pid
+    with _lock:
+        if _heartbeat_pid == os.getpid():
+            return
+        _heartbeat_pid = os.getpid()
+    threading.Thread(target=_heartbeat_loop, name="job-heartbeat", daemon=True).start()
+
+
+def resume_orphaned_jobs(force: bool = False) -> int:
+    """
+    Re-run jobs whose worker died before finishing them, and renew this
+    worker's lease on its own jobs.
+
+    Called at worker start, every ORPHAN_SCAN_INTERVAL seconds by the
+    heartbeat thread (started on the first call) and, at most that often,
+    from the job routes. Returns the number of jobs taken over.
+    """
+    global _last_scan, _pending
+    _ensure_heartbeat()
+    now = time.monotonic()
+    with _lock:
+        if not force and now - _last_scan < ORPHAN_SCAN_INTERVAL:
+            return 0
+        _last_scan = now
+
+    claimed = job_store.claim_orphaned_jobs()
+    with _lock:
+        _pending += len(claimed)
+    for job_id, request in claimed:
+        logger.info("Resuming job %s left by a stopped worker", job_id)
+        _schedule(job_id, request)
+    return len(claimed)
+
+
+def submit_job(request: Dict[str, Any]) -> str:
+    """
+    Queue a health-assist run and return its job id.
+
+    `request` holds the orchestrate() arguments (symptoms, medical_report,
+    user_id, session_id, use_cache). Raises OverloadError when this worker
+    already has JOB_MAX_QUEUED unfinished jobs.
+    """
+    global _pending
+    resume_orphaned_jobs()
+    with _lock:
+        if _pending >= JOB_MAX_QUEUED:
+            raise OverloadError("Too many queued jobs, try again later")
+        _pending += 1
+
+    try:
+        job_id = job_store.create_job(request)
+    except BaseException:
+        with _lock:
+            _pending -= 1
+        raise
+    _schedule(job_id, request)
+    return job_id
+
+
+def get_job_status(job_id: str) -> Optional[Dict[str, Any]]:
+    """Current state of a job (see job_store.get_job), or None if unknown."""
+    resume_orphaned_jobs()
+    return job_store.get_job(job_id)
+
+
+def _collect_metrics():
+    with _lock:
+        pending = _pending
+    yield (
+        "jobs_pending",
+        "gauge",
+        "Health-assist jobs queued or running in this worker",
+        [({}, pending)],
+    )
+
+
+register_collector(_collect_metrics)
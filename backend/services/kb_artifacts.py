@@ -0,0 +1,134 @@
+import json
+import os
+import re
+import shutil
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+
+# ------------------------------------------------------------
+# Prebuilt knowledge base index layout
+# ------------------------------------------------------------
+# <index_dir>/
+#     CURRENT                 name of the live version, replaced atomically
+#     v000001/
+#         manifest.json       build parameters, sources (hash, chunk range)
+#         chunks.jsonl        one {"title", "content", "topic", "source", "simhash"} per line
+#         lexical.json        BM25 postings (see BM25Index.to_dict)
+#         vectors.npy         (n_chunks, dim) float32 unit vectors, memory-mapped
+#     v000002/ ...
+FORMAT_VERSION = 1
+CURRENT_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+CHUNKS_FILE = "chunks.jsonl"
+LEXICAL_FILE = "lexical.json"
+VECTORS_FILE = "vectors.npy"
+
+_VERSION_RE = re.compile(r"^v(\d{6})$")
+
+
+def current_version(index_dir: str) -> Optional[str]:
+    """Name of the live version, or None if nothing was published yet."""
+    try:
+        with open(os.path.join(index_dir, CURRENT_FILE), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def version_path(index_dir: str, version: str, name: str = "") -> str:
+    return os.path.join(index_dir, version, name) if name else os.path.join(index_dir, version)
+
+
+def read_manifest(index_dir: str, version: str) -> Dict[str, Any]:
+    with open(version_path(index_dir, version, MANIFEST_FILE), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def iter_chunks(index_dir: str, version: str) -> Iterator[Dict[str, Any]]:
+    with open(version_path(index_dir, version, CHUNKS_FILE), encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_lexical(index_dir: str, version: str) -> Dict[str, Any]:
+    with open(version_path(index_dir, version, LEXICAL_FILE), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def open_vectors(index_dir: str, version: str) -> np.ndarray:
+    """The version's vectors, memory-mapped read-only."""
+    return np.load(version_path(index_dir, version, VECTORS_FILE), mmap_mode="r")
+
+
+def _versions(index_dir: str) -> List[str]:
+    if not os.path.isdir(index_dir):
+        return []
+    return sorted(name for name in os.listdir(index_dir) if _VERSION_RE.match(name))
+
+
+def next_version(index_dir: str) -> str:
+    existing = _versions(index_dir)
+    number = int(_VERSION_RE.match(existing[-1]).group(1)) + 1 if existing else 1
+    return f"v{number:06d}"
+
+
+# ------------------------------------------------------------
+# Writing
+# ------------------------------------------------------------
+class VectorWriter:
+    """
+    Append float32 rows to a scratch file and turn them into an `.npy` at
+    the end, so ingesting a large corpus never holds every vector in memory.
+    """
+
+    def __init__(self, path: str, dim: int):
+        self.path = path
+        self.dim = dim
+        self.rows = 0
+        self._raw_path = path + ".raw"
+        self._raw = open(self._raw_path, "wb")
+
+    def append(self, vector: np.ndarray) -> None:
+        self._raw.write(np.ascontiguousarray(vector, dtype=np.float32).tobytes())
+        self.rows += 1
+
+    def close(self) -> None:
+        self._raw.close()
+        out = np.lib.format.open_memmap(self.path, mode="w+", dtype=np.float32, shape=(self.rows, self.dim))
+        if self.rows:
+            out[:] = np.memmap(self._raw_path, dtype=np.float32, mode="r", shape=(self.rows, self.dim))
+        out.flush()
+        del out
+        os.remove(self._raw_path)
+
+
+def staging_path(index_dir: str) -> str:
+    """A fresh scratch directory inside `index_dir` for building a version."""
+    path = os.path.join(index_dir, f".staging-{os.getpid()}")
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    return path
+
+
+def publish_version(index_dir: str, staging: str) -> str:
+    """Move a fully written staging directory into place and make it live."""
+    version = next_version(index_dir)
+    os.rename(staging, version_path(index_dir, version))
+    tmp_path = os.path.join(index_dir, f"{CURRENT_FILE}.{os.getpid()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(version + "\n")
+    os.replace(tmp_path, os.path.join(index_dir, CURRENT_FILE))
+    return version
+
+
+def prune_versions(index_dir: str, keep: int) -> List[str]:
+    """Delete all but the newest `keep` versions (never the live one)."""
+    live = current_version(index_dir)
+    removed = []
+    for version in _versions(index_dir)[: -max(keep, 1)]:
+        if version != live:
+            shutil.rmtree(version_path(index_dir, version), ignore_errors=True)
+            removed.append(version)
+    return removed
@@ -0,0 +1,212 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable
+
+from healthbackend.utils.processes import pid_alive, worker_id
+
+logger = logging.getLogger("healthbackend")
+
+# key -> scheduling state (see api_key_pool)
+KeyState = Dict[str, Dict[str, float]]
+Transaction = Callable[[KeyState], Any]
+
+
+# ------------------------------------------------------------
+# Key-pool state backends
+# ------------------------------------------------------------
+# A backend owns the per-key state dicts of api_key_pool and exposes one
+# operation, `transact(fn)`: run `fn(state)` atomically, persisting whatever
+# it changed. The state dicts hold plain floats; `in_flight` is the number of
+# calls in flight on that key across every process sharing the backend.
+class InMemoryKeyPoolBackend:
+    """State in a module dict; shared by the threads of one process only."""
+
+    # Transactions never wait on another process
+    blocking = False
+
+    def __init__(self, keys: Iterable[str], new_state: Callable[[float], Dict[str, float]]):
+        self._lock = threading.Lock()
+        self._state: KeyState = {k: new_state(0.0) for k in keys}
+
+    def transact(self, fn: Transaction) -> Any:
+        with self._lock:
+            return fn(self._state)
+
+
+class SQLiteKeyPoolBackend:
+    """
+    State in a SQLite file (WAL mode) shared by every worker on the node.
+
+    Each transaction runs under BEGIN IMMEDIATE, so rotation, buckets and
+    cooldowns stay consistent across processes. In-flight calls are counted
+    per worker (`worker_id()`, never reused like a pid); reservations of a
+    worker that died (crash, OOM kill, container restart) are dropped so they
+    do not block the key forever. A worker counts as dead when its pid is gone
+    or it has not made a transaction for LEASE_SECONDS; a live worker making
+    calls transacts at least once per call.
+    """
+
+    # Transactions can wait on other workers' locks (see api_key_pool.offload)
+    blocking = True
+
+    # How often to look for dead worker processes (seconds)
+    REAP_INTERVAL = 5.0
+    # A worker silent for this long has its reservations dropped (seconds)
+    LEASE_SECONDS = 300.0
+
+    def __init__(
+        self,
+        path: str,
+        keys: Iterable[str],
+        new_state: Callable[[float], Dict[str, float]],
+    ):
+        self.path = path
+        self.keys = list(keys)
+        self._new_state = new_state
+        self._local = threading.local()
+        self._last_reap = 0.0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS key_state ("
+            " key TEXT PRIMARY KEY,"
+            " state TEXT NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS key_reservations ("
+            " key TEXT NOT NULL,"
+            " worker TEXT NOT NULL,"
+            " count INTEGER NOT NULL,"
+            " PRIMARY KEY (key, worker))"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS key_pool_workers ("
+            " worker TEXT PRIMARY KEY,"
+            " pid INTEGER NOT NULL,"
+            " seen_at REAL NOT NULL)"
+        )
+        self.transact(lambda state: None)
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread (sqlite3 connections are not thread-safe)
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            # A forked worker must not reuse its parent's connection
+            conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def transact(self, fn: Transaction) -> Any:
+        conn = self._connect()
+        worker = worker_id()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            conn.execute(
+                "INSERT OR REPLACE INTO key_pool_workers (worker, pid, seen_at) VALUES (?, ?, ?)",
+                (worker, os.getpid(), now),
+            )
+            if now - self._last_reap >= self.REAP_INTERVAL:
+                self._reap_dead_workers(conn, now - self.LEASE_SECONDS)
+                self._last_reap = now
+
+            state = self._load(conn, now)
+            before = {k: dict(s) for k, s in state.items()}
+            result = fn(state)
+
+            for key, s in state.items():
+                if s == before.get(key):
+                    continue
+                delta = int(s["in_flight"] - before[key]["in_flight"])
+                if delta:
+                    self._add_in_flight(conn, key, worker, delta)
+                stored = {k: v for k, v in s.items() if k != "in_flight"}
+                conn.execute(
+                    "INSERT OR REPLACE INTO key_state (key, state) VALUES (?, ?)",
+                    (key, json.dumps(stored)),
+                )
+            conn.execute("COMMIT")
+            return result
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _load(self, conn: sqlite3.Connection, now: float) -> KeyState:
+        rows = dict(conn.execute("SELECT key, state FROM key_state").fetchall())
+        in_flight = dict(
+            conn.execute(
+                "SELECT key, SUM(count) FROM key_reservations GROUP BY key"
+            ).fetchall()
+        )
+        state: KeyState = {}
+        for key in self.keys:
+            raw = rows.get(key)
+            if raw is None:
+                s = self._new_state(now)
+                conn.execute(
+                    "INSERT INTO key_state (key, state) VALUES (?, ?)",
+                    (key, json.dumps({k: v for k, v in s.items() if k != "in_flight"})),
+                )
+            else:
+                # Fields added in newer versions start from their defaults
+                s = {**self._new_state(now), **json.loads(raw)}
+            s["in_flight"] = float(in_flight.get(key) or 0)
+            state[key] = s
+        return state
+
+    @staticmethod
+    def _add_in_flight(conn: sqlite3.Connection, key: str, worker: str, delta: int) -> None:
+        conn.execute(
+            "INSERT INTO key_reservations (key, worker, count) VALUES (?, ?, ?)"
+            " ON CONFLICT (key, worker) DO UPDATE SET count = count + excluded.count",
+            (key, worker, delta),
+        )
+        conn.execute("DELETE FROM key_reservations WHERE count <= 0")
+
+    @staticmethod
+    def _reap_dead_workers(conn: sqlite3.Connection, stale_before: float) -> None:
+        rows = conn.execute("SELECT worker, pid, seen_at FROM key_pool_workers").fetchall()
+        for worker, pid, seen_at in rows:
+            if seen_at >= stale_before and pid_alive(pid):
+                continue
+            dropped = conn.execute(
+                "DELETE FROM key_reservations WHERE worker = ?", (worker,)
+            ).rowcount
+            if dropped:
+                logger.info("Key pool: dropping in-flight calls of dead worker %s (pid %s)", worker, pid)
+            conn.execute("DELETE FROM key_pool_workers WHERE worker = ?", (worker,))
+        # Reservations whose worker row is already gone
+        conn.execute(
+            "DELETE FROM key_reservations"
+            " WHERE worker NOT IN (SELECT worker FROM key_pool_workers)"
+        )
+
+
+def create_backend(
+    kind: str, path: str, keys: Iterable[str], new_state: Callable[[float], Dict[str, float]]
+):
+    """
+    Build the configured backend ("memory" or "sqlite").
+
+    Falls back to the in-memory backend if the SQLite file cannot be used,
+    so a read-only deployment still serves requests.
+    """
+    keys = list(keys)
+    if kind == "sqlite":
+        try:
+            return SQLiteKeyPoolBackend(path, keys, new_state)
+        except (OSError, sqlite3.Error) as e:
+            logger.warning("Key pool: SQLite backend unavailable (%s), using memory", e)
+    elif kind != "memory":
+        raise ValueError(f"Unknown KEY_POOL_BACKEND: {kind!r}")
+    return InMemoryKeyPoolBackend(keys, new_state)
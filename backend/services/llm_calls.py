@@ -0,0 +1,449 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+import httpx
+import openai
+
+from healthbackend.config.settings import (
+    GROQ_MODEL_NAME,
+    KEY_ACQUIRE_TIMEOUT,
+    LLM_BACKOFF_BASE,
+    LLM_BACKOFF_CAP,
+    LLM_CALL_DEADLINE,
+    LLM_HEDGE_ENABLED,
+    LLM_HEDGE_MIN_DELAY,
+    LLM_HEDGE_MIN_SAMPLES,
+    LLM_HEDGE_PERCENTILE,
+    LLM_COMPLETION_TOKEN_ESTIMATE,
+    LLM_MAX_ATTEMPTS,
+)
+from healthbackend.services import llm_memo
+from healthbackend.services.api_key_pool import (
+    aacquire_key,
+    acquire_key,
+    atry_acquire_key,
+    mark_key_quota_exceeded,
+    mark_key_rate_limited,
+    offload,
+    release_key,
+)
+from healthbackend.services.llm_clients import get_chat_model
+from healthbackend.services.memory import estimate_tokens
+from healthbackend.services.metrics import TOKEN_BUCKETS, counter, histogram, span
+
+logger = logging.getLogger("healthbackend")
+
+# Error classes, in order of how the call layer reacts to them
+RATE_LIMIT = "rate_limit"  # short per-key cooldown (Retry-After), try another key
+QUOTA = "quota"  # key exhausted / unusable: long cooldown, try another key
+TRANSIENT = "transient"  # timeout, connection error, 5xx: back off and retry
+FATAL = "fatal"  # bad request etc.: retrying will not help
+
+# Async callback that receives each text chunk as the LLM streams it
+TokenCallback = Callable[[str], Awaitable[None]]
+
+_attempts = counter(
+    "llm_attempts_total", "LLM requests sent, by call label and outcome", ("label", "outcome")
+)
+_memo_hits = counter("llm_memo_hits_total", "LLM calls answered from the memo", ("label",))
+_prompt_tokens = histogram(
+    "llm_prompt_tokens", "Prompt tokens per LLM request", ("label",), TOKEN_BUCKETS
+)
+_completion_tokens = histogram(
+    "llm_completion_tokens", "Completion tokens per LLM request", ("label",), TOKEN_BUCKETS
+)
+_first_token = histogram(
+    "llm_first_token_seconds", "Time to the first streamed chunk", ("label",)
+)
+
+
+def classify_error(exc: BaseException) -> str:
+    """Map an exception from an LLM call to RATE_LIMIT / QUOTA / TRANSIENT / FATAL."""
+    if isinstance(exc, openai.RateLimitError):
+        message = str(exc).lower()
+        if getattr(exc, "code", None) == "insufficient_quota" or "per day" in message:
+            return QUOTA
+        return RATE_LIMIT
+    if isinstance(exc, (openai.AuthenticationError, openai.PermissionDeniedError)):
+        return QUOTA
+    if isinstance(
+        exc,
+        (
+            openai.APITimeoutError,
+            openai.APIConnectionError,
+            openai.InternalServerError,
+            httpx.TransportError,
+            asyncio.TimeoutError,
+        ),
+    ):
+        return TRANSIENT
+    if isinstance(exc, openai.APIStatusError):
+        if exc.status_code >= 500 or exc.status_code in (408, 409):
+            return TRANSIENT
+        return FATAL
+    return FATAL
+
+
+def _retry_after(exc: BaseException) -> Optional[float]:
+    response = getattr(exc, "response", None)
+    if response is None:
+        return None
+    value = response.headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def _backoff(attempt: int) -> float:
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(LLM_BACKOFF_CAP, LLM_BACKOFF_BASE * (2 ** attempt)))
+
+
+def _estimate_call_tokens(messages: List, max_tokens: Optional[int]) -> int:
+    """Prompt tokens plus the completion budget, charged to the key up front."""
+    prompt = sum(estimate_tokens(m.content) for m in messages)
+    return prompt + (max_tokens or LLM_COMPLETION_TOKEN_ESTIMATE)
+
+
+def _usage(message) -> Tuple[Optional[int], Optional[Dict[str, str]]]:
+    """(total tokens, response headers) reported for a reply, when available."""
+    usage = getattr(message, "usage_metadata", None) or {}
+    metadata = getattr(message, "response_metadata", None) or {}
+    return usage.get("total_tokens"), metadata.get("headers")
+
+
+def _record_tokens(label: str, message) -> None:
+    # Prompt / completion split reported by the API (last chunk when streaming)
+    usage = getattr(message, "usage_metadata", None) or {}
+    if usage.get("input_tokens") is not None:
+        _prompt_tokens.observe(usage["input_tokens"], label=label)
+    if usage.get("output_tokens") is not None:
+        _completion_tokens.observe(usage["output_tokens"], label=label)
+
+
+def _acquire_timeout(deadline: float) -> float:
+    return max(min(KEY_ACQUIRE_TIMEOUT, deadline - time.monotonic()), 0.0)
+
+
+def _handle_failure(key: str, exc: BaseException, label: str) -> str:
+    """Apply the key-pool side effect for a failed attempt and return its class."""
+    kind = classify_error(exc)
+    _attempts.inc(label=label, outcome=kind)
+    logger.warning("LLM call %s failed (%s) on key …%s: %s", label, kind, key[-4:], exc)
+    if kind == RATE_LIMIT:
+        mark_key_rate_limited(key, _retry_after(exc))
+    elif kind == QUOTA:
+        mark_key_quota_exceeded(key)
+    return kind
+
+
+# ------------------------------------------------------------
+# Latency tracking for hedged requests
+# ------------------------------------------------------------
+_latency_lock = threading.Lock()
+_latencies: Dict[str, Deque[float]] = {}
+
+
+def _record_latency(label: str, seconds: float) -> None:
+    with _latency_lock:
+        _latencies.setdefault(label, deque(maxlen=200)).append(seconds)
+
+
+def _hedge_delay(label: str) -> Optional[float]:
+    """Seconds to wait before hedging a call, or None if hedging is off."""
+    if not LLM_HEDGE_ENABLED:
+        return None
+    with _latency_lock:
+        samples = sorted(_latencies.get(label, ()))
+    if len(samples) < LLM_HEDGE_MIN_SAMPLES:
+        return None
+    idx = min(len(samples) - 1, int(len(samples) * LLM_HEDGE_PERCENTILE / 100))
+    return max(samples[idx], LLM_HEDGE_MIN_DELAY)
+
+
+def _memo_params(temperature: float, max_tokens: Optional[int]) -> Dict[str, Any]:
+    params: Dict[str, Any] = {"temperature": temperature}
+    if max_tokens is not None:
+        params["max_tokens"] = max_tokens
+    return params
+
+
+class _AttemptError(Exception):
+    """A failed attempt, remembering which key it used."""
+
+    def __init__(self, key: str, cause: BaseException):
+        super().__init__(str(cause))
+        self.key = key
+        self.cause = cause
+        # Error class, set once `_handle_failure` has accounted for it
+        self.kind: Optional[str] = None
+
+
+# ------------------------------------------------------------
+# Async call layer
+# ------------------------------------------------------------
+async def _invoke_once(
+    messages: List,
+    key: str,
+    estimate: int,
+    temperature: float,
+    max_tokens: Optional[int],
+    label: str,
+) -> str:
+    """One request on an acquired key; always releases the key."""
+    llm = get_chat_model(key, temperature=temperature, max_tokens=max_tokens)
+    used, headers = None, None
+    try:
+        result = await llm.ainvoke(messages)
+        used, headers = _usage(result)
+        _record_tokens(label, result)
+        return result.content
+    except Exception as e:
+        raise _AttemptError(key, e) from e
+    finally:
+        await offload(release_key, key, estimate, used, headers)
+
+
+async def _hedged_invoke(
+    messages: List, label: str, temperature: float, max_tokens: Optional[int], deadline: float
+) -> str:
+    """One logical attempt; fires a duplicate on another key if it is slow."""
+    estimate = _estimate_call_tokens(messages, max_tokens)
+    key = await aacquire_key(estimate, timeout=_acquire_timeout(deadline))
+    started = time.monotonic()
+    primary = asyncio.create_task(
+        _invoke_once(messages, key, estimate, temperature, max_tokens, label)
+    )
+    tasks = {primary}
+
+    delay = _hedge_delay(label)
+    try:
+        if delay is not None:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                # Only hedge on a key that is free right now
+                hedge_key = await atry_acquire_key(estimate, exclude=(key,))
+                if hedge_key is not None:
+                    logger.info("Hedging slow LLM call %s after %.2fs", label, delay)
+                    tasks.add(
+                        asyncio.create_task(
+                            _invoke_once(
+                                messages, hedge_key, estimate, temperature, max_tokens, label
+                            )
+                        )
+                    )
+
+        # Take the first successful reply; only fail when every copy failed.
+        # Every failed copy puts its own key on cooldown as it completes,
+        # even when another copy goes on to succeed.
+        first_error: Optional[BaseException] = None
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                error = task.exception()
+                if error is None:
+                    _record_latency(label, time.monotonic() - started)
+                    _attempts.inc(label=label, outcome="ok")
+                    return task.result()
+                if isinstance(error, _AttemptError):
+                    error.kind = await offload(_handle_failure, error.key, error.cause, label)
+                if first_error is None:
+                    # Raised once every copy has failed: the earliest failure
+                    first_error = error
+        raise first_error
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def stream_llm(
+    messages: List,
+    label: str,
+    temperature: float = 0.0,
+    max_tokens: Optional[int] = None,
+) -> AsyncIterator[str]:
+    """
+    Stream reply chunks with the same error handling as `call_llm`.
+
+    Retries only happen before the first chunk has been yielded (a retry
+    after that would repeat text the caller already consumed). No hedging.
+    """
+    deadline = time.monotonic() + LLM_CALL_DEADLINE
+    estimate = _estimate_call_tokens(messages, max_tokens)
+    for attempt in range(LLM_MAX_ATTEMPTS):
+        key = await aacquire_key(estimate, timeout=_acquire_timeout(deadline))
+        llm = get_chat_model(key, temperature=temperature, max_tokens=max_tokens)
+        started = time.monotonic()
+        yielded = False
+        # Headers arrive on the first chunk, usage on the last one
+        used, headers, last_chunk = None, None, None
+        stream = None
+        try:
+            stream = llm.astream(messages).__aiter__()
+            while True:
+                remaining = deadline - time.monotonic()
+                try:
+                    chunk = await asyncio.wait_for(stream.__anext__(), timeout=max(remaining, 0.001))
+                except StopAsyncIteration:
+                    break
+                chunk_used, chunk_headers = _usage(chunk)
+                if chunk_used:
+                    last_chunk = chunk
+                used = chunk_used or used
+                headers = chunk_headers or headers
+                text = getattr(chunk, "content", "") or ""
+                if text:
+                    if not yielded:
+                        elapsed = time.monotonic() - started
+                        _record_latency(f"{label}:first_token", elapsed)
+                        _first_token.observe(elapsed, label=label)
+                    yielded = True
+                    yield text
+            _attempts.inc(label=label, outcome="ok")
+            if last_chunk is not None:
+                _record_tokens(label, last_chunk)
+            return
+        except Exception as e:
+            error = e
+        finally:
+            # Also when the consumer abandons us: close the HTTP response now, not at GC
+            if stream is not None:
+                try:
+                    await stream.aclose()
+                except Exception:
+                    logger.debug("Closing LLM stream %s failed", label, exc_info=True)
+            await offload(release_key, key, estimate, used, headers)
+
+        kind = await offload(_handle_failure, key, error, label)
+        if yielded or kind == FATAL or attempt == LLM_MAX_ATTEMPTS - 1:
+            raise error
+        delay = 0.0 if kind in (RATE_LIMIT, QUOTA) else _backoff(attempt)
+        if time.monotonic() + delay >= deadline:
+            raise error
+        await asyncio.sleep(delay)
+
+
+async def call_llm(
+    messages: List,
+    label: str,
+    temperature: float = 0.0,
+    max_tokens: Optional[int] = None,
+    on_token: Optional[TokenCallback] = None,
+) -> str:
+    """
+    The single entry point for async LLM calls.
+
+    - Deterministic calls are answered from the disk memo when possible.
+    - Failures are classified (rate limit, quota, transient, fatal); the key
+      pool is updated accordingly and retryable errors are retried with
+      jittered exponential backoff, within LLM_MAX_ATTEMPTS and an overall
+      LLM_CALL_DEADLINE.
+    - Non-streaming calls slower than the LLM_HEDGE_PERCENTILE latency for
+      `label` are hedged on another key (LLM_HEDGE_ENABLED).
+    - With `on_token` the reply is streamed and each chunk forwarded.
+    """
+    memo_params = _memo_params(temperature, max_tokens)
+    # The memo is a SQLite file shared with other workers: keep it off the loop
+    cached = await asyncio.to_thread(llm_memo.lookup, messages, GROQ_MODEL_NAME, memo_params)
+    if cached is not None:
+        _memo_hits.inc(label=label)
+        if on_token is not None:
+            await on_token(cached)
+        return cached
+
+    # Whole call: key waits, retries, backoff and hedges included
+    with span("llm_call", label=label):
+        if on_token is not None:
+            parts = []
+            async for text in stream_llm(messages, label, temperature, max_tokens):
+                parts.append(text)
+                await on_token(text)
+            content = "".join(parts)
+        else:
+            content = await _call_with_retries(messages, label, temperature, max_tokens)
+
+    await asyncio.to_thread(llm_memo.store, messages, GROQ_MODEL_NAME, memo_params, content)
+    return content
+
+
+async def _call_with_retries(
+    messages: List, label: str, temperature: float, max_tokens: Optional[int]
+) -> str:
+    deadline = time.monotonic() + LLM_CALL_DEADLINE
+    for attempt in range(LLM_MAX_ATTEMPTS):
+        remaining = deadline - time.monotonic()
+        try:
+            return await asyncio.wait_for(
+                _hedged_invoke(messages, label, temperature, max_tokens, deadline),
+                timeout=max(remaining, 0.001),
+            )
+        except _AttemptError as e:
+            kind = e.kind or await offload(_handle_failure, e.key, e.cause, label)
+            if kind == FATAL or attempt == LLM_MAX_ATTEMPTS - 1:
+                raise e.cause
+            delay = 0.0 if kind in (RATE_LIMIT, QUOTA) else _backoff(attempt)
+            if time.monotonic() + delay >= deadline:
+                raise e.cause
+            await asyncio.sleep(delay)
+    raise AssertionError("unreachable")
+
+
+# ------------------------------------------------------------
+# Sync call layer (Flask views that are not async yet)
+# ------------------------------------------------------------
+def call_llm_sync(
+    messages: List,
+    label: str,
+    temperature: float = 0.0,
+    max_tokens: Optional[int] = None,
+) -> str:
+    """Blocking `call_llm` without streaming or hedging."""
+    memo_params = _memo_params(temperature, max_tokens)
+    cached = llm_memo.lookup(messages, GROQ_MODEL_NAME, memo_params)
+    if cached is not None:
+        _memo_hits.inc(label=label)
+        return cached
+
+    with span("llm_call", label=label):
+        content = _call_sync_with_retries(messages, label, temperature, max_tokens)
+    llm_memo.store(messages, GROQ_MODEL_NAME, memo_params, content)
+    return content
+
+
+def _call_sync_with_retries(
+    messages: List, label: str, temperature: float, max_tokens: Optional[int]
+) -> str:
+    deadline = time.monotonic() + LLM_CALL_DEADLINE
+    estimate = _estimate_call_tokens(messages, max_tokens)
+    for attempt in range(LLM_MAX_ATTEMPTS):
+        key = acquire_key(estimate, timeout=_acquire_timeout(deadline))
+        llm = get_chat_model(key, temperature=temperature, max_tokens=max_tokens)
+        started = time.monotonic()
+        used, headers = None, None
+        try:
+            result = llm.invoke(messages)
+            used, headers = _usage(result)
+            _record_tokens(label, result)
+            content = result.content
+        except Exception as e:
+            release_key(key, estimate)
+            kind = _handle_failure(key, e, label)
+            if kind == FATAL or attempt == LLM_MAX_ATTEMPTS - 1:
+                raise
+            delay = 0.0 if kind in (RATE_LIMIT, QUOTA) else _backoff(attempt)
+            if time.monotonic() + delay >= deadline:
+                raise
+            time.sleep(delay)
+            continue
+        release_key(key, estimate, used, headers)
+        _record_latency(label, time.monotonic() - started)
+        _attempts.inc(label=label, outcome="ok")
+        return content
+    raise AssertionError("unreachable")
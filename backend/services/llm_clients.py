@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+import httpx
+from langchain_openai import ChatOpenAI
+
+from healthbackend.config.settings import (
+    GROQ_MODEL_NAME,
+    LLM_BASE_URL,
+    LLM_HTTP_TIMEOUT,
+    LLM_KEEPALIVE_EXPIRY,
+    LLM_POOL_MAX_CONNECTIONS,
+    LLM_POOL_MAX_KEEPALIVE,
+    LLM_PREWARM_CONNECTIONS,
+)
+
+logger = logging.getLogger("healthbackend")
+
+
+# ------------------------------------------------------------
+# Pooled HTTP clients
+# ------------------------------------------------------------
+# One connection pool is shared by every API key (keys only change the
+# Authorization header), so TLS connections to the LLM host are reused
+# across agents, keys and requests.
+#
+# httpx.AsyncClient pools are bound to the event loop that first uses them,
+# so async clients (and the ChatOpenAI instances that wrap them) are kept
+# per running loop. A loop that is closed and garbage collected takes its
+# clients with it.
+_lock = threading.Lock()
+_sync_http_client: Optional[httpx.Client] = None
+_async_http_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = (
+    weakref.WeakKeyDictionary()
+)
+
+# (api_key, model, temperature, max_tokens, streaming) -> ChatOpenAI
+_ModelKey = Tuple[str, str, float, Optional[int], bool]
+_sync_models: Dict[_ModelKey, ChatOpenAI] = {}
+_loop_models: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[_ModelKey, ChatOpenAI]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=LLM_POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_POOL_MAX_KEEPALIVE,
+        keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+    )
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(LLM_HTTP_TIMEOUT, connect=10.0)
+
+
+def get_sync_http_client() -> httpx.Client:
+    """Return the process-wide pooled sync HTTP client."""
+    global _sync_http_client
+    with _lock:
+        if _sync_http_client is None:
+            _sync_http_client = httpx.Client(limits=_limits(), timeout=_timeout())
+        return _sync_http_client
+
+
+def _get_async_http_client(loop: asyncio.AbstractEventLoop) -> httpx.AsyncClient:
+    # Caller holds _lock
+    client = _async_http_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(limits=_limits(), timeout=_timeout())
+        _async_http_clients[loop] = client
+    return client
+
+
+# ------------------------------------------------------------
+# Chat model registry
+# ------------------------------------------------------------
+def get_chat_model(
+    api_key: str,
+    model: str = GROQ_MODEL_NAME,
+    temperature: float = 0.0,
+    max_tokens: Optional[int] = None,
+    streaming: bool = False,
+) -> ChatOpenAI:
+    """
+    Return a cached ChatOpenAI for (api key, model, params).
+
+    Inside a running event loop the instance uses that loop's pooled async
+    client; outside a loop it is meant for sync `invoke` calls.
+    """
+    key: _ModelKey = (api_key, model, temperature, max_tokens, streaming)
+    try:
+        loop: Optional[asyncio.AbstractEventLoop] = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+
+    http_client = get_sync_http_client()
+    with _lock:
+        models = _sync_models if loop is None else _loop_models.setdefault(loop, {})
+        llm = models.get(key)
+        if llm is None:
+            llm = ChatOpenAI(
+                model=model,
+                api_key=api_key,
+                base_url=LLM_BASE_URL,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                streaming=streaming,
+                # Retries are handled by llm_calls (key rotation + backoff)
+                max_retries=0,
+                # Rate-limit headers and token usage feed the key scheduler
+                include_response_headers=True,
+                stream_usage=True,
+                http_client=http_client,
+                http_async_client=(
+                    _get_async_http_client(loop) if loop is not None else None
+                ),
+            )
+            models[key] = llm
+        return llm
+
+
+# ------------------------------------------------------------
+# Connection pre-warming
+# ------------------------------------------------------------
+def prewarm_connections(api_key: str, connections: int = LLM_PREWARM_CONNECTIONS) -> int:
+    """
+    Open `connections` keep-alive connections to the LLM host in the sync pool.
+
+    Issues cheap `GET /models` requests concurrently so the TLS handshakes
+    happen at worker start instead of on the first user request.
+    Returns the number of successful warm-up requests.
+    """
+    client = get_sync_http_client()
+    headers = {"Authorization": f"Bearer {api_key}"}
+
+    def _warm(_):
+        try:
+            client.get(f"{LLM_BASE_URL}/models", headers=headers)
+            return True
+        except httpx.HTTPError as e:
+            logger.warning("LLM connection pre-warm failed: %s", e)
+            return False
+
+    with ThreadPoolExecutor(max_workers=max(connections, 1)) as pool:
+        return sum(pool.map(_warm, range(connections)))
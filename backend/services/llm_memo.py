@@ -0,0 +1,136 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from healthbackend.config.settings import (
+    LLM_MEMO_ENABLED,
+    LLM_MEMO_MAX_BYTES,
+    LLM_MEMO_PATH,
+)
+
+logger = logging.getLogger("healthbackend")
+
+
+# ------------------------------------------------------------
+# Content-addressed LLM response memo
+# ------------------------------------------------------------
+# Deterministic (temperature 0) LLM calls are keyed by a hash of the exact
+# message list, model and parameters, and stored in a local SQLite file in
+# WAL mode. The store survives restarts and is shared by every worker
+# process on the node; least recently used rows are evicted once the total
+# stored size exceeds LLM_MEMO_MAX_BYTES.
+_local = threading.local()
+_init_lock = threading.Lock()
+_initialized_paths: set = set()
+
+
+def _connect() -> sqlite3.Connection:
+    # One connection per thread (sqlite3 connections are not thread-safe)
+    conn = getattr(_local, "conn", None)
+    if conn is not None and getattr(_local, "pid", None) == os.getpid():
+        return conn
+
+    directory = os.path.dirname(LLM_MEMO_PATH)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(LLM_MEMO_PATH, timeout=5.0, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    with _init_lock:
+        if LLM_MEMO_PATH not in _initialized_paths:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS memo ("
+                " key TEXT PRIMARY KEY,"
+                " content TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " last_access REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS memo_last_access ON memo (last_access)"
+            )
+            _initialized_paths.add(LLM_MEMO_PATH)
+    _local.conn = conn
+    # A worker forked after import must not reuse its parent's connection
+    _local.pid = os.getpid()
+    return conn
+
+
+def memo_key(messages: List[Any], model: str, params: Dict[str, Any]) -> str:
+    """Hash of the exact request: message roles + contents, model and params."""
+    payload = {
+        "model": model,
+        "params": params,
+        "messages": [[m.type, m.content] for m in messages],
+    }
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _memoizable(params: Dict[str, Any]) -> bool:
+    # Only deterministic calls can be replayed safely
+    return LLM_MEMO_ENABLED and not params.get("temperature")
+
+
+def lookup(messages: List[Any], model: str, params: Dict[str, Any]) -> Optional[str]:
+    """Return the stored reply for this exact request, or None."""
+    if not _memoizable(params):
+        return None
+    key = memo_key(messages, model, params)
+    try:
+        conn = _connect()
+        row = conn.execute("SELECT content FROM memo WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        conn.execute(
+            "UPDATE memo SET last_access = ? WHERE key = ?", (time.time(), key)
+        )
+        return row[0]
+    except sqlite3.Error as e:
+        # The memo is an optimization: never fail the request because of it
+        logger.warning("LLM memo lookup failed: %s", e)
+        return None
+
+
+def store(messages: List[Any], model: str, params: Dict[str, Any], content: str) -> None:
+    """Persist the reply for this request and evict old rows if over budget."""
+    if not _memoizable(params) or not content:
+        return
+    key = memo_key(messages, model, params)
+    size = len(content.encode("utf-8"))
+    try:
+        conn = _connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO memo (key, content, size, last_access)"
+                " VALUES (?, ?, ?, ?)",
+                (key, content, size, time.time()),
+            )
+            _evict(conn)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    except sqlite3.Error as e:
+        logger.warning("LLM memo store failed: %s", e)
+
+
+def _evict(conn: sqlite3.Connection) -> None:
+    # Drop least recently used rows until the store fits LLM_MEMO_MAX_BYTES
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM memo").fetchone()[0]
+    while total > LLM_MEMO_MAX_BYTES:
+        rows = conn.execute(
+            "SELECT key, size FROM memo ORDER BY last_access LIMIT 64"
+        ).fetchall()
+        if not rows:
+            break
+        for key, size in rows:
+            conn.execute("DELETE FROM memo WHERE key = ?", (key,))
+            total -= size
+            if total <= LLM_MEMO_MAX_BYTES:
+                break
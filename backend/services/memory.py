@@ -1,30 +1,174 @@
-# Import LangChain's memory module for storing conversation history
-from langchain.memory import ConversationBufferMemory
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from langchain.schema import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+from healthbackend.config.settings import (
+    AGENT_HISTORY_TOKEN_BUDGET,
+    AGENT_HISTORY_TOKEN_BUDGETS,
+    MEMORY_MAX_INPUT_CHARS,
+    MEMORY_SUMMARY_SENTENCES,
+    SESSION_MEMORY_MAX_SESSIONS,
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English text)."""
+    return len(text) // 4 + 1
+
+
+def history_budget(agent: str) -> int:
+    """Return the history token budget configured for `agent`."""
+    return AGENT_HISTORY_TOKEN_BUDGETS.get(agent, AGENT_HISTORY_TOKEN_BUDGET)
+
+
+_SUMMARY_HEADER = "Summary of earlier agent notes:"
+
+
+def _summarize_turn(tag: str, output: str) -> str:
+    """Extractive summary of one turn: its leading sentences, markdown stripped."""
+    text = re.sub(r"[#*_`>|]+", " ", output)
+    text = re.sub(r"\s+", " ", text).strip()
+    sentences = re.split(r"(?<=[.!?])\s+", text)
+    return f"{tag} {' '.join(sentences[:MEMORY_SUMMARY_SENTENCES])}".strip()
 
 
 # ------------------------------------------------------------
-# Shared memory initialization
+# Token-budgeted session memory
 # ------------------------------------------------------------
-# Create a single shared memory buffer instance that stores conversation history
-# - memory_key: identifies how the memory is referenced across agents
-# - return_messages=True: keeps full message objects instead of plain text
-_shared_memory = ConversationBufferMemory(
-    memory_key="chat_history",
-    return_messages=True,
-)
+# Stores one turn per agent call: a short input label and the agent's output.
+# Large prompts (KB snippets, other agents' notes) are never stored, so they
+# are not re-sent down the chain. When the history does not fit an agent's
+# token budget, the newest turns are kept verbatim and older turns are folded
+# into a rolling extractive summary.
+class SessionMemory:
+    def __init__(self, max_input_chars: int = MEMORY_MAX_INPUT_CHARS):
+        self.max_input_chars = max_input_chars
+        self._turns: List[Dict[str, str]] = []
+
+    def save_context(self, inputs: Dict[str, str], outputs: Dict[str, str]) -> None:
+        """Record one agent turn (same call shape as LangChain memories)."""
+        label = inputs.get("input", "")
+        if len(label) > self.max_input_chars:
+            label = label[: self.max_input_chars].rstrip() + "…"
+        output = outputs.get("output", "")
+        tag = label.split("]", 1)[0] + "]" if label.startswith("[") else ""
+        self._turns.append(
+            {
+                "input": label,
+                "output": output,
+                "summary": _summarize_turn(tag, output),
+            }
+        )
+
+    def chat_history(self, max_tokens: Optional[int] = None) -> List[BaseMessage]:
+        """
+        Return the conversation as messages, fitted to `max_tokens`.
+
+        Roughly a quarter of the budget is reserved for the summary of turns
+        that do not fit verbatim; `None` returns the full history.
+        """
+        if max_tokens is None:
+            return self._render(self._turns)
+
+        verbatim_budget = max_tokens * 3 // 4
+        used = 0
+        keep = 0
+        for turn in reversed(self._turns):
+            cost = estimate_tokens(turn["input"]) + estimate_tokens(turn["output"])
+            if used + cost > verbatim_budget:
+                break
+            used += cost
+            keep += 1
+
+        older = self._turns[: len(self._turns) - keep]
+        recent = self._turns[len(self._turns) - keep :]
+        messages: List[BaseMessage] = []
+        if older:
+            summary_budget = max_tokens - used
+            # Newest of the older turns first, so the most recent context survives
+            lines: List[str] = []
+            for turn in reversed(older):
+                candidate = "\n".join([_SUMMARY_HEADER, turn["summary"]] + lines)
+                if estimate_tokens(candidate) > summary_budget:
+                    break
+                lines.insert(0, turn["summary"])
+            if lines:
+                messages.append(SystemMessage(content="\n".join([_SUMMARY_HEADER] + lines)))
+        return messages + self._render(recent)
+
+    def extend(self, other: "SessionMemory") -> None:
+        """Append a copy of another memory's turns (e.g. from a shared run)."""
+        self._turns.extend(dict(turn) for turn in other._turns)
+
+    def load_memory_variables(self, inputs: Dict) -> Dict[str, List[BaseMessage]]:
+        """Full history under the `chat_history` key (LangChain compatible)."""
+        return {"chat_history": self.chat_history()}
+
+    def clear(self) -> None:
+        self._turns.clear()
+
+    @staticmethod
+    def _render(turns: List[Dict[str, str]]) -> List[BaseMessage]:
+        messages: List[BaseMessage] = []
+        for turn in turns:
+            messages.append(HumanMessage(content=turn["input"]))
+            messages.append(AIMessage(content=turn["output"]))
+        return messages
 
 
 # ------------------------------------------------------------
-# Get shared memory instance
+# Session memory factory
 # ------------------------------------------------------------
-# Purpose: Provides global access to the same memory object used by all agents.
-# Ensures that all agents (symptom, lifestyle, etc.) share a consistent conversation state.
-def get_shared_memory() -> ConversationBufferMemory:
-    return _shared_memory
+# Every orchestration gets its own memory, passed explicitly to each agent,
+# so concurrent requests never clear or read each other's history.
+def create_session_memory() -> SessionMemory:
+    return SessionMemory()
+
+
+# ------------------------------------------------------------
+# Bounded session registry
+# ------------------------------------------------------------
+# Optional: keeps the most recent sessions (LRU) so a follow-up question can
+# reuse the conversation of the orchestration that produced the plan.
+_sessions: "OrderedDict[str, SessionMemory]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def start_session_memory(session_id: Optional[str] = None) -> SessionMemory:
+    """
+    Create a fresh memory for a new orchestration.
+
+    If `session_id` is given, the memory is registered under it (replacing any
+    previous memory for that id) and the least recently used sessions are
+    evicted once the registry exceeds SESSION_MEMORY_MAX_SESSIONS.
+    """
+    memory = create_session_memory()
+    if not session_id:
+        return memory
 
+    with _lock:
+        _sessions[session_id] = memory
+        _sessions.move_to_end(session_id)
+        while len(_sessions) > SESSION_MEMORY_MAX_SESSIONS:
+            _sessions.popitem(last=False)
+    return memory
 
 
-def reset_memory():
-    _shared_memory.clear()
+def get_session_memory(session_id: Optional[str]) -> Optional[SessionMemory]:
+    """Return the registered memory for `session_id`, or None if unknown/evicted."""
+    if not session_id:
+        return None
+    with _lock:
+        memory = _sessions.get(session_id)
+        if memory is not None:
+            _sessions.move_to_end(session_id)
+        return memory
 
 
+def drop_session_memory(session_id: str) -> None:
+    """Forget a session's memory (e.g. on logout)."""
+    with _lock:
+        _sessions.pop(session_id, None)
@@ -0,0 +1,207 @@
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+logger = logging.getLogger("healthbackend")
+
+PREFIX = "healthbackend_"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; LLM calls range from tens of milliseconds (memo, fake) to a minute
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+TOKEN_BUCKETS = (16, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+LabelValues = Tuple[str, ...]
+# A collector returns [(name, type, help, [(labels, value), ...]), ...] at scrape time
+Sample = Tuple[Dict[str, str], float]
+Collector = Callable[[], Iterable[Tuple[str, str, str, List[Sample]]]]
+
+
+# ------------------------------------------------------------
+# Metric types (Prometheus text exposition format)
+# ------------------------------------------------------------
+# A minimal, dependency-free registry. Metrics are per worker process: with
+# several gunicorn/uvicorn workers, scrape each worker (or sum in PromQL).
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[LabelValues, float] = {}
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._lock = threading.Lock()
+        # label values -> [bucket counts..., sum, count]
+        self._values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, state in sorted(self._values.items()):
+                cumulative = 0.0
+                for i, bound in enumerate(self.buckets):
+                    cumulative += state[i]
+                    le = f'le="{_format_value(bound)}"'
+                    lines.append(
+                        f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} "
+                        f"{_format_value(cumulative)}"
+                    )
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {_format_value(state[-2])}")
+                lines.append(f"{self.name}_count{labels} {_format_value(state[-1])}")
+        return lines
+
+
+# ------------------------------------------------------------
+# Registry
+# ------------------------------------------------------------
+_lock = threading.Lock()
+_metrics: Dict[str, object] = {}
+_collectors: List[Collector] = []
+
+
+def _get_or_create(cls, name: str, *args, **kwargs):
+    full_name = name if name.startswith(PREFIX) else PREFIX + name
+    with _lock:
+        metric = _metrics.get(full_name)
+        if metric is None:
+            metric = _metrics[full_name] = cls(full_name, *args, **kwargs)
+        return metric
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    """Return the process-wide counter `healthbackend_<name>`, creating it once."""
+    return _get_or_create(Counter, name, documentation, labelnames)
+
+
+def histogram(
+    name: str,
+    documentation: str,
+    labelnames: Sequence[str] = (),
+    buckets: Sequence[float] = DEFAULT_BUCKETS,
+) -> Histogram:
+    """Return the process-wide histogram `healthbackend_<name>`, creating it once."""
+    return _get_or_create(Histogram, name, documentation, labelnames, buckets)
+
+
+def register_collector(collector: Collector) -> None:
+    """Add a callback that reports gauges (queue depth, in-flight calls...) at scrape time."""
+    with _lock:
+        _collectors.append(collector)
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    with _lock:
+        metrics = list(_metrics.values())
+        collectors = list(_collectors)
+
+    lines: List[str] = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    for collector in collectors:
+        try:
+            families = list(collector())
+        except Exception:
+            # A broken collector must not take /metrics down
+            logger.exception("Metrics collector %r failed", collector)
+            continue
+        for name, kind, documentation, samples in families:
+            full_name = PREFIX + name
+            lines.append(f"# HELP {full_name} {documentation}")
+            lines.append(f"# TYPE {full_name} {kind}")
+            for labels, value in samples:
+                label_text = _format_labels(list(labels), list(labels.values()))
+                lines.append(f"{full_name}{label_text} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# ------------------------------------------------------------
+# Timing spans
+# ------------------------------------------------------------
+@contextmanager
+def span(name: str, **labels: str):
+    """
+    Time a block into the histogram `healthbackend_<name>_seconds`.
+
+    Labels are the keyword arguments plus `outcome` ("ok", "error" or
+    "cancelled"); every use of one span name must pass the same labels.
+    Works around `await`s too, so async code can use it directly.
+    """
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException as e:
+        outcome = "cancelled" if type(e).__name__ == "CancelledError" else "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        labelnames = tuple(sorted(labels)) + ("outcome",)
+        histogram(
+            f"{name}_seconds", f"Duration of {name.replace('_', ' ')} in seconds", labelnames
+        ).observe(elapsed, outcome=outcome, **labels)
+        logger.debug("span %s %s %.4fs (%s)", name, labels, elapsed, outcome)
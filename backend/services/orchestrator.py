@@ -1,38 +1,139 @@
+import asyncio
+import copy
 import json
+import logging
 import re
-from typing import AsyncGenerator, Dict, Any
+import uuid
+from typing import AsyncGenerator, Callable, Dict, Any, Optional
 
-from langchain_openai import ChatOpenAI
 from langchain.schema import HumanMessage, SystemMessage
 
-from healthbackend.services.api_key_pool import (
-    get_next_key,
-    mark_key_quota_exceeded,
-)
 from healthbackend.services.agents import (
     symptom_agent,
     lifestyle_agent,
     diet_agent,
     fitness_agent,
 )
+from healthbackend.services.agent_graph import AgentNode, run_agent_graph
 from healthbackend.services.history_store import save_history
-from healthbackend.services.memory import get_shared_memory, reset_memory
-from healthbackend.config.settings import GROQ_MODEL_NAME
+from healthbackend.services.llm_calls import call_llm, stream_llm
+from healthbackend.services.intent import OFF_TOPIC_MESSAGE, ais_health_query
+from healthbackend.services.memory import (
+    SessionMemory,
+    create_session_memory,
+    drop_session_memory,
+    history_budget,
+    start_session_memory,
+)
+from healthbackend.services.result_cache import normalize_symptoms, report_hash, result_cache
+from healthbackend.services.single_flight import orchestration_flight, stream_flight
+from healthbackend.utils.exceptions import InputError
+
+logger = logging.getLogger("healthbackend")
 
 
 # ---------------------------------------------------------------------
-# Synthesizer LLM helper
+# Agent dependency graph
 # ---------------------------------------------------------------------
-def _make_synth_llm_with_key():
-    """Create the synthesizer LLM using the next available Groq API key."""
-    key = get_next_key()
-    llm = ChatOpenAI(
-        model=GROQ_MODEL_NAME,  # e.g. "llama-3.3-70b-versatile"
-        api_key=key,
-        base_url="https://api.groq.com/openai/v1",
-        temperature=0.0,  # deterministic JSON
+# Each agent declares where its inputs come from. Symptom and lifestyle
+# only need the raw symptoms, so they start together; diet waits for the
+# lifestyle notes (and for the symptom triage so it is in its history),
+# fitness waits for the diet plan.
+WELLNESS_PIPELINE = [
+    AgentNode(
+        "symptom_analysis",
+        "Symptom Agent",
+        symptom_agent,
+        args={"symptoms": "symptoms", "memory": "memory"},
+    ),
+    AgentNode(
+        "lifestyle",
+        "Lifestyle Agent",
+        lifestyle_agent,
+        args={"symptoms": "symptoms", "memory": "memory"},
+    ),
+    AgentNode(
+        "diet",
+        "Diet Agent",
+        diet_agent,
+        args={
+            "symptoms": "symptoms",
+            "report": "medical_report",
+            "lifestyle_notes": "lifestyle",
+            "memory": "memory",
+        },
+        after=("symptom_analysis",),
+    ),
+    AgentNode(
+        "fitness",
+        "Fitness Agent",
+        fitness_agent,
+        args={"symptoms": "symptoms", "diet_notes": "diet", "memory": "memory"},
+    ),
+]
+
+
+async def _refined_lifestyle_agent(
+    symptoms: str,
+    diet_notes: str,
+    fitness_notes: str,
+    memory,
+    on_token=None,
+) -> str:
+    """Second lifestyle pass that checks the diet and fitness plans for conflicts."""
+    refined_lifestyle_prompt = (
+        f"Symptoms: {symptoms}\n\n"
+        f"Diet plan summary:\n{diet_notes}\n\n"
+        f"Fitness plan summary:\n{fitness_notes}\n\n"
+        "Adjust lifestyle guidance if any conflicts or overloads are detected."
     )
-    return llm, key
+    return await lifestyle_agent(refined_lifestyle_prompt, memory, on_token=on_token)
+
+
+# The streaming UI also runs a refining lifestyle pass after fitness
+STREAM_PIPELINE = WELLNESS_PIPELINE + [
+    AgentNode(
+        "lifestyle_refined",
+        "Lifestyle Agent (refined)",
+        _refined_lifestyle_agent,
+        args={
+            "symptoms": "symptoms",
+            "diet_notes": "diet",
+            "fitness_notes": "fitness",
+            "memory": "memory",
+        },
+    ),
+]
+
+# (on start, on finish) thoughts shown in the UI for each streamed agent
+_STREAM_THOUGHTS = {
+    "symptom_analysis": (
+        "Orchestrator → SymptomAgent: analyze primary symptoms.",
+        "SymptomAgent → Orchestrator: symptom profile ready (example: {example}...).",
+    ),
+    "lifestyle": (
+        "Orchestrator → LifestyleAgent: first-pass lifestyle checks, "
+        "in parallel with symptom analysis.",
+        "LifestyleAgent → Orchestrator: first-pass lifestyle guidance ready "
+        "(sleep, routine, stress). Example: {example}...",
+    ),
+    "diet": (
+        "Orchestrator → DietAgent: generate plan using symptoms + lifestyle constraints.",
+        "DietAgent → Orchestrator: diet & hydration plan ready. Example: {example}...",
+    ),
+    "fitness": (
+        "DietAgent → FitnessAgent: sending energy & restriction profile "
+        "to shape safe activity level.",
+        "FitnessAgent → Orchestrator: movement plan ready "
+        "(light / restricted). Example: {example}...",
+    ),
+    "lifestyle_refined": (
+        "FitnessAgent → LifestyleAgent: sharing activity plan to detect "
+        "conflicts with fatigue, sleep, or routine.",
+        "LifestyleAgent → Orchestrator: refined lifestyle guidance ready. "
+        "Example: {example}...",
+    ),
+}
 
 
 def _build_markdown_table(output: dict) -> str:
@@ -59,68 +160,148 @@ def _build_markdown_table(output: dict) -> str:
 # Main orchestration (non‑streaming, used by /health-assist)
 # ---------------------------------------------------------------------
 async def orchestrate(
-    symptoms: str, medical_report: str, user_id: str
+    symptoms: str,
+    medical_report: str,
+    user_id: str,
+    session_id: Optional[str] = None,
+    use_cache: bool = True,
+    check_intent: bool = False,
+    on_agent_done: Optional[Callable[[AgentNode, Dict[str, Any]], None]] = None,
 ) -> Dict[str, Any]:
-    """Run the full multi‑agent pipeline and return structured JSON."""
+    """
+    Run the full multi‑agent pipeline and return structured JSON.
 
-    # Reset shared memory for this session
-    reset_memory()
-    memory = get_shared_memory()
+    Each call gets its own session memory; it is registered under
+    `session_id` (generated if not given) so follow-ups can reuse it.
 
-    # Track agent communication flow
-    agent_flow = []
+    Results are served from the result cache when an identical or
+    near-identical query (same medical report) was answered recently.
+    `use_cache=False` skips the lookup; the fresh result still refreshes
+    the cache.
 
-    # 1. Symptom agent
-    symptom_result = await symptom_agent(symptoms)
-    agent_flow.append(
-        {
-            "agent": "Symptom Agent",
-            "output": symptom_result,
-        }
-    )
+    With `check_intent=True` the intent filter runs concurrently with the
+    agents (speculative execution); if the query is off-topic the agents
+    are cancelled and InputError is raised.
 
-    # 2. Lifestyle agent
-    lifestyle_result = await lifestyle_agent(symptoms)
-    agent_flow.append(
-        {
-            "agent": "Lifestyle Agent",
-            "output": lifestyle_result,
-        }
-    )
+    Concurrent identical queries (same normalized symptoms, report and
+    `check_intent`) share one pipeline run; every caller still gets its own
+    session and envelope.
 
-    # 3. Diet agent (uses lifestyle)
-    diet_result = await diet_agent(
-        symptoms=symptoms,
-        report=medical_report,
-        lifestyle_notes=lifestyle_result,
-    )
-    agent_flow.append(
-        {
-            "agent": "Diet Agent",
-            "output": diet_result,
-        }
-    )
+    `on_agent_done(node, flow_entry)` is called as each agent finishes, when
+    this call runs the agents itself (not on cache hits or joined runs).
+    """
 
-    # 4. Fitness agent (uses diet)
-    fitness_result = await fitness_agent(
-        symptoms=symptoms,
-        diet_notes=diet_result,
-    )
-    agent_flow.append(
-        {
-            "agent": "Fitness Agent",
-            "output": fitness_result,
-        }
+    session_id = session_id or uuid.uuid4().hex
+    memory = start_session_memory(session_id)
+
+    plan = None
+    if result_cache is not None and use_cache:
+        plan = result_cache.get(symptoms, medical_report)
+    if plan is not None:
+        logger.info("Result cache hit for query %r", symptoms)
+        _seed_memory(memory, plan)
+    else:
+
+        def pipeline():
+            run = _run_pipeline(symptoms, medical_report, memory, on_agent_done)
+            return _speculate(symptoms, run, session_id) if check_intent else run
+
+        if orchestration_flight is None:
+            plan, complete = await pipeline()
+            leader = True
+        else:
+            # A run with the intent check must never be shared with one without
+            key = (normalize_symptoms(symptoms), report_hash(medical_report), check_intent)
+            try:
+                (plan, complete), leader = await orchestration_flight.run(key, pipeline)
+            except InputError:
+                drop_session_memory(session_id)
+                raise
+        if leader:
+            # Only cache well-formed plans (synthesizer returned valid JSON)
+            if result_cache is not None and complete:
+                result_cache.put(symptoms, medical_report, plan)
+        else:
+            logger.info("Joined in-flight orchestration for query %r", symptoms)
+            plan = copy.deepcopy(plan)
+            _seed_memory(memory, plan)
+
+    # ------------------------------------------------------------
+    # Final Output Structure
+    # ------------------------------------------------------------
+    output = {
+        "user_id": user_id,
+        "session_id": session_id,
+        "query": symptoms,
+        **plan,
+    }
+
+    # Add markdown table summary
+    output["table_markdown"] = _build_markdown_table(output)
+
+    # File I/O: keep it off the event loop (ASGI serves many requests on it)
+    await asyncio.to_thread(save_history, user_id, output)
+    return output
+
+
+def _seed_memory(memory: SessionMemory, plan: Dict[str, Any]) -> None:
+    # Give a session that did not run the agents their notes, for follow-ups
+    for entry in plan["agent_flow"]:
+        memory.save_context({"input": f"[{entry['agent']}]"}, {"output": entry["output"]})
+
+
+async def _speculate(symptoms: str, pipeline, session_id: str):
+    """
+    Await `pipeline` while the intent check runs; cancel it if off-topic.
+
+    Cancellation surfaces as CancelledError inside the agents, which the
+    call layer's `except Exception` retry handling does not catch, so no
+    key gets marked as exhausted for a call we abandoned.
+    """
+    task = asyncio.create_task(pipeline)
+    try:
+        on_topic = await ais_health_query(symptoms)
+    except BaseException:
+        task.cancel()
+        raise
+    if not on_topic:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        drop_session_memory(session_id)
+        raise InputError(OFF_TOPIC_MESSAGE)
+    return await task
+
+
+async def _run_pipeline(
+    symptoms: str,
+    medical_report: str,
+    memory: SessionMemory,
+    on_agent_done: Optional[Callable[[AgentNode, Dict[str, Any]], None]] = None,
+) -> tuple[Dict[str, Any], bool]:
+    """
+    Run the agent graph and the synthesizer.
+
+    Returns:
+        (plan, complete): the user-independent part of the response and
+        whether the synthesizer produced valid JSON.
+    """
+    # Run the agent graph: independent agents start concurrently
+    results, agent_flow = await run_agent_graph(
+        WELLNESS_PIPELINE,
+        {"symptoms": symptoms, "medical_report": medical_report, "memory": memory},
+        on_agent_done=on_agent_done,
     )
+    symptom_result = results["symptom_analysis"]
+    lifestyle_result = results["lifestyle"]
+    diet_result = results["diet"]
+    fitness_result = results["fitness"]
 
     # Conversation history for synthesis
-    history = memory.load_memory_variables({})["chat_history"]
+    history = memory.chat_history(history_budget("synthesizer"))
 
     # -----------------------------------------------------------------
     # Synthesizer LLM: combine all agent outputs into JSON wellness plan
     # -----------------------------------------------------------------
-    synth_llm, synth_key = _make_synth_llm_with_key()
-
     synth_messages = [
         SystemMessage(
             content=(
@@ -150,15 +331,9 @@ async def orchestrate(
         HumanMessage(content="Generate the JSON response now."),
     ]
 
-    try:
-        final_answer = await synth_llm.ainvoke(synth_messages)
-    except Exception:
-        # Key likely hit quota or hard failure → rotate and retry once
-        mark_key_quota_exceeded(synth_key)
-        synth_llm, synth_key = _make_synth_llm_with_key()
-        final_answer = await synth_llm.ainvoke(synth_messages)
-
-    raw = final_answer.content.strip()
+    # Deterministic JSON; memoized, retried and hedged by the call layer
+    raw = await call_llm(synth_messages, "synthesizer")
+    raw = raw.strip()
 
     # ------------------------------------------------------------
     # JSON Cleaning and Parsing
@@ -169,15 +344,12 @@ async def orchestrate(
 
     try:
         data = json.loads(raw)
+        complete = True
     except json.JSONDecodeError:
         data = {"synthesized_guidance": raw, "recommendations": []}
+        complete = False
 
-    # ------------------------------------------------------------
-    # Final Output Structure
-    # ------------------------------------------------------------
-    output = {
-        "user_id": user_id,
-        "query": symptoms,
+    plan = {
         "symptom_analysis": symptom_result,
         "lifestyle": lifestyle_result,
         "diet": diet_result,
@@ -186,144 +358,128 @@ async def orchestrate(
         "recommendations": data.get("recommendations", []),
         "agent_flow": agent_flow,
     }
-
-    # Add markdown table summary
-    output["table_markdown"] = _build_markdown_table(output)
-
-    save_history(user_id, output)
-    return output
+    return plan, complete
 
 
 # ---------------------------------------------------------------------
 # Streaming helper - agent communication for UI
 # ---------------------------------------------------------------------
-async def stream_agent_updates(symptoms: str, medical_report: str) -> AsyncGenerator[Dict[str, str], None]:
+async def stream_agent_updates(
+    symptoms: str,
+    medical_report: str,
+    session_id: Optional[str] = None,
+    check_intent: bool = False,
+) -> AsyncGenerator[Dict[str, str], None]:
     """
-    Async generator that yields 'thought' and 'answer' events for the UI,
-    reflecting a mesh-style multi-agent workflow:
+    Async generator that yields 'thought', 'agent_token' and 'answer' events
+    for the UI, reflecting a mesh-style multi-agent workflow:
 
-    User -> Orchestrator -> Symptom
-    Symptom -> Diet + Lifestyle
-    Lifestyle <-> Diet, Diet -> Fitness, Fitness -> Lifestyle
+    User -> Orchestrator -> Symptom + Lifestyle (concurrently)
+    Lifestyle -> Diet, Diet -> Fitness, Fitness -> Lifestyle
     All -> Synthesizer -> Orchestrator -> User
-    """
 
-    reset_memory()
-    memory = get_shared_memory()
+    Every agent streams: `{"type": "agent_token", "agent": "<label>",
+    "content": "<chunk>"}` events are yielded as tokens arrive.
 
-    # 1) Symptom Agent
-    yield {
-        "type": "thought",
-        "content": "User → Orchestrator: new wellness query received.",
-    }
-    yield {
-        "type": "thought",
-        "content": "Orchestrator → SymptomAgent: analyze primary symptoms.",
-    }
-    symptom_result = await symptom_agent(symptoms)
-    yield {
-        "type": "thought",
-        "content": (
-            "SymptomAgent → Orchestrator: symptom profile ready "
-            f"(example: {symptom_result[:160]}...)."
-        ),
-    }
+    With `check_intent=True` the agents start speculatively while the intent
+    filter runs; their events are held back until the query is confirmed.
+    An off-topic query cancels the agents and yields a single
+    `{"type": "error", "content": ...}` event.
 
-    # 2) Symptom → Diet + Lifestyle (parallel conceptually)
-    yield {
-        "type": "thought",
-        "content": "SymptomAgent → DietAgent: sending symptom profile for diet constraints.",
-    }
-    yield {
-        "type": "thought",
-        "content": "SymptomAgent → LifestyleAgent: sending symptom profile for lifestyle checks.",
-    }
+    Concurrent identical queries subscribe to one shared run; a late
+    subscriber first receives the events emitted so far. The run stops when
+    its last subscriber disconnects.
+    """
 
-    # 3) Lifestyle Agent – first pass
-    lifestyle_result = await lifestyle_agent(symptoms)
-    yield {
-        "type": "thought",
-        "content": (
-            "LifestyleAgent → Orchestrator: first-pass lifestyle guidance ready "
-            f"(sleep, routine, stress). Example: {lifestyle_result[:160]}..."
+    memory = start_session_memory(session_id)
+    if stream_flight is None:
+        async for evt in _stream_events(symptoms, medical_report, memory, check_intent):
+            if evt["type"] == "error":
+                drop_session_memory(session_id)
+            yield evt
+        return
+
+    key = (normalize_symptoms(symptoms), report_hash(medical_report), check_intent)
+    shared = stream_flight.join(
+        key,
+        make_context=create_session_memory,
+        produce=lambda run_memory: _stream_events(
+            symptoms, medical_report, run_memory, check_intent
         ),
-    }
-
-    # 4) Diet Agent – uses symptoms + lifestyle constraints
-    yield {
-        "type": "thought",
-        "content": "Orchestrator → DietAgent: generate plan using symptoms + lifestyle constraints.",
-    }
-    diet_result = await diet_agent(
-        symptoms=symptoms,
-        report=medical_report,
-        lifestyle_notes=lifestyle_result,
     )
-    yield {
-        "type": "thought",
-        "content": (
-            "DietAgent → Orchestrator: diet & hydration plan ready. "
-            f"Example: {diet_result[:160]}..."
-        ),
-    }
-
-    # Diet → Fitness
-    yield {
-        "type": "thought",
-        "content": (
-            "DietAgent → FitnessAgent: sending energy & restriction profile "
-            "to shape safe activity level."
-        ),
-    }
-
-    # 5) Fitness Agent – uses diet restrictions
-    fitness_result = await fitness_agent(
-        symptoms=symptoms,
-        diet_notes=diet_result,
+    off_topic = False
+    async for evt in shared.events():
+        off_topic = off_topic or evt["type"] == "error"
+        yield evt
+    if off_topic:
+        drop_session_memory(session_id)
+    else:
+        # Copy the shared run's agent notes into this session for follow-ups
+        memory.extend(shared.context)
+
+
+async def _stream_events(
+    symptoms: str,
+    medical_report: str,
+    memory: SessionMemory,
+    check_intent: bool,
+) -> AsyncGenerator[Dict[str, str], None]:
+    """Run the streaming pipeline once, recording agent notes in `memory`."""
+    events: asyncio.Queue = asyncio.Queue()
+
+    def _thought(text: str) -> None:
+        events.put_nowait({"type": "thought", "content": text})
+
+    def _token_emitter(label: str):
+        async def on_token(text: str) -> None:
+            events.put_nowait({"type": "agent_token", "agent": label, "content": text})
+
+        return on_token
+
+    def _on_start(node: AgentNode) -> None:
+        _thought(_STREAM_THOUGHTS[node.name][0])
+
+    def _on_done(node: AgentNode, entry: Dict[str, Any]) -> None:
+        _thought(_STREAM_THOUGHTS[node.name][1].format(example=entry["output"][:160]))
+
+    # 1-6) Run the agent graph; every agent streams its tokens as it goes
+    nodes = [
+        node.bind(on_token=_token_emitter(node.label)) for node in STREAM_PIPELINE
+    ]
+    graph = asyncio.create_task(
+        run_agent_graph(
+            nodes,
+            {"symptoms": symptoms, "medical_report": medical_report, "memory": memory},
+            on_agent_start=_on_start,
+            on_agent_done=_on_done,
+        )
     )
-    yield {
-        "type": "thought",
-        "content": (
-            "FitnessAgent → Orchestrator: movement plan ready "
-            f"(light / restricted). Example: {fitness_result[:160]}..."
-        ),
-    }
-
-    # Fitness → Lifestyle: check for behavior conflicts
-    yield {
-        "type": "thought",
-        "content": (
-            "FitnessAgent → LifestyleAgent: sharing activity plan to detect "
-            "conflicts with fatigue, sleep, or routine."
-        ),
-    }
+    # Sentinel tells the loop below that no more agent events will arrive
+    graph.add_done_callback(lambda _: events.put_nowait(None))
+    try:
+        if check_intent and not await ais_health_query(symptoms):
+            graph.cancel()
+            await asyncio.gather(graph, return_exceptions=True)
+            yield {"type": "error", "content": OFF_TOPIC_MESSAGE}
+            return
 
-    # 6) Lifestyle Agent – second pass, refines using fitness & diet
-    refined_lifestyle_prompt = (
-        f"Symptoms: {symptoms}\n\n"
-        f"Diet plan summary:\n{diet_result}\n\n"
-        f"Fitness plan summary:\n{fitness_result}\n\n"
-        "Adjust lifestyle guidance if any conflicts or overloads are detected."
-    )
-    refined_lifestyle = await lifestyle_agent(refined_lifestyle_prompt)
-    yield {
-        "type": "thought",
-        "content": (
-            "LifestyleAgent → DietAgent & FitnessAgent: updated lifestyle "
-            "constraints (sleep, stress, routine) shared for consistency."
-        ),
-    }
-    yield {
-        "type": "thought",
-        "content": (
-            "LifestyleAgent → Orchestrator: refined lifestyle guidance ready. "
-            f"Example: {refined_lifestyle[:160]}..."
-        ),
-    }
+        yield {
+            "type": "thought",
+            "content": "User → Orchestrator: new wellness query received.",
+        }
+        while True:
+            evt = await events.get()
+            if evt is None:
+                break
+            yield evt
+        graph.result()  # re-raise an agent failure
+    finally:
+        # Client went away mid-stream: stop the agents still running
+        if not graph.done():
+            graph.cancel()
 
     # 7) All agents → Synthesizer
-    history = memory.load_memory_variables({})["chat_history"]
-    synth_llm, synth_key = _make_synth_llm_with_key()
+    history = memory.chat_history(history_budget("synthesizer"))
 
     yield {
         "type": "thought",
@@ -350,19 +506,9 @@ async def stream_agent_updates(symptoms: str, medical_report: str) -> AsyncGener
         HumanMessage(content="Generate the wellness plan now."),
     ]
 
-    try:
-        async for chunk in synth_llm.astream(synth_messages):
-            text = getattr(chunk, "content", "") or ""
-            if text:
-                # Stream final answer tokens
-                yield {"type": "answer", "content": text}
-    except Exception:
-        mark_key_quota_exceeded(synth_key)
-        synth_llm, synth_key = _make_synth_llm_with_key()
-        async for chunk in synth_llm.astream(synth_messages):
-            text = getattr(chunk, "content", "") or ""
-            if text:
-                yield {"type": "answer", "content": text}
+    # Stream final answer tokens (retried on another key until the first one)
+    async for text in stream_llm(synth_messages, "synthesizer_stream"):
+        yield {"type": "answer", "content": text}
 
     # 8) Final delivery
     yield {
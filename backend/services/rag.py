@@ -1,42 +1,304 @@
+import hashlib
+import heapq
 import json
+import logging
 import os
+import re
+import shutil
+import threading
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple, Union
 
-# Path to the local knowledge base file used for simple RAG-style lookup
-KB_PATH = "data/knowledge.json"
+from healthbackend.config.settings import (
+    KB_INDEX_DIR,
+    KB_PATH,
+    KB_RELOAD_INTERVAL,
+    RAG_DENSE_MIN_SCORE,
+    RAG_EMBED_DIM,
+    RAG_HYBRID_ALPHA,
+    RAG_INDEX_TYPE,
+    RAG_IVF_NLIST,
+    RAG_IVF_NPROBE,
+    RAG_MODE,
+    RAG_VECTOR_DIR,
+)
+from healthbackend.services.bm25 import BM25Index
+from healthbackend.services import ann_index, kb_artifacts
+from healthbackend.services.ann_index import IVFIndex
+from healthbackend.services.embeddings import DenseIndex, embed
+from healthbackend.services.metrics import register_collector, span
+
+logger = logging.getLogger("healthbackend")
+
+# Exact scan or IVF, per RAG_INDEX_TYPE; both take a query vector
+VectorIndex = Union[DenseIndex, IVFIndex]
+
+# Files `_load_dense` writes to RAG_VECTOR_DIR: "<digest>-<dim>.npy", the IVF
+# directory "<digest>-<dim>-ivf-<nlist>", and their ".<pid>.tmp" / ".<pid>.old"
+# leftovers. Anything else in the directory is not ours to delete.
+_VECTOR_FILE_RE = re.compile(r"[0-9a-f]{16}-\d+(\.npy|-ivf-\w+)(\.\d+\.(tmp|old))?")
+
+
+class KBDocument(NamedTuple):
+    title: str
+    content: str
+    # Set by the ingestion pipeline (tools/kb_ingest.py)
+    topic: str = ""
+    source: str = ""
+
+
+class KBSnapshot(NamedTuple):
+    """An immutable, fully built version of the knowledge base."""
+
+    documents: Tuple[KBDocument, ...]
+    lexical: BM25Index
+    # Only built in "dense" / "hybrid" mode
+    dense: Optional[VectorIndex]
+    mtime_ns: int
+    size: int
+    digest: str
+
+
+_EMPTY = KBSnapshot((), BM25Index({}, []), None, 0, 0, "")
+
+# (path, file bytes, sha256) -> (documents, lexical index, dense index or None)
+Loader = Callable[[str, bytes, str], Tuple[Tuple[KBDocument, ...], BM25Index, Optional[VectorIndex]]]
+
+
+# ------------------------------------------------------------
+# Knowledge base index
+# ------------------------------------------------------------
+class KnowledgeIndex:
+    """
+    Process-wide, in-memory view of the knowledge base.
+
+    `path` is the JSON knowledge base, or the CURRENT pointer of a prebuilt
+    index directory (see `kb_artifacts`); `loader` turns it into documents
+    and indexes. The file is loaded once; afterwards its mtime/size is
+    checked at most every `reload_interval` seconds and it is only reloaded
+    when those changed and the content hash differs. A reload builds a complete new
+    snapshot and swaps it in with one assignment, so concurrent readers
+    never lock and never see a half-built index. If the file becomes
+    unreadable or invalid, the last good snapshot keeps serving.
+    """
+
+    def __init__(
+        self,
+        path: str = KB_PATH,
+        reload_interval: float = KB_RELOAD_INTERVAL,
+        loader: Optional[Loader] = None,
+    ):
+        self.path = path
+        self.loader = loader or _load_json
+        self.reload_interval = reload_interval
+        self._snapshot = _EMPTY
+        self._checked_at = float("-inf")
+        # (mtime_ns, size) of a version that failed to parse, so it is logged once
+        self._rejected = None
+        self._reload_lock = threading.Lock()
+
+    def snapshot(self) -> KBSnapshot:
+        """Current snapshot, reloading first if the file changed."""
+        if time.monotonic() - self._checked_at >= self.reload_interval:
+            self._maybe_reload()
+        return self._snapshot
+
+    def _maybe_reload(self) -> None:
+        # One thread checks / rebuilds; the others keep reading the old snapshot
+        if not self._reload_lock.acquire(blocking=False):
+            return
+        try:
+            self._checked_at = time.monotonic()
+            current = self._snapshot
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                if current is not _EMPTY:
+                    logger.warning("Knowledge base %s disappeared; keeping last version", self.path)
+                return
+            version = (stat.st_mtime_ns, stat.st_size)
+            if version in ((current.mtime_ns, current.size), self._rejected):
+                return
+
+            with open(self.path, "rb") as f:
+                raw = f.read()
+            digest = hashlib.sha256(raw).hexdigest()
+            if digest == current.digest:
+                # Touched but unchanged: remember the new mtime, skip the rebuild
+                self._snapshot = current._replace(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+                return
+            try:
+                documents, lexical, dense = self.loader(self.path, raw, digest)
+            except (OSError, ValueError, TypeError, KeyError, AttributeError) as e:
+                logger.warning("Knowledge base %s is invalid (%s); keeping last version", self.path, e)
+                self._rejected = version
+                return
+            self._snapshot = KBSnapshot(documents, lexical, dense, stat.st_mtime_ns, stat.st_size, digest)
+            logger.info("Loaded knowledge base %s (%d documents)", self.path, len(documents))
+        finally:
+            self._reload_lock.release()
+
+
+def _needs_dense() -> bool:
+    return RAG_MODE in ("dense", "hybrid")
+
+
+def _load_json(path: str, raw: bytes, digest: str):
+    """Loader for the hand-edited JSON list; indexes are built in-process."""
+    documents = _build_documents(json.loads(raw))
+    lexical = _build_lexical(documents)
+    dense = _load_dense(documents, digest) if _needs_dense() else None
+    return documents, lexical, dense
+
+
+def _load_prebuilt(path: str, raw: bytes, digest: str):
+    """Loader for an index directory written by `tools/kb_ingest.py`."""
+    index_dir = os.path.dirname(path)
+    version = raw.decode("utf-8").strip()
+    manifest = kb_artifacts.read_manifest(index_dir, version)
+    if manifest.get("format") != kb_artifacts.FORMAT_VERSION:
+        raise ValueError(f"unsupported index format {manifest.get('format')!r}")
+    documents = tuple(
+        KBDocument(c.get("title", ""), c["content"], c.get("topic", ""), c.get("source", ""))
+        for c in kb_artifacts.iter_chunks(index_dir, version)
+    )
+    lexical = BM25Index.from_dict(kb_artifacts.read_lexical(index_dir, version))
+    dense = None
+    if _needs_dense():
+        vectors = kb_artifacts.open_vectors(index_dir, version)
+        if len(vectors) != len(documents):
+            raise ValueError(f"{len(vectors)} vectors for {len(documents)} chunks in {version}")
+        # kb_ingest --ivf prebuilds this; otherwise the first worker trains it
+        ivf_path = kb_artifacts.version_path(index_dir, version, _ivf_name())
+        dense = _vector_index(vectors, ivf_path)
+    logger.info("Using prebuilt knowledge base index %s/%s", index_dir, version)
+    return documents, lexical, dense
+
+
+def _build_documents(entries) -> Tuple[KBDocument, ...]:
+    # Expected format: a list of objects with at least a "content" field
+    return tuple(KBDocument(entry.get("title", ""), entry["content"]) for entry in entries)
+
+
+def _build_lexical(documents: Tuple[KBDocument, ...]) -> BM25Index:
+    # Titles are short and on-topic, so they are indexed along with the content
+    return BM25Index.build(_index_text(doc) for doc in documents)
+
+
+def _index_text(doc: KBDocument) -> str:
+    return f"{doc.title} {doc.content}"
+
+
+def _ivf_name() -> str:
+    return f"ivf-{RAG_IVF_NLIST or 'auto'}"
+
+
+def _vector_index(vectors, ivf_path: str) -> VectorIndex:
+    """Flat or IVF search over `vectors`, according to RAG_INDEX_TYPE."""
+    if RAG_INDEX_TYPE == "ivf" and len(vectors):
+        return ann_index.open_or_build(ivf_path, vectors, RAG_IVF_NLIST, RAG_IVF_NPROBE)
+    return DenseIndex(vectors)
+
+
+def _load_dense(documents: Tuple[KBDocument, ...], digest: str) -> Optional[VectorIndex]:
+    """
+    Map the vectors of this KB version, embedding the documents only when no
+    worker has written them yet. Files of older versions are removed.
+    """
+    prefix = f"{digest[:16]}-{RAG_EMBED_DIM}"
+    path = os.path.join(RAG_VECTOR_DIR, f"{prefix}.npy")
+    try:
+        if os.path.exists(path):
+            flat = DenseIndex.open(path)
+        else:
+            flat = DenseIndex.build((_index_text(doc) for doc in documents), RAG_EMBED_DIM, path)
+        dense = _vector_index(flat.matrix, os.path.join(RAG_VECTOR_DIR, f"{prefix}-{_ivf_name()}"))
+    except (OSError, ValueError) as e:
+        logger.warning("Dense KB vectors unavailable (%s); using lexical retrieval", e)
+        return None
+    for name in os.listdir(RAG_VECTOR_DIR):
+        if _VECTOR_FILE_RE.fullmatch(name) and not name.startswith(f"{digest[:16]}-"):
+            stale = os.path.join(RAG_VECTOR_DIR, name)
+            try:
+                if os.path.isdir(stale):
+                    shutil.rmtree(stale)
+                else:
+                    os.remove(stale)
+            except OSError:
+                pass
+    return dense
+
+
+# Shared by every agent in this worker: the prebuilt index when KB_INDEX_DIR
+# is set, the JSON file at KB_PATH otherwise
+if KB_INDEX_DIR:
+    knowledge_base = KnowledgeIndex(
+        os.path.join(KB_INDEX_DIR, kb_artifacts.CURRENT_FILE), loader=_load_prebuilt
+    )
+else:
+    knowledge_base = KnowledgeIndex()
 
 
 def retrieve_context(query: str, top_k: int = 2) -> str:
     """
-    Very lightweight keyword-based retriever over a local JSON knowledge base.
+    Retriever over the local knowledge base.
+
+    Ranks snippets by BM25 ("lexical"), by hashed n-gram vector similarity
+    ("dense", catches paraphrases like "can't sleep" vs "insomnia") or by a
+    blend of both ("hybrid"), according to `RAG_MODE`.
 
     Args:
         query: User symptom / question text used to find relevant snippets.
-        top_k: Maximum number of matching snippets to return.
+        top_k: Maximum number of snippets to return, best match first.
 
     Returns:
         A single string containing up to `top_k` snippets joined with newlines.
         Returns an empty string if the knowledge base file does not exist
         or no snippets match.
     """
-    # If the knowledge base file is missing, just return empty context
-    if not os.path.exists(KB_PATH):
-        return ""
-
-    # Load the JSON file: expected format is a list of objects,
-    # each with at least a "content" field containing text.
-    with open(KB_PATH, "r", encoding="utf-8") as f:
-        docs = json.load(f)
-
-    # Lowercase version of the query for case-insensitive matching
-    query_l = query.lower()
-    hits = []
-
-    # Naive keyword search:
-    # - Split the query into individual words
-    # - For each document, check if ANY word appears in its content
-    for doc in docs:
-        if any(word in doc["content"].lower() for word in query_l.split()):
-            hits.append(doc["content"])
-
-    # Return at most `top_k` matching snippets, joined by newlines
-    return "\n".join(hits[:top_k])
+    with span("retrieve_context", mode=RAG_MODE):
+        snapshot = knowledge_base.snapshot()
+        hits = search(snapshot, query, top_k)
+        return "\n".join(snapshot.documents[doc_id].content for doc_id, _ in hits)
+
+
+def search(snapshot: KBSnapshot, query: str, top_k: int) -> List[Tuple[int, float]]:
+    """Best (doc_id, score) pairs for `query` under the configured mode."""
+    if snapshot.dense is None or RAG_MODE == "lexical":
+        return snapshot.lexical.search(query, top_k)
+    vector = embed(query, snapshot.dense.dim)
+    if RAG_MODE == "dense":
+        return snapshot.dense.search(vector, top_k, RAG_DENSE_MIN_SCORE)
+    return _hybrid_search(snapshot, query, vector, top_k)
+
+
+def _hybrid_search(
+    snapshot: KBSnapshot, query: str, vector, top_k: int
+) -> List[Tuple[int, float]]:
+    # Candidates: every lexical match plus the closest vectors; each scored as
+    # alpha * cosine + (1 - alpha) * BM25 scaled to [0, 1] by the best match
+    lexical = snapshot.lexical.scores(query)
+    cosine: Dict[int, float] = dict(snapshot.dense.search(vector, top_k, RAG_DENSE_MIN_SCORE))
+    lexical_only = [doc_id for doc_id in lexical if doc_id not in cosine]
+    if lexical_only:
+        cosine.update(zip(lexical_only, snapshot.dense.similarity(vector, lexical_only).tolist()))
+
+    best_lexical = max(lexical.values(), default=0.0) or 1.0
+    candidates = {
+        doc_id: RAG_HYBRID_ALPHA * score
+        + (1 - RAG_HYBRID_ALPHA) * lexical.get(doc_id, 0.0) / best_lexical
+        for doc_id, score in cosine.items()
+    }
+    return heapq.nlargest(top_k, candidates.items(), key=lambda item: (item[1], -item[0]))
+
+
+def _collect_metrics():
+    yield (
+        "kb_documents",
+        "gauge",
+        "Documents in the loaded knowledge base",
+        [({}, len(knowledge_base._snapshot.documents))],
+    )
+
+
+register_collector(_collect_metrics)
@@ -0,0 +1,260 @@
+import copy
+import hashlib
+import math
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from healthbackend.config.settings import (
+    RESULT_CACHE_ENABLED,
+    RESULT_CACHE_MAX_ENTRIES,
+    RESULT_CACHE_SIMILARITY,
+    RESULT_CACHE_TTL_SECONDS,
+)
+from healthbackend.services.metrics import register_collector
+
+# Filler words that do not change what the user is asking about
+_STOPWORDS = {
+    "a", "an", "and", "am", "are", "as", "at", "be", "been", "but", "by", "for",
+    "from", "have", "having", "has", "i", "i'm", "im", "in", "is", "it", "me",
+    "my", "of", "on", "or", "some", "the", "to", "very", "with", "since",
+    "also", "feel", "feeling", "getting", "got", "please", "bit", "little",
+}
+
+# Words that negate the symptom after them ("no fever", "not pregnant")
+_NEGATIONS = {
+    "no", "not", "never", "without", "none", "nor", "cannot", "denies", "deny",
+    "don't", "dont", "doesn't", "doesnt", "didn't", "didnt", "isn't", "isnt",
+    "aren't", "arent", "wasn't", "wasnt", "haven't", "havent", "hasn't", "hasnt",
+    "can't", "cant", "won't",
+}
+# Spelled-out quantities; digits are recognized directly
+_NUMBER_WORDS = {
+    "zero", "one", "two", "three", "four", "five", "six", "seven", "eight",
+    "nine", "ten", "eleven", "twelve", "fifteen", "twenty", "thirty", "forty",
+    "fifty", "hundred", "half", "once", "twice", "several", "few", "many",
+}
+_NEGATED = "no:"
+
+_VECTOR_DIM = 4096
+
+
+def normalize_symptoms(text: str) -> str:
+    """
+    Canonical form of a symptom query: lowercase words, filler removed,
+    de-duplicated and sorted, so "fever and headache" and "headache with
+    fever" map to the same key. Plurals are folded ("headaches").
+
+    A negation is bound to the next word ("no fever" -> "no:fever"), so
+    "no fever, headache" and "fever, no headache" stay different keys.
+    """
+    words = re.findall(r"[a-z0-9']+", (text or "").lower().replace("\u2019", "'"))
+    tokens = set()
+    negate = False
+    for word in words:
+        if word in _NEGATIONS:
+            negate = True
+        elif word not in _STOPWORDS:
+            tokens.add((_NEGATED if negate else "") + _stem(word))
+            negate = False
+    if negate:
+        # Trailing negation ("headache? no")
+        tokens.add("no")
+    return " ".join(sorted(tokens))
+
+
+def _changes_meaning(token: str) -> bool:
+    return (
+        token.startswith(_NEGATED)
+        or token == "no"
+        or token in _NUMBER_WORDS
+        or any(c.isdigit() for c in token)
+    )
+
+
+def same_meaning(normalized: str, other: str) -> bool:
+    """
+    False when two normalized queries differ by a negated word or a quantity
+    ("no fever" vs "fever", "3 days" vs "2 days"), however similar the rest.
+    """
+    return not any(_changes_meaning(t) for t in set(normalized.split()) ^ set(other.split()))
+
+
+def _stem(word: str) -> str:
+    # Plural folding only ("headaches" -> "headache"); keeps "stress", "nausea"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def report_hash(report: Optional[str]) -> str:
+    """Stable hash of the (whitespace/case-normalized) medical report text."""
+    text = " ".join((report or "").lower().split())
+    if not text:
+        return ""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _bucket(feature: str) -> int:
+    digest = hashlib.md5(feature.encode("utf-8")).digest()
+    return int.from_bytes(digest[:4], "little") % _VECTOR_DIM
+
+
+def vectorize(normalized: str) -> Dict[int, float]:
+    """
+    Local sparse vector for near-duplicate matching: hashed words plus
+    character trigrams (so "headaches" still lands close to "headache"),
+    L2-normalized.
+    """
+    vec: Dict[int, float] = {}
+    for word in normalized.split():
+        idx = _bucket("w:" + word)
+        vec[idx] = vec.get(idx, 0.0) + 1.0
+        padded = f"#{word}#"
+        for i in range(len(padded) - 2):
+            idx = _bucket("c:" + padded[i : i + 3])
+            vec[idx] = vec.get(idx, 0.0) + 0.5
+    norm = math.sqrt(sum(v * v for v in vec.values())) or 1.0
+    return {k: v / norm for k, v in vec.items()}
+
+
+def _cosine(a: Dict[int, float], b: Dict[int, float]) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(k, 0.0) for k, v in a.items())
+
+
+# ------------------------------------------------------------
+# Orchestration result cache
+# ------------------------------------------------------------
+class ResultCache:
+    """
+    Thread-safe LRU + TTL cache of orchestration results.
+
+    Keyed on (normalized symptoms, medical-report hash). Lookups try an exact
+    key match first, then the most similar cached query with the same report
+    whose cosine similarity is at least `similarity_threshold`. A near
+    duplicate never matches when the queries differ by a negation or a
+    number (see `same_meaning`).
+    """
+
+    def __init__(
+        self,
+        max_entries: int = RESULT_CACHE_MAX_ENTRIES,
+        ttl_seconds: float = RESULT_CACHE_TTL_SECONDS,
+        similarity_threshold: float = RESULT_CACHE_SIMILARITY,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._lock = threading.Lock()
+        # (normalized, report_hash) -> (expires_at, vector, result)
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, Dict[int, float], Dict[str, Any]]]" = (
+            OrderedDict()
+        )
+        # Same keys in the order they expire (the TTL is fixed, so put order)
+        self._expiry: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._stats = {
+            "hits_exact": 0,
+            "hits_near": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+        }
+
+    def get(self, symptoms: str, report: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Return a deep copy of the cached result, or None on a miss."""
+        normalized = normalize_symptoms(symptoms)
+        key = (normalized, report_hash(report))
+        now = time.time()
+
+        with self._lock:
+            self._expire(now)
+
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._stats["hits_exact"] += 1
+                return copy.deepcopy(entry[2])
+
+            if self.similarity_threshold < 1.0 and normalized:
+                vector = vectorize(normalized)
+                best_key, best_score = None, self.similarity_threshold
+                for other_key, (_, other_vec, _) in self._entries.items():
+                    if other_key[1] != key[1] or not same_meaning(normalized, other_key[0]):
+                        continue
+                    score = _cosine(vector, other_vec)
+                    if score >= best_score:
+                        best_key, best_score = other_key, score
+                if best_key is not None:
+                    self._entries.move_to_end(best_key)
+                    self._stats["hits_near"] += 1
+                    return copy.deepcopy(self._entries[best_key][2])
+
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, symptoms: str, report: Optional[str], result: Dict[str, Any]) -> None:
+        normalized = normalize_symptoms(symptoms)
+        if not normalized:
+            return
+        key = (normalized, report_hash(report))
+        with self._lock:
+            expires_at = time.time() + self.ttl_seconds
+            self._entries[key] = (expires_at, vectorize(normalized), copy.deepcopy(result))
+            self._entries.move_to_end(key)
+            self._expiry[key] = expires_at
+            self._expiry.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                del self._expiry[evicted]
+                self._stats["evictions"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = (
+                self._stats["hits_exact"] + self._stats["hits_near"] + self._stats["misses"]
+            )
+            hits = self._stats["hits_exact"] + self._stats["hits_near"]
+            return {
+                **self._stats,
+                "size": len(self._entries),
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._expiry.clear()
+
+    def _expire(self, now: float) -> None:
+        # Caller holds the lock; only the expired prefix is visited
+        while self._expiry:
+            key, expires_at = next(iter(self._expiry.items()))
+            if expires_at > now:
+                break
+            del self._expiry[key]
+            del self._entries[key]
+            self._stats["expirations"] += 1
+
+
+# Process-wide cache used by the orchestrator (None when disabled)
+result_cache: Optional[ResultCache] = ResultCache() if RESULT_CACHE_ENABLED else None
+
+
+def _collect_metrics():
+    if result_cache is None:
+        return
+    stats = result_cache.stats()
+    yield (
+        "result_cache_lookups_total",
+        "counter",
+        "Result cache lookups by outcome",
+        [({"outcome": name}, stats[name]) for name in ("hits_exact", "hits_near", "misses")],
+    )
+    yield ("result_cache_entries", "gauge", "Cached orchestration results", [({}, stats["size"])])
+
+
+register_collector(_collect_metrics)
@@ -0,0 +1,235 @@
+import asyncio
+import concurrent.futures
+import logging
+import threading
+from collections import Counter
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+from healthbackend.config.settings import SINGLE_FLIGHT_ENABLED
+from healthbackend.services.background_loop import get_background_loop
+
+logger = logging.getLogger("healthbackend")
+
+
+# ------------------------------------------------------------
+# Single-flight coalescing
+# ------------------------------------------------------------
+# Flask serves each request on its own thread with its own event loop, so
+# in-flight work is shared through thread-safe primitives: a
+# concurrent.futures.Future for one-shot results, and a lock-protected event
+# log with per-subscriber wake-ups (call_soon_threadsafe) for streams.
+class SingleFlight:
+    """Run one computation per key; concurrent callers with the same key share it."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight: Dict[Hashable, concurrent.futures.Future] = {}
+        self._stats = Counter()
+
+    async def run(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Await `factory()` unless an identical computation is already running.
+
+        Returns:
+            (result, leader): `leader` is True for the caller that actually
+            ran the computation; followers receive the same result object.
+        """
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = concurrent.futures.Future()
+                self._inflight[key] = future
+            self._stats["leaders" if leader else "followers"] += 1
+
+        if not leader:
+            try:
+                # shield: a follower going away must not cancel the shared future
+                return await asyncio.shield(asyncio.wrap_future(future)), False
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # The leader was cancelled mid-way: compute it ourselves
+                return await factory(), True
+
+        try:
+            result = await factory()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, True
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._stats, "in_flight": len(self._inflight)}
+
+
+class Broadcast:
+    """
+    Event log of one shared stream.
+
+    Subscribers replay the events published so far, then follow live ones,
+    from any thread or event loop. `context` is an object owned by the
+    producer that subscribers may read once the stream has finished.
+    """
+
+    def __init__(self, context: Any = None):
+        self.context = context
+        self._lock = threading.Lock()
+        self._events: List[Any] = []
+        self._done = False
+        self._error: Optional[BaseException] = None
+        self._waiters: Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = set()
+        self._subscribers = 1  # the subscriber that started the stream
+        self._abandoned = False
+        self._producer: Optional[Tuple[asyncio.AbstractEventLoop, asyncio.Task]] = None
+
+    def publish(self, event: Any) -> None:
+        with self._lock:
+            self._events.append(event)
+            waiters = list(self._waiters)
+        self._wake(waiters)
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            self._done = True
+            self._error = error
+            waiters = list(self._waiters)
+        self._wake(waiters)
+
+    @staticmethod
+    def _wake(waiters) -> None:
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # The subscriber's loop is already closed
+                pass
+
+    def _attach(self) -> bool:
+        # False once every subscriber has left (the producer is being stopped)
+        with self._lock:
+            if self._abandoned:
+                return False
+            self._subscribers += 1
+            return True
+
+    async def events(self) -> AsyncIterator[Any]:
+        """Replay past events, then yield new ones until the stream ends."""
+        loop = asyncio.get_running_loop()
+        wake = asyncio.Event()
+        waiter = (loop, wake)
+        index = 0
+        try:
+            while True:
+                with self._lock:
+                    pending = self._events[index:]
+                    index = len(self._events)
+                    done, error = self._done, self._error
+                    if not pending and not done:
+                        wake.clear()
+                        self._waiters.add(waiter)
+                for event in pending:
+                    yield event
+                if pending:
+                    continue
+                if done:
+                    if error is not None:
+                        raise error
+                    return
+                await wake.wait()
+        finally:
+            self._leave(waiter)
+
+    def _leave(self, waiter) -> None:
+        with self._lock:
+            self._waiters.discard(waiter)
+            self._subscribers -= 1
+            last = self._subscribers == 0 and not self._done
+            self._abandoned = self._abandoned or last
+            producer = self._producer
+        if last and producer is not None:
+            # Nobody is listening any more: stop the shared computation
+            loop, task = producer
+            try:
+                loop.call_soon_threadsafe(task.cancel)
+            except RuntimeError:
+                pass
+
+
+class StreamFlight:
+    """Share one running event stream between concurrent identical requests."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._streams: Dict[Hashable, Broadcast] = {}
+        self._stats = Counter()
+
+    def join(
+        self,
+        key: Hashable,
+        make_context: Callable[[], Any],
+        produce: Callable[[Any], AsyncIterator[Any]],
+    ) -> Broadcast:
+        """
+        Subscribe to the stream for `key`, starting it if none is running.
+
+        The first subscriber creates the context with `make_context()` and
+        starts `produce(context)` on the worker's background event loop, so
+        the stream does not depend on any one subscriber staying connected.
+        Every returned Broadcast must be iterated with `events()`.
+        """
+        with self._lock:
+            broadcast = self._streams.get(key)
+            leader = broadcast is None or not broadcast._attach()
+            if leader:
+                broadcast = Broadcast(make_context())
+                self._streams[key] = broadcast
+            self._stats["leaders" if leader else "followers"] += 1
+
+        if leader:
+            asyncio.run_coroutine_threadsafe(
+                self._produce(key, broadcast, produce), get_background_loop()
+            )
+        return broadcast
+
+    async def _produce(self, key: Hashable, broadcast: Broadcast, produce) -> None:
+        task = asyncio.current_task()
+        with broadcast._lock:
+            broadcast._producer = (asyncio.get_running_loop(), task)
+            abandoned = broadcast._abandoned
+        error: Optional[BaseException] = None
+        stream = produce(broadcast.context)
+        try:
+            if not abandoned:
+                async for event in stream:
+                    broadcast.publish(event)
+        except asyncio.CancelledError:
+            error = asyncio.CancelledError()
+        except Exception as e:
+            logger.exception("Shared stream %r failed", key)
+            error = e
+        finally:
+            await stream.aclose()
+            # Later requests start a fresh stream (no stale replays)
+            with self._lock:
+                if self._streams.get(key) is broadcast:
+                    del self._streams[key]
+            broadcast.finish(error)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._stats, "in_flight": len(self._streams)}
+
+
+# Process-wide instances used by the orchestrator (None when disabled)
+orchestration_flight: Optional[SingleFlight] = SingleFlight() if SINGLE_FLIGHT_ENABLED else None
+stream_flight: Optional[StreamFlight] = StreamFlight() if SINGLE_FLIGHT_ENABLED else None
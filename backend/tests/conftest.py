@@ -0,0 +1,34 @@
+"""
+Test setup: the backend is imported as the `healthbackend` package (its
+deployed name), and every on-disk store points into a throwaway directory.
+"""
+import importlib.util
+import os
+import sys
+import tempfile
+
+_BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_STORE_DIR = tempfile.mkdtemp(prefix="healthbackend-tests-")
+
+for _name, _file in (
+    ("LLM_MEMO_PATH", "llm_memo.sqlite3"),
+    ("KEY_POOL_PATH", "key_pool.sqlite3"),
+    ("JOB_STORE_PATH", "jobs.sqlite3"),
+    ("RAG_VECTOR_DIR", "kb_vectors"),
+):
+    os.environ.setdefault(_name, os.path.join(_STORE_DIR, _file))
+os.environ.setdefault("GROQ_API_KEY", "test-key-1,test-key-2")
+
+# Checked out as backend/, deployed as healthbackend/
+if "healthbackend" not in sys.modules:
+    try:
+        import healthbackend  # noqa: F401
+    except ImportError:
+        _spec = importlib.util.spec_from_file_location(
+            "healthbackend",
+            os.path.join(_BACKEND_DIR, "__init__.py"),
+            submodule_search_locations=[_BACKEND_DIR],
+        )
+        _module = importlib.util.module_from_spec(_spec)
+        sys.modules["healthbackend"] = _module
+        _spec.loader.exec_module(_module)
@@ -0,0 +1,96 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from healthbackend.services.admission import AdmissionController
+from healthbackend.utils.exceptions import OverloadError
+
+
+def test_full_queue_is_rejected_with_429():
+    controller = AdmissionController(max_concurrent=1, max_queue=0, queue_timeout=1.0)
+    ticket = controller.acquire()
+    with pytest.raises(OverloadError) as exc:
+        controller.acquire()
+    assert exc.value.status_code == 429
+    assert exc.value.retry_after >= 1
+    assert controller.stats()["rejected_queue_full"] == 1
+
+    ticket.release()
+    controller.acquire().release()
+
+
+def test_wait_past_timeout_is_rejected_with_503():
+    controller = AdmissionController(max_concurrent=1, max_queue=4, queue_timeout=0.05)
+    ticket = controller.acquire()
+    with pytest.raises(OverloadError) as exc:
+        controller.acquire()
+    assert exc.value.status_code == 503
+    stats = controller.stats()
+    assert stats["rejected_timeout"] == 1
+    # The timed-out request left the queue; the slot is still held
+    assert stats["queue_depth"] == 0 and stats["in_flight"] == 1
+    ticket.release()
+    assert controller.stats()["in_flight"] == 0
+
+
+def test_released_slot_goes_to_oldest_waiter():
+    controller = AdmissionController(max_concurrent=1, max_queue=4, queue_timeout=5.0)
+    ticket = controller.acquire()
+    order = []
+
+    def wait(name):
+        with controller.slot():
+            order.append(name)
+
+    threads = []
+    for name in ("first", "second"):
+        thread = threading.Thread(target=wait, args=(name,))
+        thread.start()
+        threads.append(thread)
+        while controller.stats()["queue_depth"] < len(threads):
+            time.sleep(0.001)
+
+    ticket.release()
+    for thread in threads:
+        thread.join(5.0)
+    assert order == ["first", "second"]
+    assert controller.stats()["in_flight"] == 0
+
+
+def test_async_waiter_timeout_and_cancel():
+    controller = AdmissionController(max_concurrent=1, max_queue=4, queue_timeout=0.05)
+
+    async def main():
+        ticket = await controller.aacquire()
+        with pytest.raises(OverloadError) as exc:
+            await controller.aacquire()
+        assert exc.value.status_code == 503
+
+        # A client that goes away while queued gives up its place
+        controller.queue_timeout = 5.0
+        waiter = asyncio.create_task(controller.aacquire())
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert controller.stats()["queue_depth"] == 0
+        ticket.release()
+
+    asyncio.run(main())
+    assert controller.stats()["in_flight"] == 0
+
+
+def test_overloaded_route_returns_retry_after(monkeypatch):
+    from healthbackend import app as app_module
+
+    controller = AdmissionController(max_concurrent=1, max_queue=0, queue_timeout=1.0)
+    monkeypatch.setattr(app_module, "admission", controller)
+    ticket = controller.acquire()
+    try:
+        response = app_module.app.test_client().post("/recommendations", json={})
+    finally:
+        ticket.release()
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+from healthbackend.services.agent_graph import AgentNode, run_agent_graph, validate_graph
+
+
+def _agent(value, delay=0.0):
+    async def run(**kwargs):
+        await asyncio.sleep(delay)
+        return value
+
+    return run
+
+
+def test_validate_graph_rejects_cycle():
+    nodes = [
+        AgentNode("a", "A", _agent(1), args={"x": "b"}),
+        AgentNode("b", "B", _agent(2), args={"x": "a"}),
+        AgentNode("c", "C", _agent(3)),
+    ]
+    with pytest.raises(ValueError, match="cycle"):
+        validate_graph(nodes)
+
+
+def test_validate_graph_rejects_unknown_after_edge():
+    with pytest.raises(ValueError, match="unknown"):
+        validate_graph([AgentNode("a", "A", _agent(1), after=["missing"])])
+
+
+def test_dependencies_receive_outputs_and_inputs():
+    async def combine(first, query):
+        return f"{first}+{query}"
+
+    nodes = [
+        AgentNode("first", "First", _agent("one")),
+        AgentNode("second", "Second", combine, args={"first": "first", "query": "query"}),
+    ]
+    results, flow = asyncio.run(run_agent_graph(nodes, {"query": "q"}))
+
+    assert results == {"first": "one", "second": "one+q"}
+    assert [entry["agent"] for entry in flow] == ["First", "Second"]
+    assert flow[1]["started_at"] >= flow[0]["finished_at"]
+
+
+def test_independent_agents_run_concurrently():
+    nodes = [AgentNode(name, name, _agent(name, delay=0.2)) for name in "abcd"]
+
+    async def timed():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await run_agent_graph(nodes, {})
+        return loop.time() - started
+
+    assert asyncio.run(timed()) < 0.6
+
+
+def test_failure_cancels_running_agents():
+    cancelled = asyncio.Event()
+    dependent_started = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("agent failed")
+
+    async def dependent(**kwargs):
+        dependent_started.append(True)
+
+    nodes = [
+        AgentNode("slow", "Slow", slow),
+        AgentNode("failing", "Failing", failing),
+        AgentNode("after", "After", dependent, args={"x": "failing"}),
+    ]
+
+    async def run():
+        with pytest.raises(RuntimeError, match="agent failed"):
+            await asyncio.wait_for(run_agent_graph(nodes, {}), timeout=2)
+        return cancelled.is_set()
+
+    assert asyncio.run(run())
+    assert dependent_started == []
@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+
+from healthbackend.services.ann_index import IVFIndex, open_or_build
+from healthbackend.services.embeddings import DenseIndex
+
+
+def _unit(rows):
+    return (rows / np.linalg.norm(rows, axis=1, keepdims=True)).astype(np.float32)
+
+
+@pytest.fixture(scope="module")
+def data():
+    """2000 clustered unit vectors (40 topics) and 50 queries near them."""
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(40, 64))
+    vectors = _unit(np.repeat(centers, 50, axis=0) + 0.6 * rng.normal(size=(2000, 64)))
+    queries = _unit(centers[rng.integers(0, 40, 50)] + 0.6 * rng.normal(size=(50, 64)))
+    return vectors, queries
+
+
+def _ids(hits):
+    return [doc_id for doc_id, _ in hits]
+
+
+def _recall(index, exact, queries, k=10, **kwargs):
+    found = 0
+    for query in queries:
+        truth = set(_ids(exact.search(query, k, -1.0)))
+        found += len(truth & set(_ids(index.search(query, k, -1.0, **kwargs))))
+    return found / (k * len(queries))
+
+
+def test_recall_against_exact_search(data):
+    vectors, queries = data
+    index = IVFIndex.train(vectors, nlist=32, nprobe=8)
+    exact = DenseIndex(vectors)
+    assert _recall(index, exact, queries) >= 0.9
+    # More lists probed, at least as good; all of them is exact search
+    assert _recall(index, exact, queries, nprobe=2) <= _recall(index, exact, queries)
+    assert _recall(index, exact, queries, nprobe=32) == 1.0
+
+
+def test_scores_match_exact_cosine(data):
+    vectors, queries = data
+    index = IVFIndex.train(vectors, nlist=32, nprobe=32)
+    for doc_id, score in index.search(queries[0], 5):
+        assert score == pytest.approx(float(vectors[doc_id] @ queries[0]), abs=1e-5)
+    ids = [3, 1500, 42]
+    assert np.allclose(index.similarity(queries[0], ids), vectors[ids] @ queries[0], atol=1e-5)
+
+
+def test_save_and_open_round_trip(data, tmp_path):
+    vectors, queries = data
+    index = IVFIndex.train(vectors, nlist=16, nprobe=4)
+    path = str(tmp_path / "ivf")
+    index.save(path)
+    opened = IVFIndex.open(path, nprobe=4)
+
+    assert (opened.nlist, opened.dim, len(opened), opened.trained_on) == (16, 64, 2000, 2000)
+    assert isinstance(opened.vectors, np.memmap)
+    for query in queries[:10]:
+        assert opened.search(query, 10) == index.search(query, 10)
+
+    # Saving again replaces the directory in place
+    index.save(path)
+    assert len(IVFIndex.open(path)) == 2000
+
+
+def test_open_or_build_reuses_a_saved_index(data, tmp_path):
+    vectors, _ = data
+    path = str(tmp_path / "kb" / "ivf-auto")
+    built = open_or_build(path, vectors[:500], nlist=8)
+    # A second worker opens the saved copy instead of training again
+    reopened = open_or_build(path, np.zeros((0, 64), dtype=np.float32))
+    assert reopened.nlist == built.nlist == 8
+    assert len(reopened) == 500
+
+
+def test_added_vectors_are_searchable_before_and_after_compact(data, tmp_path):
+    vectors, _ = data
+    index = IVFIndex.train(vectors[:1500], nlist=16, nprobe=16)
+    index.add(vectors[1500:])
+    assert len(index) == 2000
+
+    def finds_itself(idx):
+        return all(_ids(idx.search(vectors[i], 1))[0] == i for i in (1500, 1750, 1999))
+
+    # Served from the insert tail, then from the merged layout
+    assert finds_itself(index)
+    assert index.similarity(vectors[1999], [1999])[0] == pytest.approx(1.0, abs=1e-5)
+    index.compact()
+    assert len(index._tail_ids) == 0 and len(index.ids) == 2000
+    assert np.all(np.diff(index.offsets) >= 0) and index.offsets[-1] == 2000
+    assert finds_itself(index)
+
+    # The centroids were not retrained; a save merges everything to disk
+    index.add(vectors[:1], ids=[5000])
+    index.save(str(tmp_path / "ivf"))
+    opened = IVFIndex.open(str(tmp_path / "ivf"), nprobe=16)
+    assert len(opened) == 2001
+    assert opened.trained_on == 1500
+    assert 5000 in _ids(opened.search(vectors[0], 2))
@@ -0,0 +1,120 @@
+import asyncio
+
+import pytest
+
+from healthbackend.services import api_key_pool
+from healthbackend.services.key_pool_backends import InMemoryKeyPoolBackend
+
+
+class FakeClock:
+    def __init__(self, now=1_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(api_key_pool, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def pool(monkeypatch, clock):
+    """Two keys with 60 requests / 6000 tokens per minute and 2 calls in flight each."""
+    monkeypatch.setattr(api_key_pool, "GROQ_RPM_LIMIT", 60)
+    monkeypatch.setattr(api_key_pool, "GROQ_TPM_LIMIT", 6000)
+    monkeypatch.setattr(api_key_pool, "GROQ_MAX_IN_FLIGHT_PER_KEY", 2)
+    backend = InMemoryKeyPoolBackend(["key-aaaa", "key-bbbb"], api_key_pool._new_key_state)
+    for s in backend._state.values():
+        s["refilled_at"] = clock.now
+    monkeypatch.setattr(api_key_pool, "_backend", backend)
+    return backend._state
+
+
+def test_token_bucket_refills_at_the_per_minute_rate(pool, clock):
+    s = pool["key-aaaa"]
+    s["tokens"] = 0.0
+    s["requests"] = 0.0
+
+    clock.now += 15
+    api_key_pool._refill(s, clock.now)
+    assert s["tokens"] == pytest.approx(1500)
+    assert s["requests"] == pytest.approx(15)
+
+    # Capped at one minute's worth
+    clock.now += 600
+    api_key_pool._refill(s, clock.now)
+    assert s["tokens"] == pytest.approx(6000)
+    assert s["requests"] == pytest.approx(60)
+
+
+def test_wait_time_until_the_bucket_has_enough_tokens(pool, clock):
+    s = pool["key-aaaa"]
+    s["tokens"] = 1000.0
+    # 2000 more tokens at 100 tokens/s
+    assert api_key_pool._wait_time(s, 3000, clock.now) == pytest.approx(20)
+    assert api_key_pool._wait_time(s, 500, clock.now) == 0.0
+
+
+def test_acquire_charges_the_buckets_and_release_corrects_the_estimate(pool):
+    key = api_key_pool.try_acquire_key(1000)
+    s = pool[key]
+    assert s["in_flight"] == 1
+    assert s["tokens"] == pytest.approx(5000)
+    assert s["requests"] == pytest.approx(59)
+
+    api_key_pool.release_key(key, 1000, used_tokens=400)
+    assert s["in_flight"] == 0
+    assert s["tokens"] == pytest.approx(5600)
+    assert s["used_tokens"] == 400
+
+
+def test_in_flight_cap_per_key(pool):
+    keys = [api_key_pool.try_acquire_key(10) for _ in range(4)]
+    # Spread over both keys, least loaded first
+    assert sorted(keys) == ["key-aaaa", "key-aaaa", "key-bbbb", "key-bbbb"]
+    assert api_key_pool.try_acquire_key(10) is None
+
+    api_key_pool.release_key("key-bbbb", 10)
+    assert api_key_pool.try_acquire_key(10) == "key-bbbb"
+
+
+def test_exhausted_token_bucket_makes_a_key_unusable(pool):
+    pool["key-aaaa"]["tokens"] = 0.0
+    assert api_key_pool.try_acquire_key(100) == "key-bbbb"
+    assert api_key_pool.try_acquire_key(100) == "key-bbbb"
+    assert api_key_pool.try_acquire_key(100) is None
+
+
+def test_cooldown_skips_a_key_until_it_expires(pool, clock):
+    api_key_pool.mark_key_rate_limited("key-aaaa", retry_after=5)
+    assert {api_key_pool.try_acquire_key(10) for _ in range(2)} == {"key-bbbb"}
+    api_key_pool.release_key("key-bbbb", 10)
+    api_key_pool.release_key("key-bbbb", 10)
+
+    clock.now += 6
+    assert api_key_pool.try_acquire_key(10) == "key-aaaa"
+
+
+def test_rate_limit_headers_override_the_local_budget(pool, clock):
+    key = api_key_pool.try_acquire_key(10)
+    api_key_pool.release_key(
+        key,
+        10,
+        headers={"x-ratelimit-limit-tokens": "3000", "x-ratelimit-remaining-tokens": "120"},
+    )
+    assert pool[key]["tpm_reported"] == 3000
+    assert pool[key]["tokens"] == pytest.approx(120)
+
+
+def test_acquire_fails_when_no_key_frees_up_in_time(pool):
+    for _ in range(4):
+        api_key_pool.try_acquire_key(10)
+    with pytest.raises(RuntimeError, match="rate limited, busy"):
+        asyncio.run(api_key_pool.aacquire_key(10, timeout=0.01))
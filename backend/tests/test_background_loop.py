@@ -0,0 +1,67 @@
+import asyncio
+import threading
+
+import pytest
+
+from healthbackend.services import background_loop
+from healthbackend.services.background_loop import iterate_in_background
+
+
+def _drain(agen, timeout=10.0):
+    """Iterate the bridge in a thread; fail instead of hanging the suite."""
+    items, errors = [], []
+
+    def consume():
+        try:
+            for item in iterate_in_background(agen, maxsize=2):
+                items.append(item)
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=consume, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "stream consumer is still blocked"
+    return items, errors
+
+
+def test_items_then_done():
+    async def events():
+        for i in range(5):
+            yield i
+
+    assert _drain(events()) == ([0, 1, 2, 3, 4], [])
+
+
+def test_generator_error_reaches_consumer():
+    async def events():
+        yield 1
+        raise ValueError("boom")
+
+    items, errors = _drain(events())
+    assert items == [1]
+    assert isinstance(errors[0], ValueError)
+
+
+def test_cancelled_generator_does_not_block_consumer():
+    async def events():
+        yield 1
+        raise asyncio.CancelledError()
+
+    items, errors = _drain(events())
+    assert items == [1]
+    assert isinstance(errors[0], RuntimeError)
+
+
+def test_consumer_notices_pump_gone_with_full_queue(monkeypatch):
+    monkeypatch.setattr(background_loop, "_PUMP_CHECK_SECONDS", 0.05)
+
+    async def events():
+        # Fill the queue (maxsize=2) before cancelling, so no error item fits
+        yield 1
+        yield 2
+        raise asyncio.CancelledError()
+
+    items, errors = _drain(events())
+    assert items == [1, 2]
+    assert isinstance(errors[0], RuntimeError)
@@ -0,0 +1,68 @@
+import json
+import math
+
+from healthbackend.services.bm25 import B, K1, BM25Index, tokenize
+
+
+def test_tokenize_drops_stopwords_and_folds_plurals():
+    assert tokenize("I have Headaches and a stress rash") == ["headache", "stress", "rash"]
+
+
+def test_rare_term_outranks_common_term():
+    index = BM25Index.build(
+        [
+            "fever and cough",
+            "fever with chills",
+            "fever after travel",
+            "migraine with aura",
+        ]
+    )
+    hits = index.search("fever migraine", top_k=4)
+    assert hits[0][0] == 3
+    assert {doc_id for doc_id, _ in hits} == {0, 1, 2, 3}
+
+
+def test_shorter_document_wins_for_same_term_frequency():
+    index = BM25Index.build(
+        [
+            "insomnia sleep hygiene routine caffeine screens bedroom darkness",
+            "insomnia",
+            "unrelated back pain",
+        ]
+    )
+    assert [doc_id for doc_id, _ in index.search("insomnia", top_k=3)] == [1, 0]
+
+
+def test_term_frequency_saturates():
+    index = BM25Index.build(["rash", "rash rash", "rash " * 20, "other words here"])
+    scores = index.scores("rash")
+    # More occurrences help, but far less than linearly
+    assert scores[0] < scores[1] < 2 * scores[0]
+    idf = index.idf["rash"]
+    assert all(score < idf * (K1 + 1) for score in scores.values())
+
+
+def test_score_matches_formula():
+    index = BM25Index.build(["knee pain", "knee knee swelling ice", "wrist sprain"])
+    idf = math.log(1 + (3 - 2 + 0.5) / (2 + 0.5))
+    length, avg = 4, (2 + 4 + 2) / 3
+    expected = idf * 2 * (K1 + 1) / (2 + K1 * (1 - B + B * length / avg))
+    assert math.isclose(index.scores("knee")[1], expected)
+
+
+def test_no_match_and_top_k():
+    index = BM25Index.build(["cough", "cough syrup", "cough drops"])
+    assert index.search("the and of", top_k=3) == []
+    assert index.search("fracture", top_k=3) == []
+    assert len(index.search("cough", top_k=2)) == 2
+
+
+def test_ties_go_to_earlier_document():
+    index = BM25Index.build(["nausea", "nausea", "nausea"])
+    assert [doc_id for doc_id, _ in index.search("nausea", top_k=3)] == [0, 1, 2]
+
+
+def test_round_trip_through_json():
+    index = BM25Index.build(["dry cough at night", "chest pain", "night sweats"])
+    loaded = BM25Index.from_dict(json.loads(json.dumps(index.to_dict())))
+    assert loaded.search("night cough", top_k=3) == index.search("night cough", top_k=3)
@@ -0,0 +1,115 @@
+import json
+import threading
+
+import pytest
+
+from healthbackend.services import history_store, intent
+
+
+@pytest.fixture(autouse=True)
+def fresh_model(tmp_path, monkeypatch):
+    monkeypatch.setattr(history_store, "FILE", str(tmp_path / "history.json"))
+    monkeypatch.setattr(intent, "_model", None)
+    monkeypatch.setattr(intent, "_model_history_mtime", None)
+    monkeypatch.setattr(intent, "_decisions", type(intent._decisions)())
+    monkeypatch.setattr(intent, "_stats", type(intent._stats)())
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    calls = []
+
+    def fake(text):
+        calls.append(text)
+        return True
+
+    monkeypatch.setattr(intent, "_llm_is_health_query", fake)
+    return calls
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "knee injury during a football match",
+        "eye strain from staring at my computer screen",
+        "wrist hurts from typing code all day",
+        "jet lag after a long flight",
+    ],
+)
+def test_mixed_health_and_off_topic_queries_go_to_the_llm(query, llm):
+    decision, _, _ = intent._quick_decision(query)
+    assert decision is None
+    assert intent.is_health_query(query) is True
+    assert llm == [query]
+
+
+def test_clear_health_query_is_accepted_locally(llm):
+    assert intent.is_health_query("fever and a bad cough with headaches") is True
+    assert llm == []
+
+
+def test_clear_off_topic_query_is_rejected_locally(llm):
+    assert intent.is_health_query("python code for a football score website") is False
+    assert llm == []
+    assert intent.intent_stats()["local_no"] == 1
+
+
+def test_negated_symptom_is_still_a_health_query(llm):
+    assert intent.is_health_query("no fever but coughing and sore throat") is True
+    assert llm == []
+
+
+def test_inflections_match_but_longer_words_do_not():
+    model, _ = intent._train()
+    assert model._term("coughing") == "cough"
+    assert model._term("injuries") == "injury"
+    assert model._term("painting") is None
+
+
+def test_painting_is_not_a_confident_yes():
+    decision, _, _ = intent._quick_decision("painting tips")
+    assert decision is not True
+
+
+def test_seed_keywords_survive_normalization():
+    # Seeds dropped as filler by normalize_symptoms could never match
+    model, _ = intent._train()
+    assert model.health_terms <= set(model.weights)
+    assert all(list(intent._tokens(keyword)) for keyword in intent.HEALTH_KEYWORDS)
+
+
+def test_decisions_are_cached(llm):
+    intent.is_health_query("knee injury during a football match")
+    intent.is_health_query("football match during a knee injury")
+    assert len(llm) == 1
+    assert intent.intent_stats()["cache_hits"] == 1
+
+
+def test_history_change_retrains_in_the_background(monkeypatch):
+    model = intent._get_model()
+    with open(history_store.FILE, "w", encoding="utf-8") as f:
+        json.dump({"u": [{"query": "zygomatic arch discomfort"}]}, f)
+
+    started = threading.Event()
+    release = threading.Event()
+    train = intent._train
+
+    def slow_train():
+        started.set()
+        release.wait(5)
+        return train()
+
+    monkeypatch.setattr(intent, "_train", slow_train)
+    monkeypatch.setattr(intent, "INTENT_RETRAIN_INTERVAL", 0.0)
+
+    # The request path returns the current model while retraining runs
+    assert intent._get_model() is model
+    assert started.wait(5)
+    assert intent._get_model() is model
+    release.set()
+
+    for _ in range(100):
+        if intent._get_model() is not model and not intent._retrain_lock.locked():
+            break
+        threading.Event().wait(0.02)
+    assert "zygomatic" in intent._get_model().weights
@@ -0,0 +1,120 @@
+import asyncio
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from healthbackend.services import job_store, jobs
+
+
+def _dead_pid():
+    proc = subprocess.Popen([sys.executable, "-c", "pass"])
+    proc.wait()
+    return proc.pid
+
+
+def _job_of(monkeypatch, worker, pid, heartbeat_at):
+    """A queued job left by `worker`, whose last heartbeat was at `heartbeat_at`."""
+    monkeypatch.setattr(job_store, "worker_id", lambda: worker)
+    job_id = job_store.create_job({"symptoms": "headache"})
+    monkeypatch.undo()
+    job_store._connect().execute(
+        "UPDATE job_workers SET pid = ?, heartbeat_at = ? WHERE worker = ?",
+        (pid, heartbeat_at, worker),
+    )
+    job_store.mark_running(job_id)
+    return job_id
+
+
+def _claimed_ids():
+    return {job_id for job_id, _ in job_store.claim_orphaned_jobs()}
+
+
+def test_job_of_dead_process_is_reclaimed(monkeypatch):
+    job_id = _job_of(monkeypatch, "dead-worker", _dead_pid(), time.time())
+    assert job_id in _claimed_ids()
+    job = job_store.get_job(job_id)
+    assert job["status"] == job_store.QUEUED
+    # Now owned by this worker: not claimed twice
+    assert job_id not in _claimed_ids()
+
+
+def test_reused_pid_does_not_keep_a_stale_job(monkeypatch):
+    # The old worker's pid now belongs to a live process (this one)
+    stale = time.time() - job_store.JOB_LEASE_SECONDS - 1
+    job_id = _job_of(monkeypatch, "restarted-worker", os.getpid(), stale)
+    assert job_id in _claimed_ids()
+
+
+def test_live_worker_keeps_its_jobs(monkeypatch):
+    job_id = _job_of(monkeypatch, "live-worker", os.getpid(), time.time())
+    assert job_id not in _claimed_ids()
+    assert job_store.get_job(job_id)["status"] == job_store.RUNNING
+
+
+def test_finished_jobs_are_not_reclaimed(monkeypatch):
+    job_id = _job_of(monkeypatch, "finished-worker", _dead_pid(), time.time())
+    job_store.complete_job(job_id, {"agent_flow": []})
+    assert job_id not in _claimed_ids()
+
+
+def test_cancelled_job_stays_reclaimable(monkeypatch):
+    async def orchestrate(*args, **kwargs):
+        await asyncio.sleep(60)
+
+    monkeypatch.setattr(jobs, "orchestrate", orchestrate)
+    monkeypatch.setattr(jobs, "_slots", None)
+    job_id = job_store.create_job({"symptoms": "headache"})
+    with jobs._lock:
+        jobs._pending += 1
+
+    async def main():
+        task = asyncio.create_task(jobs._run_job(job_id, {"symptoms": "headache"}))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    # Left running for another worker to take over, not failed
+    assert job_store.get_job(job_id)["status"] == job_store.RUNNING
+
+
+def test_job_store_writes_run_off_the_event_loop(monkeypatch):
+    threads = {}
+
+    def recording(name):
+        original = getattr(job_store, name)
+
+        def write(*args):
+            threads[name] = threading.current_thread()
+            return original(*args)
+
+        monkeypatch.setattr(job_store, name, write)
+
+    for name in ("mark_running", "set_agent_flow", "complete_job"):
+        recording(name)
+
+    async def orchestrate(*args, on_agent_done=None, **kwargs):
+        on_agent_done(None, {"agent": "Fake", "output": "ok"})
+        return {"agent_flow": [{"agent": "Fake", "output": "ok"}]}
+
+    monkeypatch.setattr(jobs, "orchestrate", orchestrate)
+    monkeypatch.setattr(jobs, "_slots", None)
+    job_id = job_store.create_job({"symptoms": "headache"})
+    with jobs._lock:
+        jobs._pending += 1
+
+    async def main():
+        await jobs._run_job(job_id, {"symptoms": "headache"})
+        return threading.current_thread()
+
+    loop_thread = asyncio.run(main())
+    assert set(threads) == {"mark_running", "set_agent_flow", "complete_job"}
+    assert loop_thread not in threads.values()
+    job = job_store.get_job(job_id)
+    assert job["status"] == job_store.SUCCEEDED
+    assert job["agent_flow"] == [{"agent": "Fake", "output": "ok"}]
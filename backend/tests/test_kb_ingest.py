@@ -0,0 +1,125 @@
+import os
+
+import numpy as np
+
+from healthbackend.services import kb_artifacts
+from healthbackend.tools.kb_ingest import chunk_words, ingest
+
+
+def _sentences(count, words=5):
+    return [" ".join(f"s{i}w{j}" for j in range(words)) + "." for i in range(count)]
+
+
+def _words(chunk):
+    return chunk.split()
+
+
+def test_chunks_respect_the_word_limit_and_keep_sentences_whole():
+    chunks = list(chunk_words(_sentences(10), max_words=12, overlap_words=0))
+    assert all(len(_words(c)) <= 12 for c in chunks)
+    # 5-word sentences, 12-word chunks: two whole sentences per chunk
+    assert chunks[0] == " ".join(_sentences(2))
+    # Without overlap every word appears exactly once, in order
+    assert [w for c in chunks for w in _words(c)] == [w for s in _sentences(10) for w in s.split()]
+
+
+def test_chunks_repeat_the_previous_trailing_sentences():
+    chunks = list(chunk_words(_sentences(10), max_words=15, overlap_words=6))
+    for previous, chunk in zip(chunks, chunks[1:]):
+        # One whole 5-word sentence fits the 6-word overlap
+        assert _words(chunk)[:5] == _words(previous)[-5:]
+        assert len(_words(chunk)) <= 15
+    assert _words(chunks[-1])[-1] == "s9w4."
+
+
+def test_sentence_longer_than_a_chunk_is_split_on_words():
+    chunks = list(chunk_words(_sentences(1, words=25), max_words=10, overlap_words=3))
+    assert all(len(_words(c)) <= 10 for c in chunks)
+    # The overlap carries the end of the oversized sentence
+    assert _words(chunks[1])[:3] == _words(chunks[0])[-3:]
+    assert _words(chunks[-1])[-1] == "s0w24."
+
+
+def _write(path, text):
+    path.write_text(text, encoding="utf-8")
+    # Make every rewrite visible to the size/mtime check
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10_000_000))
+
+
+SLEEP = (
+    "Keep a regular sleep schedule and avoid screens before bed. "
+    "A dark and cool bedroom helps most people fall asleep faster."
+)
+HYDRATION = (
+    "Drink water regularly through the day, more during exercise and hot weather. "
+    "Pale yellow urine is a simple sign of good hydration."
+)
+STRETCHING = (
+    "Gentle stretching after sitting for long periods eases lower back stiffness. "
+    "Stand up and move for a few minutes every hour."
+)
+
+
+def _chunks(index_dir):
+    version = kb_artifacts.current_version(index_dir)
+    return version, list(kb_artifacts.iter_chunks(index_dir, version))
+
+
+def test_exact_duplicates_are_dropped(tmp_path):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    _write(docs / "sleep.txt", SLEEP)
+    _write(docs / "sleep_copy.txt", SLEEP)
+    _write(docs / "hydration.txt", HYDRATION)
+
+    summary = ingest([str(docs)], str(tmp_path / "index"))
+    assert summary["duplicates_dropped"] == 1
+
+    _, chunks = _chunks(str(tmp_path / "index"))
+    assert [c["content"] for c in chunks].count(SLEEP) == 1
+    assert len(chunks) == 2
+
+
+def test_reingest_reuses_unchanged_sources(tmp_path):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    index_dir = str(tmp_path / "index")
+    _write(docs / "sleep.txt", SLEEP)
+    _write(docs / "hydration.txt", HYDRATION)
+    ingest([str(docs)], index_dir)
+    old_version, old_chunks = _chunks(index_dir)
+    old_vectors = np.array(kb_artifacts.open_vectors(index_dir, old_version))
+
+    assert ingest([str(docs)], index_dir)["status"] == "up to date"
+
+    _write(docs / "hydration.txt", STRETCHING)
+    summary = ingest([str(docs)], index_dir)
+    assert summary["reused_sources"] == 1
+    assert summary["ingested_sources"] == 1
+
+    version, chunks = _chunks(index_dir)
+    assert version != old_version
+    assert {c["content"] for c in chunks} == {SLEEP, STRETCHING}
+    # The unchanged source's chunk and vector were copied, not rebuilt
+    vectors = kb_artifacts.open_vectors(index_dir, version)
+    old_row = next(i for i, c in enumerate(old_chunks) if c["content"] == SLEEP)
+    row = next(i for i, c in enumerate(chunks) if c["content"] == SLEEP)
+    assert chunks[row] == old_chunks[old_row]
+    assert np.array_equal(vectors[row], old_vectors[old_row])
+
+
+def test_removing_a_source_restores_its_duplicates_elsewhere(tmp_path):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    index_dir = str(tmp_path / "index")
+    _write(docs / "a_sleep.txt", SLEEP)
+    _write(docs / "b_sleep.txt", SLEEP)
+    ingest([str(docs)], index_dir)
+    _, chunks = _chunks(index_dir)
+    assert [c["source"] for c in chunks] == ["docs/a_sleep.txt"]
+
+    os.remove(docs / "a_sleep.txt")
+    ingest([str(docs)], index_dir)
+    _, chunks = _chunks(index_dir)
+    assert [(c["source"], c["content"]) for c in chunks] == [("docs/b_sleep.txt", SLEEP)]
@@ -0,0 +1,121 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from healthbackend.services import api_key_pool
+from healthbackend.services.key_pool_backends import SQLiteKeyPoolBackend
+from healthbackend.utils.processes import worker_id
+
+
+@pytest.fixture
+def backend(tmp_path):
+    return SQLiteKeyPoolBackend(
+        str(tmp_path / "key_pool.sqlite3"), ["key-aaaa", "key-bbbb"], api_key_pool._new_key_state
+    )
+
+
+def _reserve(state):
+    state["key-aaaa"]["in_flight"] += 1
+
+
+def _in_flight(backend):
+    return backend.transact(lambda state: state["key-aaaa"]["in_flight"])
+
+
+def _leave_reservation(backend, worker, pid, seen_at):
+    conn = backend._connect()
+    conn.execute(
+        "INSERT INTO key_reservations (key, worker, count) VALUES ('key-aaaa', ?, 2)", (worker,)
+    )
+    conn.execute(
+        "INSERT INTO key_pool_workers (worker, pid, seen_at) VALUES (?, ?, ?)",
+        (worker, pid, seen_at),
+    )
+    backend._last_reap = 0.0
+
+
+def test_reservations_are_counted_across_transactions(backend):
+    backend.transact(_reserve)
+    backend.transact(_reserve)
+    assert _in_flight(backend) == 2
+
+    backend.transact(lambda state: state["key-aaaa"].update(in_flight=0.0))
+    assert _in_flight(backend) == 0
+
+
+def test_reservations_of_a_dead_pid_are_dropped(backend):
+    _leave_reservation(backend, "crashed-worker", pid=2 ** 22 + 1, seen_at=time.time())
+    assert _in_flight(backend) == 0
+
+
+def test_reused_pid_does_not_keep_a_dead_workers_reservations(backend):
+    # A previous container's worker had our pid; its lease has run out
+    stale = time.time() - backend.LEASE_SECONDS - 1
+    _leave_reservation(backend, "previous-container-worker", pid=os.getpid(), seen_at=stale)
+    assert _in_flight(backend) == 0
+
+
+def test_live_workers_keep_their_reservations(backend):
+    _leave_reservation(backend, "other-live-worker", pid=os.getpid(), seen_at=time.time())
+    backend.transact(_reserve)
+    assert _in_flight(backend) == 3
+    rows = backend._connect().execute("SELECT worker FROM key_reservations").fetchall()
+    assert {worker for (worker,) in rows} == {"other-live-worker", worker_id()}
+
+
+def test_async_acquire_runs_sqlite_transactions_off_the_event_loop(backend, monkeypatch):
+    threads = []
+    transact = backend.transact
+
+    def recording_transact(fn):
+        threads.append(threading.current_thread())
+        return transact(fn)
+
+    monkeypatch.setattr(backend, "transact", recording_transact)
+    monkeypatch.setattr(api_key_pool, "_backend", backend)
+
+    async def acquire():
+        key = await api_key_pool.aacquire_key(10)
+        await api_key_pool.offload(api_key_pool.release_key, key, 10)
+        return threading.current_thread()
+
+    loop_thread = asyncio.run(acquire())
+    assert len(threads) == 2
+    assert loop_thread not in threads
+
+
+def test_cancelled_async_acquire_does_not_leak_the_key(backend, monkeypatch):
+    monkeypatch.setattr(api_key_pool, "_backend", backend)
+    full = _state(backend)
+    # Another worker holds the write lock while our reservation is pending
+    blocker = sqlite3.connect(backend.path, timeout=10.0, isolation_level=None)
+    blocker.execute("BEGIN IMMEDIATE")
+
+    async def main():
+        acquire = asyncio.create_task(api_key_pool.aacquire_key(1000))
+        await asyncio.sleep(0.2)
+        acquire.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await acquire
+        # The reservation commits now, after its caller is gone
+        blocker.execute("COMMIT")
+        await asyncio.sleep(0.2)
+        for _ in range(200):
+            if _in_flight(backend) == 0 and _state(backend)["tokens"] == full["tokens"]:
+                break
+            await asyncio.sleep(0.01)
+
+    asyncio.run(main())
+    state = _state(backend)
+    assert state["in_flight"] == 0
+    assert state["tokens"] == pytest.approx(full["tokens"])
+    assert state["requests"] == pytest.approx(full["requests"])
+    assert state["calls"] == 0
+
+
+def _state(backend):
+    return backend.transact(lambda state: dict(state["key-aaaa"]))
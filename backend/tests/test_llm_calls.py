@@ -0,0 +1,115 @@
+import asyncio
+
+import httpx
+import openai
+import pytest
+
+from healthbackend.services import llm_calls
+
+
+def _rate_limit_error():
+    response = httpx.Response(429, request=httpx.Request("POST", "http://llm.test/v1/chat"))
+    return openai.RateLimitError("rate limited", response=response, body=None)
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    """Two fake keys; records which keys were put on cooldown."""
+    state = {"rate_limited": [], "quota": []}
+
+    async def aacquire_key(estimate, timeout=None):
+        return "key-primary"
+
+    async def atry_acquire_key(estimate, exclude=()):
+        return "key-hedge"
+
+    monkeypatch.setattr(llm_calls, "aacquire_key", aacquire_key)
+    monkeypatch.setattr(llm_calls, "atry_acquire_key", atry_acquire_key)
+    monkeypatch.setattr(
+        llm_calls, "mark_key_rate_limited", lambda key, retry_after=None: state["rate_limited"].append(key)
+    )
+    monkeypatch.setattr(llm_calls, "mark_key_quota_exceeded", lambda key: state["quota"].append(key))
+    monkeypatch.setattr(llm_calls, "_hedge_delay", lambda label: 0.01)
+    return state
+
+
+def _invoke(behaviour):
+    async def invoke_once(messages, key, estimate, temperature, max_tokens, label):
+        delay, error = behaviour[key]
+        await asyncio.sleep(delay)
+        if error is not None:
+            raise llm_calls._AttemptError(key, error)
+        return f"reply from {key}"
+
+    return invoke_once
+
+
+def test_failed_primary_is_put_on_cooldown_when_the_hedge_succeeds(pool, monkeypatch):
+    monkeypatch.setattr(
+        llm_calls,
+        "_invoke_once",
+        _invoke({"key-primary": (0.05, _rate_limit_error()), "key-hedge": (0.1, None)}),
+    )
+    reply = asyncio.run(llm_calls._hedged_invoke([], "test", 0.0, None, float("inf")))
+
+    assert reply == "reply from key-hedge"
+    assert pool["rate_limited"] == ["key-primary"]
+
+
+def test_every_failed_copy_is_accounted_and_the_first_is_raised(pool, monkeypatch):
+    monkeypatch.setattr(
+        llm_calls,
+        "_invoke_once",
+        _invoke({"key-primary": (0.1, _rate_limit_error()), "key-hedge": (0.05, _rate_limit_error())}),
+    )
+    with pytest.raises(llm_calls._AttemptError) as raised:
+        asyncio.run(llm_calls._hedged_invoke([], "test", 0.0, None, float("inf")))
+
+    assert raised.value.key == "key-hedge"
+    assert raised.value.kind == llm_calls.RATE_LIMIT
+    assert sorted(pool["rate_limited"]) == ["key-hedge", "key-primary"]
+
+
+def test_retry_loop_does_not_account_a_failure_twice(pool, monkeypatch):
+    monkeypatch.setattr(llm_calls, "_hedge_delay", lambda label: None)
+    monkeypatch.setattr(llm_calls, "LLM_MAX_ATTEMPTS", 1)
+    monkeypatch.setattr(
+        llm_calls, "_invoke_once", _invoke({"key-primary": (0.0, _rate_limit_error())})
+    )
+    with pytest.raises(openai.RateLimitError):
+        asyncio.run(llm_calls._call_with_retries([], "test", 0.0, None))
+
+    assert pool["rate_limited"] == ["key-primary"]
+
+
+def test_classify_error():
+    assert llm_calls.classify_error(_rate_limit_error()) == llm_calls.RATE_LIMIT
+    assert llm_calls.classify_error(asyncio.TimeoutError()) == llm_calls.TRANSIENT
+    assert llm_calls.classify_error(ValueError("bad")) == llm_calls.FATAL
+
+
+class _StreamingModel:
+    def __init__(self):
+        self.closed = False
+
+    async def astream(self, messages):
+        try:
+            for text in ("one ", "two ", "three"):
+                yield type("Chunk", (), {"content": text})()
+                await asyncio.sleep(0)
+        finally:
+            self.closed = True
+
+
+def test_abandoned_stream_closes_the_llm_response(pool, monkeypatch):
+    model = _StreamingModel()
+    monkeypatch.setattr(llm_calls, "get_chat_model", lambda key, **kwargs: model)
+
+    async def main():
+        stream = llm_calls.stream_llm([], "test")
+        assert await stream.__anext__() == "one "
+        await stream.aclose()
+        # Closed right away, not when the loop shuts down its generators
+        assert model.closed
+
+    asyncio.run(main())
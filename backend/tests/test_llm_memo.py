@@ -0,0 +1,86 @@
+import threading
+
+import pytest
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from healthbackend.services import llm_memo
+
+MODEL = "test-model"
+PARAMS = {"temperature": 0.0, "max_tokens": 100}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000.0
+
+    def time(self):
+        self.now += 1.0
+        return self.now
+
+
+@pytest.fixture(autouse=True)
+def memo(monkeypatch, tmp_path):
+    """A fresh memo file per test, with a clock that always moves forward."""
+    monkeypatch.setattr(llm_memo, "LLM_MEMO_PATH", str(tmp_path / "memo.sqlite3"))
+    monkeypatch.setattr(llm_memo, "LLM_MEMO_ENABLED", True)
+    monkeypatch.setattr(llm_memo, "_local", threading.local())
+    monkeypatch.setattr(llm_memo, "time", FakeClock())
+
+
+def _messages(question):
+    return [SystemMessage(content="You are a wellness assistant."), HumanMessage(content=question)]
+
+
+def test_store_then_lookup_round_trip():
+    messages = _messages("What helps a headache?")
+    assert llm_memo.lookup(messages, MODEL, PARAMS) is None
+    llm_memo.store(messages, MODEL, PARAMS, "Rest and water.")
+    assert llm_memo.lookup(_messages("What helps a headache?"), MODEL, PARAMS) == "Rest and water."
+
+
+def test_key_covers_model_params_and_roles():
+    messages = _messages("What helps a headache?")
+    llm_memo.store(messages, MODEL, PARAMS, "Rest and water.")
+    assert llm_memo.lookup(messages, "other-model", PARAMS) is None
+    assert llm_memo.lookup(messages, MODEL, {**PARAMS, "max_tokens": 200}) is None
+    swapped = [HumanMessage(content=m.content) for m in messages]
+    assert llm_memo.lookup(swapped, MODEL, PARAMS) is None
+
+
+def test_sampled_calls_are_not_memoized():
+    messages = _messages("Give me a motivating quote")
+    params = {**PARAMS, "temperature": 0.7}
+    llm_memo.store(messages, MODEL, params, "Keep going!")
+    assert llm_memo.lookup(messages, MODEL, params) is None
+
+
+def test_disabled_memo_neither_stores_nor_answers(monkeypatch):
+    messages = _messages("What helps a headache?")
+    llm_memo.store(messages, MODEL, PARAMS, "Rest and water.")
+    monkeypatch.setattr(llm_memo, "LLM_MEMO_ENABLED", False)
+    assert llm_memo.lookup(messages, MODEL, PARAMS) is None
+    llm_memo.store(_messages("Anything else?"), MODEL, PARAMS, "Sleep.")
+
+    monkeypatch.setattr(llm_memo, "LLM_MEMO_ENABLED", True)
+    assert llm_memo.lookup(_messages("Anything else?"), MODEL, PARAMS) is None
+
+
+def test_least_recently_used_rows_are_evicted_over_the_size_budget(monkeypatch):
+    monkeypatch.setattr(llm_memo, "LLM_MEMO_MAX_BYTES", 25)
+    for name in ("first", "second"):
+        llm_memo.store(_messages(name), MODEL, PARAMS, "x" * 10)
+    # Reading "first" makes "second" the least recently used
+    assert llm_memo.lookup(_messages("first"), MODEL, PARAMS) is not None
+    llm_memo.store(_messages("third"), MODEL, PARAMS, "x" * 10)
+
+    assert llm_memo.lookup(_messages("second"), MODEL, PARAMS) is None
+    assert llm_memo.lookup(_messages("first"), MODEL, PARAMS) is not None
+    assert llm_memo.lookup(_messages("third"), MODEL, PARAMS) is not None
+
+
+def test_forked_worker_opens_its_own_connection():
+    parent = llm_memo._connect()
+    assert llm_memo._connect() is parent
+    # As seen by a child process: the cached connection belongs to another pid
+    llm_memo._local.pid = -1
+    assert llm_memo._connect() is not parent
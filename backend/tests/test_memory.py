@@ -0,0 +1,70 @@
+from langchain.schema import AIMessage, HumanMessage, SystemMessage
+
+from healthbackend.services import memory as memory_module
+from healthbackend.services.memory import SessionMemory, estimate_tokens
+
+
+def _memory(turns=8):
+    memory = SessionMemory()
+    for i in range(turns):
+        memory.save_context(
+            {"input": f"[Agent{i}] notes"},
+            {"output": f"## Note {i}\nFirst point of agent {i}. Second point. " + "Detail. " * 40},
+        )
+    return memory
+
+
+def _tokens(messages):
+    return sum(estimate_tokens(m.content) for m in messages)
+
+
+def test_history_fits_the_token_budget():
+    memory = _memory()
+    for budget in (60, 150, 300, 600):
+        assert _tokens(memory.chat_history(budget)) <= budget
+
+
+def test_newest_turns_are_kept_verbatim():
+    memory = _memory()
+    messages = memory.chat_history(300)
+    recent = [m for m in messages if not isinstance(m, SystemMessage)]
+    assert recent
+    # The tail is the newest turns, in order, exactly as stored
+    full = memory.chat_history()
+    assert [m.content for m in recent] == [m.content for m in full[-len(recent):]]
+    assert isinstance(recent[0], HumanMessage) and isinstance(recent[-1], AIMessage)
+
+
+def test_older_turns_are_folded_into_a_summary():
+    memory = _memory()
+    messages = memory.chat_history(300)
+    summary = messages[0]
+    assert isinstance(summary, SystemMessage)
+    assert summary.content.startswith("Summary of earlier agent notes:")
+    # One line per folded turn, newest of them last: tag plus leading sentences
+    kept = (len(messages) - 1) // 2
+    newest_folded = 8 - kept - 1
+    assert f"[Agent{newest_folded}] Note {newest_folded} First point" in summary.content
+    assert "##" not in summary.content
+    assert "Detail. Detail." not in summary.content
+
+
+def test_summary_sentence_count_is_configurable(monkeypatch):
+    monkeypatch.setattr(memory_module, "MEMORY_SUMMARY_SENTENCES", 1)
+    memory = SessionMemory()
+    memory.save_context({"input": "[Diet] plan"}, {"output": "Eat greens. Drink water. Sleep."})
+    assert memory._turns[0]["summary"] == "[Diet] Eat greens."
+
+
+def test_everything_fits_or_no_budget_returns_the_full_history():
+    memory = _memory(turns=2)
+    assert len(memory.chat_history()) == 4
+    assert len(memory.chat_history(10_000)) == 4
+    assert not any(isinstance(m, SystemMessage) for m in memory.chat_history(10_000))
+
+
+def test_long_inputs_are_truncated():
+    memory = SessionMemory(max_input_chars=20)
+    memory.save_context({"input": "[Symptom] " + "x" * 100}, {"output": "ok"})
+    label = memory.chat_history()[0].content
+    assert len(label) <= 21 and label.endswith("…")
@@ -0,0 +1,112 @@
+import pytest
+
+from healthbackend.services import admission, metrics
+from healthbackend.utils.exceptions import OverloadError
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    """An empty registry; module-level metrics and collectors are restored after."""
+    monkeypatch.setattr(metrics, "_metrics", {})
+    monkeypatch.setattr(metrics, "_collectors", [])
+
+
+def test_counter_renders_help_type_and_labelled_samples(registry):
+    requests = metrics.counter("test_requests_total", "Requests served", ("route", "status"))
+    assert metrics.counter("test_requests_total", "Requests served", ("route", "status")) is requests
+    requests.inc(route="/b", status="200")
+    requests.inc(2, route="/a", status="500")
+    requests.inc(0.5, route="/a", status="500")
+
+    assert metrics.render().splitlines() == [
+        "# HELP healthbackend_test_requests_total Requests served",
+        "# TYPE healthbackend_test_requests_total counter",
+        'healthbackend_test_requests_total{route="/a",status="500"} 2.5',
+        'healthbackend_test_requests_total{route="/b",status="200"} 1',
+    ]
+
+
+def test_histogram_buckets_are_cumulative_with_inf_sum_and_count(registry):
+    latency = metrics.histogram("test_latency_seconds", "Latency", ("route",), buckets=(1, 0.1))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        latency.observe(value, route="/x")
+
+    assert metrics.render().splitlines() == [
+        "# HELP healthbackend_test_latency_seconds Latency",
+        "# TYPE healthbackend_test_latency_seconds histogram",
+        'healthbackend_test_latency_seconds_bucket{route="/x",le="0.1"} 2',
+        'healthbackend_test_latency_seconds_bucket{route="/x",le="1"} 3',
+        'healthbackend_test_latency_seconds_bucket{route="/x",le="+Inf"} 4',
+        'healthbackend_test_latency_seconds_sum{route="/x"} 3.65',
+        'healthbackend_test_latency_seconds_count{route="/x"} 4',
+    ]
+
+
+def test_unlabelled_histogram_has_only_le_labels(registry):
+    metrics.histogram("test_size", "Size", buckets=(10,)).observe(12)
+    lines = metrics.render().splitlines()
+    assert 'healthbackend_test_size_bucket{le="10"} 0' in lines
+    assert 'healthbackend_test_size_bucket{le="+Inf"} 1' in lines
+    assert "healthbackend_test_size_sum 12" in lines
+    assert "healthbackend_test_size_count 1" in lines
+
+
+def test_label_values_are_escaped(registry):
+    metrics.counter("test_errors_total", "Errors", ("message",)).inc(message='bad "quote" \\ and\nnewline')
+    assert (
+        'healthbackend_test_errors_total{message="bad \\"quote\\" \\\\ and\\nnewline"} 1'
+        in metrics.render().splitlines()
+    )
+
+
+def test_span_records_outcome(registry):
+    with metrics.span("test_step", stage="a"):
+        pass
+    with pytest.raises(ValueError):
+        with metrics.span("test_step", stage="a"):
+            raise ValueError
+    lines = metrics.render().splitlines()
+    assert 'healthbackend_test_step_seconds_count{stage="a",outcome="ok"} 1' in lines
+    assert 'healthbackend_test_step_seconds_count{stage="a",outcome="error"} 1' in lines
+
+
+def test_collectors_render_at_scrape_time_and_failures_are_skipped(registry):
+    depth = [3]
+
+    def broken():
+        raise RuntimeError("boom")
+
+    metrics.register_collector(broken)
+    metrics.register_collector(
+        lambda: [("test_queue_depth", "gauge", "Queued jobs", [({"queue": 'a"b'}, depth[0])])]
+    )
+    assert metrics.render().splitlines() == [
+        "# HELP healthbackend_test_queue_depth Queued jobs",
+        "# TYPE healthbackend_test_queue_depth gauge",
+        'healthbackend_test_queue_depth{queue="a\\"b"} 3',
+    ]
+    depth[0] = 0
+    assert 'healthbackend_test_queue_depth{queue="a\\"b"} 0' in metrics.render().splitlines()
+
+
+def test_admission_collector_reports_slots_and_rejections(monkeypatch, registry):
+    controller = admission.AdmissionController(max_concurrent=1, max_queue=0, queue_timeout=1.0)
+    monkeypatch.setattr(admission, "admission", controller)
+    metrics.register_collector(admission._collect_metrics)
+
+    ticket = controller.acquire()
+    with pytest.raises(OverloadError):
+        controller.acquire()
+    lines = metrics.render().splitlines()
+    assert "# TYPE healthbackend_admission_in_flight gauge" in lines
+    assert "healthbackend_admission_in_flight 1" in lines
+    assert "healthbackend_admission_queue_depth 0" in lines
+    assert "# TYPE healthbackend_admission_rejected_total counter" in lines
+    assert 'healthbackend_admission_rejected_total{reason="queue_full"} 1' in lines
+    assert 'healthbackend_admission_rejected_total{reason="timeout"} 0' in lines
+
+    ticket.release()
+    assert "healthbackend_admission_in_flight 0" in metrics.render().splitlines()
+    # Disabled admission reports nothing
+    monkeypatch.setattr(admission, "admission", None)
+    assert "admission" not in metrics.render()
@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+
+from healthbackend.services import orchestrator
+from healthbackend.utils.exceptions import InputError
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    """Fake agent pipeline and intent check; counts pipeline runs."""
+    runs = []
+
+    async def run_pipeline(symptoms, medical_report, memory, on_agent_done=None):
+        runs.append(symptoms)
+        await asyncio.sleep(0.05)
+        return {"agent_flow": [{"agent": "Fake", "output": "ok"}]}, False
+
+    async def off_topic(symptoms):
+        await asyncio.sleep(0.01)
+        return False
+
+    monkeypatch.setattr(orchestrator, "_run_pipeline", run_pipeline)
+    monkeypatch.setattr(orchestrator, "ais_health_query", off_topic)
+    monkeypatch.setattr(orchestrator, "save_history", lambda user_id, output: None)
+    if orchestrator.orchestration_flight is None:
+        pytest.skip("single flight disabled")
+    return runs
+
+
+def _orchestrate(**kwargs):
+    return orchestrator.orchestrate("headache and fever", None, "guest", use_cache=False, **kwargs)
+
+
+def test_identical_queries_share_one_run(pipeline):
+    async def both():
+        return await asyncio.gather(_orchestrate(), _orchestrate())
+
+    first, second = asyncio.run(both())
+    assert len(pipeline) == 1
+    assert first["session_id"] != second["session_id"]
+
+
+def test_intent_checked_run_is_not_shared_with_an_unchecked_one(pipeline):
+    async def both():
+        return await asyncio.gather(
+            _orchestrate(check_intent=True), _orchestrate(), return_exceptions=True
+        )
+
+    checked, unchecked = asyncio.run(both())
+    # The unchecked caller neither joins the checked run nor gets its InputError
+    assert isinstance(checked, InputError)
+    assert isinstance(unchecked, dict)
+    assert len(pipeline) == 2
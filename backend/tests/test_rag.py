@@ -0,0 +1,92 @@
+import json
+import os
+
+from healthbackend.services import kb_artifacts, rag
+from healthbackend.services.rag import KBDocument
+from healthbackend.tools import kb_ingest
+
+
+def test_load_dense_only_removes_its_own_stale_files(monkeypatch, tmp_path):
+    monkeypatch.setattr(rag, "RAG_VECTOR_DIR", str(tmp_path))
+    old = "0123456789abcdef"
+    ours = [f"{old}-256.npy", f"{old}-256.npy.4242.tmp", f"{old}-256-ivf-auto"]
+    foreign = ["README.md", "embeddings.npy", "backup", f"{old}-notes.txt"]
+    for name in ours + foreign:
+        path = tmp_path / name
+        if name in ("backup", f"{old}-256-ivf-auto"):
+            path.mkdir()
+        else:
+            path.write_text("x")
+
+    digest = "fedcba9876543210" + "0" * 48
+    documents = (KBDocument("Insomnia", "trouble sleeping at night"), KBDocument("Cough", "dry cough"))
+    dense = rag._load_dense(documents, digest)
+
+    assert dense is not None
+    remaining = set(os.listdir(tmp_path))
+    assert remaining.isdisjoint(ours)
+    assert set(foreign) <= remaining
+    assert f"{digest[:16]}-{rag.RAG_EMBED_DIM}.npy" in remaining
+
+
+def _contents(snapshot, query):
+    return [snapshot.documents[doc_id].content for doc_id, _ in rag.search(snapshot, query, 3)]
+
+
+def _bump_mtime(path):
+    # As a later write would: never rely on the clock ticking between writes
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10_000_000))
+
+
+def test_json_edit_swaps_in_a_new_snapshot(tmp_path):
+    path = tmp_path / "knowledge.json"
+    path.write_text(json.dumps([{"title": "Sleep", "content": "Keep a regular sleep schedule."}]))
+    index = rag.KnowledgeIndex(str(path), reload_interval=0)
+    old = index.snapshot()
+    assert _contents(old, "sleep schedule") == ["Keep a regular sleep schedule."]
+
+    path.write_text(json.dumps([{"title": "Sleep", "content": "Avoid caffeine late in the day for better sleep."}]))
+    _bump_mtime(path)
+    new = index.snapshot()
+    assert new is not old
+    assert _contents(new, "sleep caffeine") == ["Avoid caffeine late in the day for better sleep."]
+    # A reader still holding the old snapshot keeps a complete, unchanged view
+    assert _contents(old, "sleep schedule") == ["Keep a regular sleep schedule."]
+
+
+def test_reload_waits_for_the_check_interval(tmp_path):
+    path = tmp_path / "knowledge.json"
+    path.write_text(json.dumps([{"title": "A", "content": "first version"}]))
+    index = rag.KnowledgeIndex(str(path), reload_interval=3600)
+    old = index.snapshot()
+    path.write_text(json.dumps([{"title": "A", "content": "second version"}]))
+    _bump_mtime(path)
+    assert index.snapshot() is old
+
+
+def test_republished_artifacts_are_picked_up_by_the_next_query(monkeypatch, tmp_path):
+    monkeypatch.setattr(rag, "RAG_MODE", "hybrid")
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    index_dir = str(tmp_path / "index")
+    (docs / "sleep.txt").write_text("Keep a regular sleep schedule and a dark bedroom.")
+    kb_ingest.ingest([str(docs)], index_dir, keep=1)
+
+    index = rag.KnowledgeIndex(
+        os.path.join(index_dir, kb_artifacts.CURRENT_FILE), reload_interval=0, loader=rag._load_prebuilt
+    )
+    old = index.snapshot()
+    assert old.dense is not None
+    assert _contents(old, "sleep bedroom") == ["Keep a regular sleep schedule and a dark bedroom."]
+
+    (docs / "hydration.txt").write_text("Drink water through the day, more when exercising.")
+    kb_ingest.ingest([str(docs)], index_dir, keep=1)
+    _bump_mtime(os.path.join(index_dir, kb_artifacts.CURRENT_FILE))
+
+    new = index.snapshot()
+    assert len(new.documents) == 2
+    assert "Drink water through the day, more when exercising." in _contents(new, "drink water")
+    # The old version's files were pruned; its mapped vectors stay readable
+    assert len(old.documents) == 1
+    assert _contents(old, "sleep bedroom") == ["Keep a regular sleep schedule and a dark bedroom."]
@@ -0,0 +1,84 @@
+import time
+
+from healthbackend.services.result_cache import ResultCache, normalize_symptoms, same_meaning
+
+QUERY = "fever, headache cough sore throat and body ache for three days"
+PLAN = {"diet_plan": "soups"}
+
+
+def test_normalize_is_order_and_filler_insensitive():
+    assert normalize_symptoms("I have fever and headaches") == normalize_symptoms(
+        "headache with fever"
+    )
+
+
+def test_negation_is_bound_to_its_word():
+    assert normalize_symptoms("no fever, headache") == "headache no:fever"
+    assert normalize_symptoms("no fever, headache") != normalize_symptoms("fever, no headache")
+    assert normalize_symptoms("I don’t have a fever") == "no:fever"
+
+
+def test_same_meaning_rejects_negation_and_numbers():
+    assert not same_meaning(normalize_symptoms("no fever"), normalize_symptoms("fever"))
+    assert not same_meaning(
+        normalize_symptoms("cough for 3 days"), normalize_symptoms("cough for 2 days")
+    )
+    assert same_meaning(normalize_symptoms("bad cough"), normalize_symptoms("cough"))
+
+
+def test_near_duplicate_hit():
+    cache = ResultCache(similarity_threshold=0.8)
+    cache.put("fever headache cough sore throat body ache", None, PLAN)
+    assert cache.get("fever headaches cough sore throat body aches please", None) == PLAN
+    assert cache.stats()["hits_near"] + cache.stats()["hits_exact"] == 1
+
+
+def test_negated_query_is_not_a_near_duplicate():
+    cache = ResultCache(similarity_threshold=0.8)
+    cache.put(QUERY, None, PLAN)
+    assert cache.get("no " + QUERY, None) is None
+
+    cache.put("i am pregnant with headache and nausea", None, PLAN)
+    assert cache.get("i am not pregnant with headache and nausea", None) is None
+
+
+def test_different_quantity_is_not_a_near_duplicate():
+    cache = ResultCache(similarity_threshold=0.8)
+    cache.put(QUERY, None, PLAN)
+    assert cache.get(QUERY.replace("three", "ten"), None) is None
+
+
+def test_report_hash_separates_entries():
+    cache = ResultCache()
+    cache.put("fever", "report A", PLAN)
+    assert cache.get("fever", "report B") is None
+    assert cache.get("fever", "REPORT  a") == PLAN
+
+
+def test_results_are_copied():
+    cache = ResultCache()
+    cache.put("fever", None, {"items": [1]})
+    cache.get("fever", None)["items"].append(2)
+    assert cache.get("fever", None) == {"items": [1]}
+
+
+def test_entries_expire_in_order():
+    cache = ResultCache(ttl_seconds=0.05)
+    cache.put("fever", None, PLAN)
+    time.sleep(0.06)
+    cache.put("cough", None, PLAN)
+    assert cache.get("fever", None) is None
+    assert cache.get("cough", None) == PLAN
+    assert cache.stats()["expirations"] == 1
+    assert cache.stats()["size"] == 1
+
+
+def test_lru_eviction():
+    cache = ResultCache(max_entries=2, similarity_threshold=1.0)
+    cache.put("fever", None, PLAN)
+    cache.put("cough", None, PLAN)
+    cache.get("fever", None)
+    cache.put("rash", None, PLAN)
+    assert cache.get("cough", None) is None
+    assert cache.get("fever", None) == PLAN
+    assert cache.stats()["evictions"] == 1
@@ -0,0 +1,88 @@
+import asyncio
+import sqlite3
+import time
+
+import pytest
+from langchain_core.messages import HumanMessage
+
+from healthbackend.services import api_key_pool, llm_calls, orchestrator
+from healthbackend.services.key_pool_backends import SQLiteKeyPoolBackend
+from healthbackend.utils.exceptions import InputError
+
+
+class _HangingModel:
+    async def ainvoke(self, messages):
+        await asyncio.sleep(60)
+
+
+@pytest.fixture
+def backend(monkeypatch, tmp_path):
+    backend = SQLiteKeyPoolBackend(
+        str(tmp_path / "key_pool.sqlite3"), ["key-aaaa", "key-bbbb"], api_key_pool._new_key_state
+    )
+    monkeypatch.setattr(api_key_pool, "_backend", backend)
+    monkeypatch.setattr(llm_calls, "get_chat_model", lambda key, **kwargs: _HangingModel())
+    return backend
+
+
+@pytest.fixture
+def off_topic(monkeypatch):
+    async def ais_health_query(symptoms):
+        await asyncio.sleep(0.2)
+        return False
+
+    monkeypatch.setattr(orchestrator, "ais_health_query", ais_health_query)
+
+
+def _agent_call():
+    return llm_calls._hedged_invoke(
+        [HumanMessage(content="hello")], "test", 0.0, 100, time.monotonic() + 30
+    )
+
+
+def _pool(backend):
+    return backend.transact(lambda state: {k: dict(s) for k, s in state.items()})
+
+
+def _speculate(pipeline):
+    async def main():
+        with pytest.raises(InputError):
+            await orchestrator._speculate("what is the capital of France", pipeline(), "s-1")
+        # A reservation still in its thread commits and is handed back on this loop
+        await asyncio.sleep(0.5)
+
+    asyncio.run(main())
+
+
+def test_cancelled_agent_call_releases_its_key(backend, off_topic):
+    async def pipeline():
+        await asyncio.gather(_agent_call(), _agent_call())
+
+    _speculate(pipeline)
+
+    pool = _pool(backend)
+    assert all(s["in_flight"] == 0 for s in pool.values())
+    # Both calls were sent, so their estimate stays charged; no key is on cooldown
+    assert sum(s["calls"] for s in pool.values()) == 2
+    assert all(s["cooldown_until"] == 0 for s in pool.values())
+
+
+def test_agent_cancelled_while_reserving_a_key_leaves_the_pool_untouched(backend, off_topic):
+    before = _pool(backend)
+    # Another worker holds the key-pool lock, so the agent is still reserving
+    blocker = sqlite3.connect(backend.path, timeout=10.0, isolation_level=None)
+    blocker.execute("BEGIN IMMEDIATE")
+
+    async def pipeline():
+        try:
+            await _agent_call()
+        finally:
+            blocker.execute("COMMIT")
+
+    _speculate(pipeline)
+
+    pool = _pool(backend)
+    for key, s in pool.items():
+        assert s["in_flight"] == 0
+        assert s["tokens"] == pytest.approx(before[key]["tokens"], abs=1)
+        assert s["requests"] == pytest.approx(before[key]["requests"], abs=0.1)
@@ -0,0 +1,132 @@
+"""
+Recall / latency benchmark for the IVF ANN index against exact search.
+
+For each nprobe, reports recall@k (overlap of the IVF top k with the exact
+top k), mean and p95 query latency and the speed-up over the exact scan.
+Vectors come from a prebuilt knowledge base index (--index-dir) or are
+synthetic: unit vectors drawn around random topic centres, queried with
+noisy copies of stored vectors.
+
+    python -m healthbackend.tools.ann_bench --n 100000 --dim 256 --k 10
+    python -m healthbackend.tools.ann_bench --index-dir kb_index --nprobe 1,4,16
+"""
+import argparse
+import json
+import sys
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+
+from healthbackend.services import kb_artifacts
+from healthbackend.services.ann_index import IVFIndex
+from healthbackend.services.embeddings import DenseIndex
+
+
+def synthetic_vectors(n: int, dim: int, topics: int, spread: float, rng) -> np.ndarray:
+    centres = rng.standard_normal((topics, dim)).astype(np.float32)
+    vectors = centres[rng.integers(0, topics, n)] + spread * rng.standard_normal((n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def make_queries(vectors: np.ndarray, count: int, noise: float, rng) -> np.ndarray:
+    base = np.asarray(vectors[rng.choice(len(vectors), count, replace=False)])
+    queries = base + noise * rng.standard_normal(base.shape).astype(np.float32) / np.sqrt(base.shape[1])
+    return (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(np.float32)
+
+
+def _timed_search(index, queries: np.ndarray, k: int, **kwargs) -> Dict[str, Any]:
+    results, latencies = [], []
+    for query in queries:
+        started = time.perf_counter()
+        results.append({doc_id for doc_id, _ in index.search(query, k, -1.0, **kwargs)})
+        latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+    return {
+        "results": results,
+        "mean_ms": round(float(np.mean(latencies)), 4),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1], 4),
+    }
+
+
+def run(vectors: np.ndarray, queries: np.ndarray, k: int, nlist: int, nprobes: List[int]) -> Dict[str, Any]:
+    exact = _timed_search(DenseIndex(vectors), queries, k)
+
+    started = time.perf_counter()
+    ivf = IVFIndex.train(vectors, nlist)
+    build_seconds = time.perf_counter() - started
+
+    rows = []
+    for nprobe in nprobes:
+        approx = _timed_search(ivf, queries, k, nprobe=nprobe)
+        recall = np.mean([len(a & e) / k for a, e in zip(approx["results"], exact["results"])])
+        rows.append(
+            {
+                "nprobe": nprobe,
+                f"recall@{k}": round(float(recall), 4),
+                "mean_ms": approx["mean_ms"],
+                "p95_ms": approx["p95_ms"],
+                "speedup": round(exact["mean_ms"] / approx["mean_ms"], 2) if approx["mean_ms"] else None,
+            }
+        )
+    return {
+        "vectors": len(vectors),
+        "dim": int(vectors.shape[1]),
+        "nlist": ivf.nlist,
+        "build_seconds": round(build_seconds, 2),
+        "exact": {"mean_ms": exact["mean_ms"], "p95_ms": exact["p95_ms"]},
+        "ivf": rows,
+    }
+
+
+def print_report(report: Dict[str, Any], k: int) -> None:
+    print(
+        f"{report['vectors']} vectors x {report['dim']} dims, nlist={report['nlist']} "
+        f"(trained in {report['build_seconds']}s)"
+    )
+    print(f"exact: mean {report['exact']['mean_ms']:.3f} ms, p95 {report['exact']['p95_ms']:.3f} ms")
+    print(f"{'nprobe':>7} {'recall@' + str(k):>10} {'mean ms':>9} {'p95 ms':>9} {'speedup':>8}")
+    for row in report["ivf"]:
+        print(
+            f"{row['nprobe']:>7} {row[f'recall@{k}']:>10.3f} {row['mean_ms']:>9.3f} "
+            f"{row['p95_ms']:>9.3f} {row['speedup'] or 0:>7.1f}x"
+        )
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--index-dir", help="benchmark the live version of this kb_ingest index")
+    parser.add_argument("--n", type=int, default=100_000, help="synthetic vectors")
+    parser.add_argument("--dim", type=int, default=256, help="synthetic dimensions")
+    parser.add_argument("--topics", type=int, default=200, help="synthetic topic centres")
+    parser.add_argument("--spread", type=float, default=1.5, help="synthetic spread around a centre")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=0.5, help="query perturbation")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nlist", type=int, default=0, help="IVF lists (0 = auto)")
+    parser.add_argument("--nprobe", default="1,2,4,8,16,32", help="comma-separated values")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="write JSON results here")
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    if args.index_dir:
+        version = kb_artifacts.current_version(args.index_dir)
+        if not version:
+            parser.error(f"no published version in {args.index_dir}")
+        vectors = kb_artifacts.open_vectors(args.index_dir, version)
+    else:
+        vectors = synthetic_vectors(args.n, args.dim, args.topics, args.spread, rng)
+    queries = make_queries(vectors, min(args.queries, len(vectors)), args.noise, rng)
+    nprobes = [int(p) for p in args.nprobe.split(",") if p.strip()]
+
+    report = run(vectors, queries, args.k, args.nlist, nprobes)
+    print_report(report, args.k)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), **report}, f, indent=2)
+    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
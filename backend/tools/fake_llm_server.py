@@ -0,0 +1,447 @@
+"""
+Offline stand-in for the Groq / OpenAI chat-completions API.
+
+Serves `POST /chat/completions` (plain and `stream=true` SSE) and
+`GET /models` under any path prefix, with token usage, x-ratelimit-*
+headers, configurable latency and throughput distributions and injected
+429 / 5xx errors, so load tests and benchmarks run without network or
+quota.
+
+Run it and point the backend at it:
+    python -m healthbackend.tools.fake_llm_server --port 8089 \\
+        --ttft lognormal:0.35,0.4 --tokens-per-sec normal:250,50 --error-429 0.02
+    LLM_BASE_URL=http://127.0.0.1:8089/v1 GROQ_API_KEY=fake1,fake2 gunicorn ...
+
+Replies are chosen by the first matching rule of a script (`--script
+rules.json`, a list of {"match": regex, "reply": template, "role":
+"system"|"user"|"any"}) and otherwise by built-in defaults: JSON for the
+synthesizer prompt, "YES" for the intent check, templated advice text for
+the agents. Templates may use {question}, {model} and {words}.
+"""
+import argparse
+import json
+import logging
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("healthbackend")
+
+Distribution = Callable[[random.Random], float]
+
+_FILLER = (
+    "Rest well, drink plenty of water, eat light balanced meals, keep a regular "
+    "sleep schedule and track how your symptoms change over the next few days. "
+    "Seek medical care if anything gets worse."
+).split()
+
+
+# ------------------------------------------------------------
+# Latency / throughput distributions
+# ------------------------------------------------------------
+def parse_distribution(spec: str) -> Distribution:
+    """
+    Parse "fixed:X", "uniform:LO,HI", "normal:MU,SIGMA", "lognormal:MEDIAN,SIGMA"
+    or "exp:MEAN" into a sampler. Samples are never negative.
+    """
+    kind, _, raw = spec.partition(":")
+    try:
+        args = [float(a) for a in raw.split(",") if a.strip()]
+    except ValueError:
+        raise ValueError(f"Bad distribution {spec!r}") from None
+    kind = kind.strip().lower()
+
+    if kind == "fixed" and len(args) == 1:
+        return lambda rng: max(0.0, args[0])
+    if kind == "uniform" and len(args) == 2:
+        return lambda rng: max(0.0, rng.uniform(args[0], args[1]))
+    if kind == "normal" and len(args) == 2:
+        return lambda rng: max(0.0, rng.gauss(args[0], args[1]))
+    if kind == "lognormal" and len(args) == 2:
+        # Parameterized by the median, so "lognormal:0.4,0.5" centres on 0.4s
+        return lambda rng: rng.lognormvariate(math.log(max(args[0], 1e-9)), args[1])
+    if kind == "exp" and len(args) == 1:
+        return lambda rng: rng.expovariate(1.0 / args[0]) if args[0] > 0 else 0.0
+    raise ValueError(f"Bad distribution {spec!r}")
+
+
+# ------------------------------------------------------------
+# Replies
+# ------------------------------------------------------------
+def _message_text(message: Dict[str, Any]) -> str:
+    content = message.get("content") or ""
+    if isinstance(content, list):
+        # Content parts: [{"type": "text", "text": ...}, ...]
+        return " ".join(p.get("text", "") for p in content if isinstance(p, dict))
+    return str(content)
+
+
+def count_tokens(text: str) -> int:
+    """Rough token count (about 4 characters per token), like the backend's estimate."""
+    return max(1, len(text) // 4) if text else 0
+
+
+def default_reply(messages: List[Dict[str, Any]], model: str, rng: random.Random, words: int) -> str:
+    system = next((_message_text(m) for m in messages if m.get("role") == "system"), "")
+    question = _message_text(messages[-1]) if messages else ""
+
+    if 'ONLY "YES"' in system:
+        return "YES"
+    if "JSON" in system:
+        return json.dumps(
+            {
+                "synthesized_guidance": "**Overview**\n" + " ".join(_filler(rng, words)),
+                "recommendations": [
+                    "Rest and stay hydrated",
+                    "Eat light, balanced meals",
+                    "See a doctor if symptoms worsen",
+                ],
+            }
+        )
+    excerpt = " ".join(question.split()[:12])
+    return f"Guidance for: {excerpt}. " + " ".join(_filler(rng, words))
+
+
+def _filler(rng: random.Random, words: int) -> List[str]:
+    start = rng.randrange(len(_FILLER))
+    return [_FILLER[(start + i) % len(_FILLER)] for i in range(words)]
+
+
+class Script:
+    """Ordered reply rules loaded from JSON; the first matching rule wins."""
+
+    def __init__(self, rules: List[Dict[str, Any]]):
+        self.rules = [
+            (re.compile(r["match"], re.IGNORECASE | re.DOTALL), r["reply"], r.get("role", "any"))
+            for r in rules
+        ]
+
+    @classmethod
+    def load(cls, path: str) -> "Script":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def reply(self, messages: List[Dict[str, Any]], model: str, words: int) -> Optional[str]:
+        question = _message_text(messages[-1]) if messages else ""
+        for pattern, template, role in self.rules:
+            texts = [
+                _message_text(m) for m in messages if role == "any" or m.get("role") == role
+            ]
+            if any(pattern.search(t) for t in texts):
+                return template.format(
+                    question=question, model=model, words=" ".join(_FILLER[:words])
+                )
+        return None
+
+
+# ------------------------------------------------------------
+# Per-key rate limits (what x-ratelimit-* headers report)
+# ------------------------------------------------------------
+class RateLimiter:
+    """
+    Fixed one-minute windows of requests and tokens per API key.
+
+    `rpm` / `tpm` of 0 mean unlimited; headers then report the limits as
+    very large numbers so the backend's scheduler never throttles.
+    """
+
+    def __init__(self, rpm: int, tpm: int):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._lock = threading.Lock()
+        # key -> [window_start, requests, tokens]
+        self._windows: Dict[str, List[float]] = {}
+
+    def check(self, key: str, tokens: int, consume: bool = True) -> Tuple[bool, Dict[str, str]]:
+        """Count one request of `tokens` (unless `consume` is False); returns (allowed, headers)."""
+        now = time.time()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= 60.0:
+                window = self._windows[key] = [now, 0, 0]
+            rpm = self.rpm or 1_000_000
+            tpm = self.tpm or 100_000_000
+            allowed = window[1] < rpm and window[2] + tokens <= tpm
+            if allowed and consume:
+                window[1] += 1
+                window[2] += tokens
+            reset = max(0.0, 60.0 - (now - window[0]))
+            headers = {
+                "x-ratelimit-limit-requests": str(rpm),
+                "x-ratelimit-remaining-requests": str(max(0, rpm - int(window[1]))),
+                "x-ratelimit-reset-requests": f"{reset:.2f}s",
+                "x-ratelimit-limit-tokens": str(tpm),
+                "x-ratelimit-remaining-tokens": str(max(0, tpm - int(window[2]))),
+                "x-ratelimit-reset-tokens": f"{reset:.2f}s",
+            }
+            if not allowed:
+                headers["retry-after"] = str(max(1, math.ceil(reset)))
+            return allowed, headers
+
+
+# ------------------------------------------------------------
+# Server
+# ------------------------------------------------------------
+class FakeLLMConfig:
+    def __init__(
+        self,
+        ttft: str = "fixed:0.2",
+        tokens_per_sec: str = "fixed:200",
+        reply_words: int = 60,
+        error_429: float = 0.0,
+        error_5xx: float = 0.0,
+        rpm: int = 0,
+        tpm: int = 0,
+        script: Optional[Script] = None,
+        seed: Optional[int] = None,
+    ):
+        self.ttft = parse_distribution(ttft)
+        self.tokens_per_sec = parse_distribution(tokens_per_sec)
+        self.reply_words = reply_words
+        self.error_429 = error_429
+        self.error_5xx = error_5xx
+        self.limiter = RateLimiter(rpm, tpm)
+        self.script = script
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.stats_lock = threading.Lock()
+        self.stats = {"requests": 0, "streams": 0, "errors_429": 0, "errors_5xx": 0, "tokens": 0}
+
+    def sample(self, fn):
+        # random.Random is not thread-safe for reproducible sequences
+        with self.rng_lock:
+            return fn(self.rng)
+
+    def count(self, name: str, n: int = 1) -> None:
+        with self.stats_lock:
+            self.stats[name] += n
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    server_version = "FakeLLM/1.0"
+    protocol_version = "HTTP/1.1"
+    config: FakeLLMConfig  # set on the class made by make_server()
+
+    def log_message(self, format, *args):
+        logger.debug("fake-llm: " + format, *args)
+
+    # ---- helpers -------------------------------------------------------
+    def _send_json(self, status: int, body: Dict[str, Any], headers: Dict[str, str] = None):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _error(self, status: int, message: str, kind: str, headers: Dict[str, str] = None):
+        self._send_json(status, {"error": {"message": message, "type": kind, "code": kind}}, headers)
+
+    def _api_key(self) -> str:
+        auth = self.headers.get("Authorization", "")
+        return auth[7:] if auth.startswith("Bearer ") else auth
+
+    # ---- routes --------------------------------------------------------
+    def do_GET(self):
+        path = self.path.split("?", 1)[0].rstrip("/")
+        if path.endswith("/models"):
+            self._send_json(
+                200,
+                {
+                    "object": "list",
+                    "data": [{"id": "fake-llm", "object": "model", "owned_by": "local"}],
+                },
+            )
+        elif path.endswith("/stats"):
+            with self.config.stats_lock:
+                self._send_json(200, dict(self.config.stats))
+        else:
+            self._error(404, "Not found", "not_found")
+
+    def do_POST(self):
+        path = self.path.split("?", 1)[0].rstrip("/")
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return self._error(400, "Invalid JSON body", "invalid_request_error")
+        if not path.endswith("/chat/completions"):
+            return self._error(404, "Not found", "not_found")
+        self._chat_completions(body)
+
+    def _chat_completions(self, body: Dict[str, Any]):
+        cfg = self.config
+        cfg.count("requests")
+        messages = body.get("messages") or []
+        model = body.get("model") or "fake-llm"
+
+        roll = cfg.sample(lambda rng: rng.random())
+        if roll < cfg.error_5xx:
+            cfg.count("errors_5xx")
+            status = cfg.sample(lambda rng: rng.choice((500, 502, 503)))
+            return self._error(status, "Injected upstream failure", "server_error")
+
+        prompt_tokens = sum(count_tokens(_message_text(m)) for m in messages)
+        reply = None
+        if cfg.script is not None:
+            reply = cfg.script.reply(messages, model, cfg.reply_words)
+        if reply is None:
+            reply = cfg.sample(lambda rng: default_reply(messages, model, rng, cfg.reply_words))
+        words = reply.split(" ")
+        if body.get("max_tokens"):
+            words = words[: int(body["max_tokens"])]
+            reply = " ".join(words)
+        completion_tokens = count_tokens(reply)
+
+        injected_429 = roll < cfg.error_5xx + cfg.error_429
+        allowed, headers = cfg.limiter.check(
+            self._api_key(), prompt_tokens + completion_tokens, consume=not injected_429
+        )
+        if injected_429 or not allowed:
+            cfg.count("errors_429")
+            headers.setdefault("retry-after", "1")
+            return self._error(
+                429,
+                "Rate limit reached for model: tokens per minute (TPM). Please try again later.",
+                "rate_limit_exceeded",
+                headers,
+            )
+
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        ttft = cfg.sample(cfg.ttft)
+        rate = max(cfg.sample(cfg.tokens_per_sec), 1.0)
+        cfg.count("tokens", usage["total_tokens"])
+
+        if body.get("stream"):
+            cfg.count("streams")
+            include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+            return self._stream(completion_id, model, words, usage, include_usage, ttft, rate, headers)
+
+        time.sleep(ttft + completion_tokens / rate)
+        self._send_json(
+            200,
+            {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": reply},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": usage,
+            },
+            headers,
+        )
+
+    def _stream(self, completion_id, model, words, usage, include_usage, ttft, rate, headers):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        # No Content-Length: the body ends when the connection closes
+        self.send_header("Connection", "close")
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.close_connection = True
+
+        def chunk(delta, finish_reason=None, usage_block=None):
+            event = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [] if usage_block else [
+                    {"index": 0, "delta": delta, "finish_reason": finish_reason}
+                ],
+            }
+            if usage_block:
+                event["usage"] = usage_block
+            self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        try:
+            time.sleep(ttft)
+            chunk({"role": "assistant", "content": ""})
+            for i, word in enumerate(words):
+                text = word if i == len(words) - 1 else word + " "
+                time.sleep(count_tokens(text) / rate)
+                chunk({"content": text})
+            chunk({}, finish_reason="stop")
+            if include_usage:
+                chunk(None, usage_block=usage)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # Client cancelled the stream
+            pass
+
+
+def make_server(host: str, port: int, config: FakeLLMConfig) -> ThreadingHTTPServer:
+    """Build (not start) a server; port 0 picks a free port (see server_address)."""
+    handler = type("ConfiguredFakeLLMHandler", (FakeLLMHandler,), {"config": config})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_in_background(config: Optional[FakeLLMConfig] = None, host: str = "127.0.0.1", port: int = 0):
+    """Start a server in a daemon thread; returns (server, base_url)."""
+    server = make_server(host, port, config or FakeLLMConfig())
+    threading.Thread(target=server.serve_forever, name="fake-llm", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--ttft", default="fixed:0.2", help="time to first token (s), e.g. lognormal:0.35,0.4")
+    parser.add_argument("--tokens-per-sec", default="fixed:200", help="generation speed, e.g. normal:250,50")
+    parser.add_argument("--reply-words", type=int, default=60, help="length of default replies")
+    parser.add_argument("--error-429", type=float, default=0.0, help="fraction of calls answered 429")
+    parser.add_argument("--error-5xx", type=float, default=0.0, help="fraction of calls answered 5xx")
+    parser.add_argument("--rpm", type=int, default=0, help="requests per minute per key (0 = unlimited)")
+    parser.add_argument("--tpm", type=int, default=0, help="tokens per minute per key (0 = unlimited)")
+    parser.add_argument("--script", help="JSON file of reply rules")
+    parser.add_argument("--seed", type=int, help="seed for reproducible latencies and errors")
+    args = parser.parse_args(argv)
+
+    config = FakeLLMConfig(
+        ttft=args.ttft,
+        tokens_per_sec=args.tokens_per_sec,
+        reply_words=args.reply_words,
+        error_429=args.error_429,
+        error_5xx=args.error_5xx,
+        rpm=args.rpm,
+        tpm=args.tpm,
+        script=Script.load(args.script) if args.script else None,
+        seed=args.seed,
+    )
+    server = make_server(args.host, args.port, config)
+    print(f"Fake LLM listening on http://{args.host}:{server.server_address[1]}/v1", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
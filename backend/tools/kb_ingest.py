@@ -0,0 +1,554 @@
+"""
+Knowledge base ingestion pipeline.
+
+Streams source documents (.txt, .md, .jsonl, or a JSON list like
+storage/knowledge.json), splits them into overlapping chunks, drops
+near-duplicate chunks (64-bit SimHash), tags each chunk with its topic and
+source, and publishes a new versioned index (chunks, BM25 postings, float32
+vectors) in --index-dir. Point KB_INDEX_DIR at that directory and the API
+loads it at startup; running workers switch to a newly published version
+within KB_RELOAD_INTERVAL seconds.
+
+Re-runs are incremental: sources whose content is unchanged keep their
+chunks and vectors from the live version, and only new or changed files
+are read, chunked and embedded.
+
+    python -m healthbackend.tools.kb_ingest docs/ leaflets.jsonl --index-dir kb_index
+    python -m healthbackend.tools.kb_ingest docs/ --index-dir kb_index --full
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import re
+import shutil
+import sys
+import time
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+import numpy as np
+
+from healthbackend.config.settings import KB_INDEX_DIR, RAG_EMBED_DIM, RAG_INDEX_TYPE, RAG_IVF_NLIST
+from healthbackend.services import kb_artifacts
+from healthbackend.services.ann_index import IVFIndex
+from healthbackend.services.bm25 import BM25Index, tokenize
+from healthbackend.services.embeddings import embed
+
+EXTENSIONS = (".txt", ".md", ".markdown", ".jsonl", ".json")
+
+
+class Paragraph(NamedTuple):
+    # Paragraphs with the same section id are chunked together
+    section: int
+    title: str
+    topic: str
+    text: str
+
+
+# ------------------------------------------------------------
+# Readers (streaming, one paragraph at a time)
+# ------------------------------------------------------------
+def _default_topic(path: str) -> str:
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return re.sub(r"[_\-]+", " ", stem).strip()
+
+
+def read_txt(path: str) -> Iterator[Paragraph]:
+    """Blank-line separated paragraphs; topic and title from the file name."""
+    topic = _default_topic(path)
+    lines: List[str] = []
+    with open(path, encoding="utf-8") as f:
+        for line in itertools.chain(f, [""]):
+            if line.strip():
+                lines.append(line.strip())
+            elif lines:
+                yield Paragraph(0, topic, topic, " ".join(lines))
+                lines = []
+
+
+_MD_HEADING = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+_MD_IMAGE = re.compile(r"!\[[^\]]*\]\([^)]*\)")
+_MD_LINK = re.compile(r"\[([^\]]*)\]\([^)]*\)")
+_MD_LIST = re.compile(r"^\s*(?:[-*+>]|\d+[.)])\s+")
+_MD_EMPHASIS = re.compile(r"[*_`]{1,3}")
+
+
+def _strip_markdown(line: str) -> str:
+    line = _MD_IMAGE.sub("", line)
+    line = _MD_LINK.sub(r"\1", line)
+    line = _MD_LIST.sub("", line)
+    return _MD_EMPHASIS.sub("", line).strip()
+
+
+def read_markdown(path: str) -> Iterator[Paragraph]:
+    """
+    One section per heading: the heading is the chunk title, the first H1
+    (or the file name) the topic. Code blocks are skipped.
+    """
+    topic = _default_topic(path)
+    title = topic
+    section = 0
+    lines: List[str] = []
+    in_code = False
+    with open(path, encoding="utf-8") as f:
+        for raw in itertools.chain(f, [""]):
+            if raw.lstrip().startswith("```"):
+                in_code = not in_code
+                continue
+            if in_code:
+                continue
+            heading = _MD_HEADING.match(raw)
+            if (heading or not raw.strip()) and lines:
+                yield Paragraph(section, title, topic, " ".join(lines))
+                lines = []
+            if heading:
+                title = _strip_markdown(heading.group(2)) or title
+                if len(heading.group(1)) == 1 and section == 0:
+                    topic = title
+                section += 1
+            elif raw.strip():
+                text = _strip_markdown(raw)
+                if text:
+                    lines.append(text)
+
+
+def _record_paragraph(record: Dict[str, Any], index: int, path: str) -> Optional[Paragraph]:
+    text = record.get("content") or record.get("text")
+    if not text:
+        return None
+    title = record.get("title") or _default_topic(path)
+    return Paragraph(index, title, record.get("topic") or title, text)
+
+
+def read_jsonl(path: str) -> Iterator[Paragraph]:
+    """One record per line: "content" (or "text"), optional "title" and "topic"."""
+    with open(path, encoding="utf-8") as f:
+        for index, line in enumerate(f):
+            if line.strip():
+                paragraph = _record_paragraph(json.loads(line), index, path)
+                if paragraph:
+                    yield paragraph
+
+
+def read_json_list(path: str) -> Iterator[Paragraph]:
+    """The hand-edited knowledge.json format: a list of records."""
+    with open(path, encoding="utf-8") as f:
+        records = json.load(f)
+    for index, record in enumerate(records):
+        paragraph = _record_paragraph(record, index, path)
+        if paragraph:
+            yield paragraph
+
+
+READERS = {
+    ".txt": read_txt,
+    ".md": read_markdown,
+    ".markdown": read_markdown,
+    ".jsonl": read_jsonl,
+    ".json": read_json_list,
+}
+
+
+# ------------------------------------------------------------
+# Chunking
+# ------------------------------------------------------------
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def chunk_words(
+    sentences: Iterable[str], max_words: int, overlap_words: int
+) -> Iterator[str]:
+    """
+    Pack whole sentences into chunks of at most `max_words` words; each chunk
+    repeats the trailing sentences (up to `overlap_words` words) of the
+    previous one. Sentences longer than a chunk are split on word boundaries
+    into pieces that leave room for the overlap.
+    """
+    window: List[List[str]] = []
+    count = 0
+    pending = False
+    step = max(max_words - overlap_words, 1)
+    for sentence in sentences:
+        words = sentence.split()
+        size = max_words if len(words) <= max_words else step
+        for start in range(0, len(words), size):
+            piece = words[start : start + size]
+            if pending and count + len(piece) > max_words:
+                yield " ".join(w for part in window for w in part)
+                # Carry the overlap into the next chunk
+                tail: List[List[str]] = []
+                kept = 0
+                for part in reversed(window):
+                    if kept + len(part) > overlap_words:
+                        break
+                    tail.insert(0, part)
+                    kept += len(part)
+                if not tail and overlap_words:
+                    # Last sentence is longer than the overlap: carry its end
+                    tail = [window[-1][-overlap_words:]]
+                    kept = len(tail[0])
+                window, count, pending = tail, kept, False
+                while window and count + len(piece) > max_words:
+                    count -= len(window.pop(0))
+            window.append(piece)
+            count += len(piece)
+            pending = True
+    if pending:
+        yield " ".join(w for part in window for w in part)
+
+
+def chunk_paragraphs(
+    paragraphs: Iterable[Paragraph], max_words: int, overlap_words: int
+) -> Iterator[Tuple[str, str, str]]:
+    """(title, topic, content) chunks; chunks never span sections."""
+    for _, group in itertools.groupby(paragraphs, key=lambda p: (p.section, p.title, p.topic)):
+        first = next(group)
+        sentences = (
+            sentence
+            for paragraph in itertools.chain([first], group)
+            for sentence in _SENTENCE_END.split(paragraph.text)
+            if sentence.strip()
+        )
+        for content in chunk_words(sentences, max_words, overlap_words):
+            yield first.title, first.topic, content
+
+
+# ------------------------------------------------------------
+# Near-duplicate detection
+# ------------------------------------------------------------
+def simhash(text: str) -> int:
+    """64-bit SimHash over word 3-shingles (stopwords removed)."""
+    words = tokenize(text)
+    shingles = [" ".join(words[i : i + 3]) for i in range(max(len(words) - 2, 1))]
+    hashes = np.array(
+        [int.from_bytes(hashlib.md5(s.encode("utf-8")).digest()[:8], "little") for s in shingles],
+        dtype=np.uint64,
+    )
+    bits = np.unpackbits(hashes.view(np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+    votes = bits.sum(axis=0, dtype=np.int64) * 2 - len(shingles)
+    return int.from_bytes(np.packbits(votes > 0, bitorder="little").tobytes(), "little")
+
+
+class NearDuplicateIndex:
+    """
+    Finds stored fingerprints within `max_distance` bits of a new one.
+
+    Fingerprints are split into `max_distance + 1` bands; two fingerprints
+    that close must agree on at least one whole band, so only fingerprints
+    sharing a band are compared.
+    """
+
+    def __init__(self, max_distance: int):
+        self.max_distance = max_distance
+        bands = max_distance + 1
+        width = 64 // bands
+        self._bands = [
+            (i * width, 64 - i * width if i == bands - 1 else width) for i in range(bands)
+        ]
+        self._buckets: Dict[Tuple[int, int], List[Tuple[int, str]]] = {}
+
+    def _keys(self, fingerprint: int) -> Iterator[Tuple[int, int]]:
+        for band, (shift, width) in enumerate(self._bands):
+            yield band, (fingerprint >> shift) & ((1 << width) - 1)
+
+    def find(self, fingerprint: int) -> Optional[str]:
+        """Source of a near-identical chunk already added, if any."""
+        for key in self._keys(fingerprint):
+            for other, source in self._buckets.get(key, ()):
+                if bin(fingerprint ^ other).count("1") <= self.max_distance:
+                    return source
+        return None
+
+    def add(self, fingerprint: int, source: str) -> None:
+        for key in self._keys(fingerprint):
+            self._buckets.setdefault(key, []).append((fingerprint, source))
+
+
+# ------------------------------------------------------------
+# Sources
+# ------------------------------------------------------------
+def discover(paths: Iterable[str]) -> List[Tuple[str, str]]:
+    """
+    (source key, file path) for every supported file, in a stable order.
+    Keys do not depend on the working directory: "<dir name>/<path in dir>"
+    for files found under a directory argument, the file name otherwise.
+    """
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            base = os.path.basename(os.path.abspath(path))
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(EXTENSIONS):
+                        file_path = os.path.join(root, name)
+                        key = os.path.join(base, os.path.relpath(file_path, path))
+                        found.append((key.replace(os.sep, "/"), file_path))
+        elif path.lower().endswith(EXTENSIONS):
+            found.append((os.path.basename(path), path))
+        else:
+            raise SystemExit(f"unsupported source: {path}")
+    return found
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# ------------------------------------------------------------
+# Build
+# ------------------------------------------------------------
+def ingest(
+    paths: List[str],
+    index_dir: str,
+    max_words: int = 120,
+    overlap_words: int = 30,
+    dim: int = RAG_EMBED_DIM,
+    dedupe_distance: int = 3,
+    full: bool = False,
+    keep: int = 3,
+    ivf: bool = False,
+    ivf_nlist: int = 0,
+) -> Dict[str, Any]:
+    """Build (or incrementally update) the index; returns a summary."""
+    started = time.monotonic()
+    params = {
+        "max_words": max_words,
+        "overlap_words": overlap_words,
+        "dim": dim,
+        "dedupe_distance": dedupe_distance,
+    }
+    os.makedirs(index_dir, exist_ok=True)
+    previous = kb_artifacts.current_version(index_dir)
+    old_sources: Dict[str, Dict[str, Any]] = {}
+    if previous and not full:
+        manifest = kb_artifacts.read_manifest(index_dir, previous)
+        # Different chunking or vectors: nothing can be reused
+        if manifest.get("format") == kb_artifacts.FORMAT_VERSION and manifest.get("params") == params:
+            old_sources = manifest["sources"]
+
+    # Which sources changed (size/mtime first, content hash to confirm)
+    sources: Dict[str, Dict[str, Any]] = {}
+    dirty: Set[str] = set()
+    files = discover(paths)
+    for key, path in files:
+        stat = os.stat(path)
+        old = old_sources.get(key)
+        entry = {"path": path, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        if old and (old["size"], old["mtime_ns"]) == (stat.st_size, stat.st_mtime_ns):
+            entry["sha256"] = old["sha256"]
+        else:
+            entry["sha256"] = file_sha256(path)
+            if not old or old["sha256"] != entry["sha256"]:
+                dirty.add(key)
+        sources[key] = entry
+    removed = set(old_sources) - set(sources)
+
+    # A reused source whose chunks were dropped as duplicates of a changed or
+    # removed source must be re-read, or that content would disappear
+    changed = True
+    while changed:
+        changed = False
+        for key in sources:
+            if key not in dirty and key in old_sources:
+                if set(old_sources[key].get("dupes_of", ())) & (dirty | removed):
+                    dirty.add(key)
+                    changed = True
+
+    ivf_missing = ivf and previous and not os.path.exists(
+        os.path.join(kb_artifacts.version_path(index_dir, previous, f"ivf-{ivf_nlist or 'auto'}"), "meta.json")
+    )
+    if previous and old_sources and not dirty and not removed and not ivf_missing:
+        return {"version": previous, "status": "up to date", "sources": len(sources)}
+
+    staging = kb_artifacts.staging_path(index_dir)
+    try:
+        summary = _write_version(
+            index_dir, staging, previous if old_sources else None,
+            sources, old_sources, dirty, params,
+        )
+        if ivf:
+            summary["ivf"] = _build_ivf(index_dir, staging, None if full else previous, ivf_nlist)
+        version = kb_artifacts.publish_version(index_dir, staging)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    pruned = kb_artifacts.prune_versions(index_dir, keep)
+    summary.update(
+        version=version,
+        status="published",
+        removed_sources=len(removed),
+        pruned_versions=pruned,
+        seconds=round(time.monotonic() - started, 2),
+    )
+    return summary
+
+
+def _write_version(
+    index_dir: str,
+    staging: str,
+    previous: Optional[str],
+    sources: Dict[str, Dict[str, Any]],
+    old_sources: Dict[str, Dict[str, Any]],
+    dirty: Set[str],
+    params: Dict[str, Any],
+) -> Dict[str, Any]:
+    dim = params["dim"]
+    dedupe = NearDuplicateIndex(params["dedupe_distance"])
+    vectors = kb_artifacts.VectorWriter(os.path.join(staging, kb_artifacts.VECTORS_FILE), dim)
+    counts = {"reused_sources": 0, "ingested_sources": 0, "duplicates_dropped": 0}
+    manifest_sources: Dict[str, Dict[str, Any]] = {}
+
+    with open(os.path.join(staging, kb_artifacts.CHUNKS_FILE), "w", encoding="utf-8") as out:
+
+        def write_chunk(record: Dict[str, Any], vector: np.ndarray) -> None:
+            entry = manifest_sources[record["source"]]
+            if entry["count"] == 0:
+                entry["first"] = vectors.rows
+            entry["count"] += 1
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            vectors.append(vector)
+
+        # 1) Unchanged sources: copy chunks and vector rows from the live version
+        reuse = {key for key in sources if key not in dirty and key in old_sources}
+        for key in reuse:
+            manifest_sources[key] = _source_entry(sources[key], old_sources[key].get("dupes_of", []))
+            manifest_sources[key]["dropped"] = old_sources[key].get("dropped", 0)
+        if previous and reuse:
+            old_vectors = kb_artifacts.open_vectors(index_dir, previous)
+            for row, record in enumerate(kb_artifacts.iter_chunks(index_dir, previous)):
+                if record["source"] in reuse:
+                    dedupe.add(int(record["simhash"], 16), record["source"])
+                    write_chunk(record, old_vectors[row])
+            del old_vectors
+        counts["reused_sources"] = len(reuse)
+
+        # 2) New and changed sources: read, chunk, dedupe, embed
+        for key, info in sources.items():
+            if key in reuse:
+                continue
+            entry = manifest_sources[key] = _source_entry(info, [])
+            reader = READERS[os.path.splitext(info["path"])[1].lower()]
+            paragraphs = reader(info["path"])
+            for number, (title, topic, content) in enumerate(
+                chunk_paragraphs(paragraphs, params["max_words"], params["overlap_words"])
+            ):
+                fingerprint = simhash(content)
+                twin = dedupe.find(fingerprint)
+                if twin is not None:
+                    entry["dropped"] += 1
+                    if twin != key and twin not in entry["dupes_of"]:
+                        entry["dupes_of"].append(twin)
+                    counts["duplicates_dropped"] += 1
+                    continue
+                dedupe.add(fingerprint, key)
+                record = {
+                    "title": title,
+                    "content": content,
+                    "topic": topic,
+                    "source": key,
+                    "chunk": number,
+                    "simhash": f"{fingerprint:016x}",
+                }
+                write_chunk(record, embed(f"{title} {content}", dim))
+            counts["ingested_sources"] += 1
+
+    vectors.close()
+    # Postings are rebuilt over all chunks: tokenizing is cheap next to
+    # parsing and embedding, and BM25 statistics are corpus-wide anyway
+    staged = (os.path.dirname(staging), os.path.basename(staging))
+    lexical = BM25Index.build(f"{c['title']} {c['content']}" for c in kb_artifacts.iter_chunks(*staged))
+    with open(os.path.join(staging, kb_artifacts.LEXICAL_FILE), "w", encoding="utf-8") as f:
+        json.dump(lexical.to_dict(), f, separators=(",", ":"))
+
+    manifest = {
+        "format": kb_artifacts.FORMAT_VERSION,
+        "created_at": time.time(),
+        "params": params,
+        "chunks": vectors.rows,
+        "sources": manifest_sources,
+    }
+    with open(os.path.join(staging, kb_artifacts.MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return {**counts, "chunks": vectors.rows, "sources": len(sources)}
+
+
+def _build_ivf(index_dir: str, staging: str, previous: Optional[str], nlist: int) -> Dict[str, Any]:
+    """
+    Prebuild the IVF index the API would otherwise train at startup. The live
+    version's centroids are reused (vectors only re-assigned) while the corpus
+    stays within 2x of the size they were trained on.
+    """
+    name = f"ivf-{nlist or 'auto'}"
+    vectors = np.load(os.path.join(staging, kb_artifacts.VECTORS_FILE), mmap_mode="r")
+    if not len(vectors):
+        return {"built": False}
+    old_path = kb_artifacts.version_path(index_dir, previous, name) if previous else ""
+    index = None
+    if old_path and os.path.exists(os.path.join(old_path, "meta.json")):
+        old = IVFIndex.open(old_path)
+        if old.dim == vectors.shape[1] and old.trained_on / 2 <= len(vectors) <= old.trained_on * 2:
+            index = IVFIndex.from_centroids(old.centroids, vectors, trained_on=old.trained_on)
+    retrained = index is None
+    if retrained:
+        index = IVFIndex.train(vectors, nlist)
+    index.save(os.path.join(staging, name))
+    return {"built": True, "nlist": index.nlist, "retrained": retrained}
+
+
+def _source_entry(info: Dict[str, Any], dupes_of: List[str]) -> Dict[str, Any]:
+    return {
+        "sha256": info["sha256"],
+        "size": info["size"],
+        "mtime_ns": info["mtime_ns"],
+        "first": 0,
+        "count": 0,
+        "dropped": 0,
+        "dupes_of": list(dupes_of),
+    }
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("sources", nargs="+", help="files or directories (.txt, .md, .jsonl, .json)")
+    parser.add_argument("--index-dir", default=KB_INDEX_DIR or None, help="output (default: KB_INDEX_DIR)")
+    parser.add_argument("--chunk-words", type=int, default=120, help="maximum words per chunk")
+    parser.add_argument("--overlap-words", type=int, default=30, help="words repeated between chunks")
+    parser.add_argument("--dim", type=int, default=RAG_EMBED_DIM, help="vector dimensions")
+    parser.add_argument("--dedupe-distance", type=int, default=3, help="max SimHash bit difference of duplicates")
+    parser.add_argument("--full", action="store_true", help="re-ingest every source")
+    parser.add_argument("--keep", type=int, default=3, help="versions to keep on disk")
+    parser.add_argument(
+        "--ivf", action=argparse.BooleanOptionalAction, default=RAG_INDEX_TYPE == "ivf",
+        help="prebuild the IVF ANN index (default: on when RAG_INDEX_TYPE=ivf)",
+    )
+    parser.add_argument("--ivf-nlist", type=int, default=RAG_IVF_NLIST, help="IVF lists (0 = auto)")
+    args = parser.parse_args(argv)
+    if not args.index_dir:
+        parser.error("--index-dir is required when KB_INDEX_DIR is not set")
+    if not 0 <= args.overlap_words < args.chunk_words:
+        parser.error("--overlap-words must be smaller than --chunk-words")
+
+    summary = ingest(
+        args.sources,
+        args.index_dir,
+        max_words=args.chunk_words,
+        overlap_words=args.overlap_words,
+        dim=args.dim,
+        dedupe_distance=args.dedupe_distance,
+        full=args.full,
+        keep=args.keep,
+        ivf=args.ivf,
+        ivf_nlist=args.ivf_nlist,
+    )
+    json.dump(summary, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
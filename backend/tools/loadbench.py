@@ -0,0 +1,475 @@
+"""
+End-to-end load benchmark for the HTTP API.
+
+Drives /health-assist, /chat_stream, /follow-up, /history/<user_id> and
+/youtube-recommendations, one endpoint per phase, with a fixed number of
+concurrent clients, and reports throughput, p50/p95/p99 latency, time to
+first SSE event and error rates. Results are saved as JSON so runs can be
+compared across commits.
+
+Self-contained run (local fake LLM + the app in this process, in a scratch
+working directory so no real history or key-pool state is touched):
+    python -m healthbackend.tools.loadbench --local --concurrency 16 --duration 20 \\
+        --out bench/$(git rev-parse --short HEAD).json
+
+Against a running server (start it with LLM_BASE_URL pointing at
+fake_llm_server to keep Groq out of the measurement):
+    python -m healthbackend.tools.loadbench --base-url http://127.0.0.1:8000
+
+Compare two runs:
+    python -m healthbackend.tools.loadbench --compare bench/old.json bench/new.json
+
+With --no-cache every symptom query gets a unique case tag, so neither the
+result cache nor the LLM memo (which /chat_stream goes through too) can
+answer it; --local also starts the app with LLM_MEMO_ENABLED=0.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+ENDPOINTS = ("health-assist", "chat_stream", "follow-up", "history", "youtube")
+
+SYMPTOMS = [
+    "mild fever and sore throat since yesterday",
+    "headache and tiredness after long screen time",
+    "dry cough at night and runny nose",
+    "stomach ache and bloating after meals",
+    "lower back pain from sitting all day",
+    "trouble sleeping and feeling stressed",
+    "seasonal allergies with sneezing and itchy eyes",
+    "muscle soreness after starting a new workout",
+    "feeling dizzy when standing up quickly",
+    "low energy and frequent headaches in the afternoon",
+]
+
+QUESTIONS = [
+    "Can I still exercise this week?",
+    "What should I eat for dinner?",
+    "How much water should I drink?",
+    "When should I see a doctor?",
+]
+
+
+# ------------------------------------------------------------
+# Statistics
+# ------------------------------------------------------------
+def percentile(sorted_values: List[float], pct: float) -> Optional[float]:
+    """Linear-interpolated percentile of an already sorted list (None if empty)."""
+    if not sorted_values:
+        return None
+    pos = (len(sorted_values) - 1) * pct / 100.0
+    lo = int(pos)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (pos - lo)
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return None if seconds is None else round(seconds * 1000.0, 2)
+
+
+class PhaseStats:
+    """Thread-safe samples of one endpoint phase."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies: List[float] = []
+        self.first_event: List[float] = []
+        self.errors: Dict[str, int] = {}
+        self.requests = 0
+
+    def record(self, latency: float, error: Optional[str], first_event: Optional[float] = None):
+        with self._lock:
+            self.requests += 1
+            if error is not None:
+                self.errors[error] = self.errors.get(error, 0) + 1
+                return
+            self.latencies.append(latency)
+            if first_event is not None:
+                self.first_event.append(first_event)
+
+    def summary(self, wall_seconds: float) -> Dict[str, Any]:
+        latencies = sorted(self.latencies)
+        first = sorted(self.first_event)
+        errors = sum(self.errors.values())
+        result = {
+            "requests": self.requests,
+            "ok": len(latencies),
+            "errors": errors,
+            "error_rate": round(errors / self.requests, 4) if self.requests else 0.0,
+            "errors_by_kind": dict(sorted(self.errors.items())),
+            "throughput_rps": round(len(latencies) / wall_seconds, 3) if wall_seconds else 0.0,
+            "wall_seconds": round(wall_seconds, 3),
+            "latency_ms": {
+                "mean": _ms(sum(latencies) / len(latencies)) if latencies else None,
+                "p50": _ms(percentile(latencies, 50)),
+                "p95": _ms(percentile(latencies, 95)),
+                "p99": _ms(percentile(latencies, 99)),
+                "max": _ms(latencies[-1]) if latencies else None,
+            },
+        }
+        if first:
+            result["first_event_ms"] = {
+                "p50": _ms(percentile(first, 50)),
+                "p95": _ms(percentile(first, 95)),
+                "p99": _ms(percentile(first, 99)),
+            }
+        return result
+
+
+# ------------------------------------------------------------
+# Requests
+# ------------------------------------------------------------
+# Each returns (error or None, time to first SSE event or None)
+Request = Callable[[httpx.Client, str, random.Random], Tuple[Optional[str], Optional[float]]]
+
+
+def _status_error(response: httpx.Response) -> Optional[str]:
+    return None if response.status_code == 200 else f"http_{response.status_code}"
+
+
+def _symptoms(rng: random.Random, no_cache: bool) -> str:
+    symptoms = rng.choice(SYMPTOMS)
+    if no_cache:
+        # A fresh prompt for every request: no memo or near-duplicate hits
+        symptoms += f" (case {rng.getrandbits(48):012x})"
+    return symptoms
+
+
+def _health_assist(no_cache: bool) -> Request:
+    def run(client, user, rng):
+        body = {"symptoms": _symptoms(rng, no_cache), "user_id": user, "no_cache": no_cache}
+        return _status_error(client.post("/health-assist", json=body)), None
+
+    return run
+
+
+def _chat_stream(no_cache: bool) -> Request:
+    def run(client, user, rng):
+        body = {"symptoms": _symptoms(rng, no_cache), "no_cache": no_cache}
+        started = time.perf_counter()
+        first_event = None
+        events = 0
+        with client.stream("POST", "/chat_stream", json=body) as response:
+            if response.status_code != 200:
+                return f"http_{response.status_code}", None
+            for line in response.iter_lines():
+                if not line.startswith("data:"):
+                    continue
+                if first_event is None:
+                    first_event = time.perf_counter() - started
+                events += 1
+                if json.loads(line[5:]).get("type") == "error":
+                    return "stream_error_event", None
+        if not events:
+            return "empty_stream", None
+        return None, first_event
+
+    return run
+
+
+def _follow_up(client, user, rng):
+    body = {"user_id": user, "question": rng.choice(QUESTIONS)}
+    return _status_error(client.post("/follow-up", json=body)), None
+
+
+def _history(client, user, rng):
+    return _status_error(client.get(f"/history/{user}")), None
+
+
+def _youtube(client, user, rng):
+    body = {"symptom": rng.choice(SYMPTOMS).split(" and ")[0], "max_videos": 4}
+    return _status_error(client.post("/youtube-recommendations", json=body)), None
+
+
+def _request_for(endpoint: str, no_cache: bool) -> Request:
+    return {
+        "health-assist": _health_assist(no_cache),
+        "chat_stream": _chat_stream(no_cache),
+        "follow-up": _follow_up,
+        "history": _history,
+        "youtube": _youtube,
+    }[endpoint]
+
+
+# ------------------------------------------------------------
+# Phases
+# ------------------------------------------------------------
+def run_phase(
+    base_url: str,
+    endpoint: str,
+    concurrency: int,
+    duration: float,
+    max_requests: Optional[int],
+    warmup: int,
+    no_cache: bool,
+    seed: int,
+    timeout: float,
+) -> Dict[str, Any]:
+    """Closed loop: `concurrency` clients send back-to-back requests until time/count is up."""
+    request = _request_for(endpoint, no_cache)
+    stats = PhaseStats()
+    budget = {"left": max_requests}
+    budget_lock = threading.Lock()
+
+    def take() -> bool:
+        with budget_lock:
+            if budget["left"] is None:
+                return True
+            if budget["left"] <= 0:
+                return False
+            budget["left"] -= 1
+            return True
+
+    def worker(index: int, deadline_holder: List[float]):
+        rng = random.Random(f"{seed}:{endpoint}:{index}")
+        user = f"bench-user-{index}"
+        with httpx.Client(base_url=base_url, timeout=timeout) as client:
+            for _ in range(warmup):
+                _safe_call(request, client, user, rng)
+            barrier.wait()
+            while time.perf_counter() < deadline_holder[0] and take():
+                started = time.perf_counter()
+                error, first_event = _safe_call(request, client, user, rng)
+                stats.record(time.perf_counter() - started, error, first_event)
+
+    barrier = threading.Barrier(concurrency + 1)
+    deadline_holder = [float("inf")]
+    threads = [
+        threading.Thread(target=worker, args=(i, deadline_holder), daemon=True)
+        for i in range(concurrency)
+    ]
+    for t in threads:
+        t.start()
+    barrier.wait()  # every client finished its warm-up
+    started = time.perf_counter()
+    deadline_holder[0] = started + duration if max_requests is None else float("inf")
+    for t in threads:
+        t.join()
+    return stats.summary(time.perf_counter() - started)
+
+
+def _safe_call(request: Request, client, user, rng) -> Tuple[Optional[str], Optional[float]]:
+    try:
+        return request(client, user, rng)
+    except httpx.TimeoutException:
+        return "timeout", None
+    except httpx.HTTPError as e:
+        return type(e).__name__, None
+
+
+def seed_users(base_url: str, concurrency: int, timeout: float) -> None:
+    # /follow-up and /history need a previous consultation per user
+    with httpx.Client(base_url=base_url, timeout=timeout) as client:
+        for i in range(concurrency):
+            client.post(
+                "/health-assist",
+                json={"symptoms": SYMPTOMS[i % len(SYMPTOMS)], "user_id": f"bench-user-{i}"},
+            )
+
+
+# ------------------------------------------------------------
+# Local stack: fake LLM + app in this process
+# ------------------------------------------------------------
+def start_local_stack(args) -> str:
+    """Start fake_llm_server and the app on free ports; returns the app's base URL."""
+    from healthbackend.tools.fake_llm_server import FakeLLMConfig, start_in_background
+
+    _, llm_url = start_in_background(
+        FakeLLMConfig(
+            ttft=args.llm_ttft,
+            tokens_per_sec=args.llm_tokens_per_sec,
+            error_429=args.llm_error_429,
+            error_5xx=args.llm_error_5xx,
+            seed=args.seed,
+        )
+    )
+    # Settings are read at import time, so configure before importing the app
+    os.environ["LLM_BASE_URL"] = llm_url
+    os.environ.setdefault("GROQ_API_KEY", ",".join(f"bench-key-{i}" for i in range(4)))
+    os.environ.setdefault("LLM_PREWARM", "0")
+    if args.no_cache:
+        # Otherwise repeated agent prompts are answered from the disk memo
+        os.environ["LLM_MEMO_ENABLED"] = "0"
+    # Relative storage paths (history, key pool, jobs) land in a scratch dir
+    workdir = args.workdir or tempfile.mkdtemp(prefix="loadbench-")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+
+    if args.server == "asgi":
+        import uvicorn
+
+        from healthbackend.asgi import app
+
+        config = uvicorn.Config(app, host="127.0.0.1", port=args.port, log_level="warning")
+        server = uvicorn.Server(config)
+        threading.Thread(target=server.run, name="bench-asgi", daemon=True).start()
+        while not server.started:
+            time.sleep(0.05)
+        port = server.servers[0].sockets[0].getsockname()[1]
+    else:
+        from werkzeug.serving import make_server
+
+        from healthbackend.app import app
+
+        server = make_server("127.0.0.1", args.port, app, threaded=True)
+        threading.Thread(target=server.serve_forever, name="bench-wsgi", daemon=True).start()
+        port = server.server_port
+    return f"http://127.0.0.1:{port}"
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            timeout=10,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+# ------------------------------------------------------------
+# Reporting
+# ------------------------------------------------------------
+def _fmt(value) -> str:
+    return "-" if value is None else f"{value:.1f}"
+
+
+def print_report(results: Dict[str, Any]) -> None:
+    header = f"{'endpoint':<14}{'req':>7}{'err%':>7}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'ttfe50':>9}{'ttfe95':>9}"
+    print(header)
+    print("-" * len(header))
+    for name, s in results["endpoints"].items():
+        lat = s["latency_ms"]
+        first = s.get("first_event_ms", {})
+        print(
+            f"{name:<14}{s['requests']:>7}{s['error_rate'] * 100:>7.1f}{s['throughput_rps']:>9.2f}"
+            f"{_fmt(lat['p50']):>9}{_fmt(lat['p95']):>9}{_fmt(lat['p99']):>9}"
+            f"{_fmt(first.get('p50')):>9}{_fmt(first.get('p95')):>9}"
+        )
+    print("(latencies in ms; ttfe = time to first SSE event)")
+
+
+def _change(old, new) -> str:
+    if old is None or new is None:
+        return "-"
+    if old == 0:
+        return "n/a" if new else "0%"
+    return f"{(new - old) / old * 100:+.1f}%"
+
+
+def compare(old_path: str, new_path: str) -> None:
+    """Print per-endpoint deltas between two saved runs (new vs old)."""
+    with open(old_path, "r", encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, "r", encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"old: {old['meta'].get('git_commit')} {old['meta']['started_at']}")
+    print(f"new: {new['meta'].get('git_commit')} {new['meta']['started_at']}")
+    metrics = [
+        ("rps", lambda s: s["throughput_rps"]),
+        ("err%", lambda s: s["error_rate"] * 100),
+        ("p50", lambda s: s["latency_ms"]["p50"]),
+        ("p95", lambda s: s["latency_ms"]["p95"]),
+        ("p99", lambda s: s["latency_ms"]["p99"]),
+        ("ttfe50", lambda s: s.get("first_event_ms", {}).get("p50")),
+        ("ttfe95", lambda s: s.get("first_event_ms", {}).get("p95")),
+    ]
+    print(f"{'endpoint':<14}{'metric':<8}{'old':>10}{'new':>10}{'change':>10}")
+    for name, new_stats in new["endpoints"].items():
+        old_stats = old["endpoints"].get(name)
+        if old_stats is None:
+            continue
+        for label, get in metrics:
+            a, b = get(old_stats), get(new_stats)
+            if a is None and b is None:
+                continue
+            print(f"{name:<14}{label:<8}{_fmt(a):>10}{_fmt(b):>10}{_change(a, b):>10}")
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--base-url", default="http://127.0.0.1:5000")
+    parser.add_argument("--local", action="store_true", help="start fake LLM + app in-process")
+    parser.add_argument("--server", choices=("flask", "asgi"), default="flask", help="app served by --local")
+    parser.add_argument("--port", type=int, default=0, help="port for --local (0 = free port)")
+    parser.add_argument("--workdir", help="working directory for --local (default: a temp dir)")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS))
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=15.0, help="seconds per endpoint")
+    parser.add_argument("--requests", type=int, help="requests per endpoint (instead of --duration)")
+    parser.add_argument("--warmup", type=int, default=1, help="unmeasured requests per client")
+    parser.add_argument(
+        "--no-cache", action="store_true", help="bypass the result cache and the LLM memo"
+    )
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--llm-ttft", default="lognormal:0.3,0.4")
+    parser.add_argument("--llm-tokens-per-sec", default="normal:250,40")
+    parser.add_argument("--llm-error-429", type=float, default=0.0)
+    parser.add_argument("--llm-error-5xx", type=float, default=0.0)
+    parser.add_argument("--out", help="write JSON results here")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    endpoints = [e.strip() for e in args.endpoints.split(",") if e.strip()]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(sorted(unknown))}")
+
+    out_path = os.path.abspath(args.out) if args.out else None
+    base_url = start_local_stack(args) if args.local else args.base_url.rstrip("/")
+    if {"follow-up", "history"} & set(endpoints):
+        seed_users(base_url, args.concurrency, args.timeout)
+
+    results: Dict[str, Any] = {
+        "meta": {
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "base_url": base_url,
+            "args": {k: v for k, v in vars(args).items() if k not in ("compare", "out")},
+        },
+        "endpoints": {},
+    }
+    for endpoint in endpoints:
+        print(f"running {endpoint} ...", file=sys.stderr, flush=True)
+        results["endpoints"][endpoint] = run_phase(
+            base_url,
+            endpoint,
+            args.concurrency,
+            args.duration,
+            args.requests,
+            args.warmup,
+            args.no_cache,
+            args.seed,
+            args.timeout,
+        )
+
+    print_report(results)
+    if out_path:
+        os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+        with open(out_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"results written to {out_path}")
+
+
+if __name__ == "__main__":
+    main()
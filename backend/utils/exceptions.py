@@ -6,3 +6,9 @@ class AgentError(Exception):
 
 class InputError(Exception):
     pass
+
+class OverloadError(Exception):
+    def __init__(self, message, retry_after=None, status_code=503):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.status_code = status_code
@@ -0,0 +1,30 @@
+import os
+import uuid
+
+_worker_id = None
+_worker_pid = None
+
+
+def pid_alive(pid: int) -> bool:
+    """True if a process with this id exists on this machine."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Exists but belongs to another user
+        return True
+    return True
+
+
+def worker_id() -> str:
+    """
+    Random id of this worker process, new in every process (forked children
+    included). Unlike a pid it is never reused after a restart, so state
+    tagged with it cannot be mistaken for a new process's.
+    """
+    global _worker_id, _worker_pid
+    if _worker_id is None or _worker_pid != os.getpid():
+        _worker_id = uuid.uuid4().hex
+        _worker_pid = os.getpid()
+    return _worker_id
@@ -0,0 +1,45 @@
+import logging
+import re
+import uuid
+from contextvars import ContextVar
+from typing import Optional
+
+HEADER = "X-Request-ID"
+
+_request_id: ContextVar[str] = ContextVar("request_id", default="-")
+# Accept client-supplied ids only if they are short and log-safe
+_VALID = re.compile(r"^[A-Za-z0-9._:-]{1,128}$")
+_installed = False
+
+
+def get_request_id() -> str:
+    """The current request's id ("-" outside a request)."""
+    return _request_id.get()
+
+
+def set_request_id(value: Optional[str] = None) -> str:
+    """
+    Bind a request id to the current context and return it.
+
+    Uses the client's `X-Request-ID` when it is valid, otherwise a new id.
+    Work scheduled from this context (tasks, the background loop) inherits it.
+    """
+    request_id = value if value and _VALID.match(value) else uuid.uuid4().hex
+    _request_id.set(request_id)
+    return request_id
+
+
+def install_log_record_factory() -> None:
+    """Give every log record a `request_id` attribute, for use in log formats."""
+    global _installed
+    if _installed:
+        return
+    previous = logging.getLogRecordFactory()
+
+    def factory(*args, **kwargs):
+        record = previous(*args, **kwargs)
+        record.request_id = _request_id.get()
+        return record
+
+    logging.setLogRecordFactory(factory)
+    _installed = True
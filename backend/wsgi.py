@@ -1,4 +1,23 @@
 from healthbackend.app import app
+from healthbackend.config.settings import LLM_PREWARM
+from healthbackend.services.api_key_pool import get_next_key
+from healthbackend.services.intent import warm_intent_model
+from healthbackend.services.jobs import resume_orphaned_jobs
+from healthbackend.services.llm_clients import prewarm_connections
+from healthbackend.services.rag import knowledge_base
+
+# Each gunicorn worker imports this module, so warm its own connection pool
+if LLM_PREWARM:
+    prewarm_connections(get_next_key())
+
+# Load the knowledge base index now rather than on the first request
+knowledge_base.snapshot()
+
+# Same for the local intent model (later retrains run in the background)
+warm_intent_model()
+
+# Pick up health-assist jobs a previous (crashed or restarted) worker left unfinished
+resume_orphaned_jobs(force=True)
 
 if __name__ == "__main__":
     app.run()
@@ -42,6 +42,7 @@ function WellnessPage({ userId, userName, onLogout }) {
   // streaming state
   const [thoughts, setThoughts] = useState([]);
   const [streamAnswer, setStreamAnswer] = useState("");
+  const [agentDrafts, setAgentDrafts] = useState({});
   const [streamLoading, setStreamLoading] = useState(false);
 
   const resetOutputs = () => {
@@ -118,6 +119,7 @@ function WellnessPage({ userId, userName, onLogout }) {
     setShowAgentFlow(false);
     setAgentLogs([]);
     setThoughts([]);
+    setAgentDrafts({});
     setStreamAnswer("");
     setStreamLoading(true);
 
@@ -131,15 +133,26 @@ function WellnessPage({ userId, userName, onLogout }) {
         }),
       });
 
+      if (!res.ok) {
+        // Rejected before streaming started (off-topic, missing symptoms, busy)
+        const data = await res.json().catch(() => ({}));
+        setStatus(data.error || "Something went wrong. Please try again.");
+        return;
+      }
+
       const reader = res.body.getReader();
       const decoder = new TextDecoder();
+      let buffer = "";
+      let streamError = "";
 
       while (true) {
         const { done, value } = await reader.read();
         if (done) break;
 
-        const chunk = decoder.decode(value);
-        const lines = chunk.split("\n\n");
+        // Events can be split across network chunks: keep the partial tail
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split("\n\n");
+        buffer = lines.pop();
 
         lines.forEach((line) => {
           if (!line.startsWith("data: ")) return;
@@ -149,18 +162,27 @@ function WellnessPage({ userId, userName, onLogout }) {
 
             if (evt.type === "thought") {
               setThoughts((prev) => [...prev, evt.content]);
+            } else if (evt.type === "agent_token") {
+              // live per-agent output while the agent is still generating
+              setAgentDrafts((prev) => ({
+                ...prev,
+                [evt.agent]: (prev[evt.agent] || "") + evt.content,
+              }));
             } else if (evt.type === "answer") {
               // append streaming markdown
               setStreamAnswer((prev) => prev + evt.content);
               // mirror into summary so the wellness card updates live
               setSummary((prev) => prev + evt.content);
+            } else if (evt.type === "error") {
+              // e.g. off-topic query: the agents were stopped, show why
+              streamError = evt.content;
             }
           } catch (err) {
             console.error("Stream parse error", err);
           }
         });
       }
-      setStatus("");
+      setStatus(streamError);
     } catch (err) {
       setStatus(`Error while streaming: ${err.message}`);
     } finally {
@@ -667,6 +689,12 @@ function WellnessPage({ userId, userName, onLogout }) {
                           <strong>Step {idx + 1}:</strong> {t}
                         </div>
                       ))}
+                      {Object.entries(agentDrafts).map(([agent, text]) => (
+                        <div key={agent} className="text-gray-600">
+                          <strong>{agent}:</strong>{" "}
+                          <span className="whitespace-pre-wrap">{text}</span>
+                        </div>
+                      ))}
                       {streamLoading && (
                         <div className="text-gray-500">
                           Agents collaborating…